@@ -0,0 +1,123 @@
+import re
+import unicodedata
+from html import unescape
+from typing import List, Optional, Set, Tuple
+
+from links import APPLE_ALBUM_TRACK_RE, APPLE_SONG_RE
+
+APPLE_URL_IN_HTML_RE = re.compile(r"https?://music\.apple\.com/[^\s\"'<>]+")
+# "(feat. X)", "[Live]", "- Remastered 2011" and the like never appear in slugs.
+TITLE_NOISE_RE = re.compile(r"\s*[\(\[].*?[\)\]]|\s+-\s+.*$")
+NON_ALNUM_RE = re.compile(r"[^a-z0-9]+")
+APPLE_SLUG_RE = re.compile(r"music\.apple\.com/[a-z]{2}/(?:song|album)/([^/?\s]+)/\d+")
+TAG_RE = re.compile(r"<[^>]+>")
+# The next result starts at the next list item or the next Apple link.
+RESULT_END_RE = re.compile(r"<li[\s>]|https?://music\.apple\.com/", re.IGNORECASE)
+
+MAX_URL_CHARS = 512
+
+
+def slug_tokens(text: str) -> Set[str]:
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c)).lower()
+    return {t for t in NON_ALNUM_RE.split(text) if t}
+
+
+def _overlap(wanted: Set[str], found: Set[str]) -> float:
+    return len(wanted & found) / len(wanted) if wanted else 0.0
+
+
+# ============================================================
+# STREAMING APPLE MUSIC CANDIDATE SCAN
+# ============================================================
+
+class AppleCandidateScanner:
+    """Finds Apple Music track links in a search results page fed to it
+    chunk by chunk.
+
+    Only track-level links (/song/ or album links with ?i=) count. Each is
+    scored by how many title words appear in its slug and how many artist
+    words appear in the text that follows it, which on a results page is
+    the result's title and snippet; a link with no artist word is
+    skipped. feed() returns True once the page has
+    yielded enough track links, or an exact match, to stop reading."""
+
+    def __init__(self, title: str, artist: str, wanted: int = 5,
+                 min_title_score: float = 0.5, context_chars: int = 400):
+        cleaned = TITLE_NOISE_RE.sub("", title).strip() or title
+        self.title_tokens = slug_tokens(cleaned)
+        self.artist_tokens = slug_tokens(artist)
+        self.wanted = wanted
+        self.min_title_score = min_title_score
+        self.context_chars = context_chars
+
+        self.candidates: List[Tuple[float, int, str]] = []
+        self.seen_ids: Set[str] = set()
+        self._buffer = ""
+        self._done = False
+
+    def feed(self, chunk: str) -> bool:
+        self._buffer += chunk
+        self._scan(final=False)
+        return self._done
+
+    def finish(self):
+        self._scan(final=True)
+
+    def best(self) -> Optional[str]:
+        if not self.candidates:
+            return None
+        # Highest score wins; ties go to the one ranked higher on the page.
+        return max(self.candidates, key=lambda c: (c[0], -c[1]))[2]
+
+    def _scan(self, final: bool):
+        buffer = self._buffer
+        resume = None
+        last_end = 0
+
+        for m in APPLE_URL_IN_HTML_RE.finditer(buffer):
+            # Wait for the URL to be complete and its context to arrive.
+            if not final and m.end() + self.context_chars > len(buffer):
+                resume = m.start()
+                break
+            self._consider(m.group(0), buffer[m.end():m.end() + self.context_chars])
+            last_end = m.end()
+            if self._done:
+                break
+
+        if resume is None:
+            resume = max(last_end, len(buffer) - MAX_URL_CHARS)
+        self._buffer = buffer[resume:]
+
+    def _consider(self, raw_url: str, context: str):
+        url = unescape(raw_url)
+        m = APPLE_SONG_RE.match(url) or APPLE_ALBUM_TRACK_RE.match(url)
+        if not m or m.group(1) in self.seen_ids:
+            return
+        self.seen_ids.add(m.group(1))
+
+        slug = APPLE_SLUG_RE.search(url)
+        slug_words = slug_tokens(slug.group(1)) if slug else set()
+        end = RESULT_END_RE.search(context)
+        if end:
+            context = context[:end.start()]
+        context_tokens = slug_tokens(unescape(TAG_RE.sub(" ", context)))
+
+        title_score = max(
+            _overlap(self.title_tokens, slug_words),
+            _overlap(self.title_tokens, context_tokens),
+        )
+        artist_score = _overlap(self.artist_tokens, context_tokens)
+
+        # A same-title song by someone else would be saved for good, so
+        # some artist word has to show up. Artists with no latin words
+        # (e.g. CJK names) can't match a slug and fall back to the title.
+        artist_ok = artist_score > 0 or not self.artist_tokens
+        if title_score >= self.min_title_score and artist_ok:
+            score = 2 * title_score + artist_score
+            self.candidates.append((score, len(self.seen_ids), url))
+            if title_score == 1.0 and artist_score == 1.0:
+                self._done = True
+
+        if len(self.seen_ids) >= self.wanted:
+            self._done = True
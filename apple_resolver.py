@@ -0,0 +1,129 @@
+import random
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+
+class AppleLookupError(Exception):
+    pass
+
+
+# ============================================================
+# BACKGROUND APPLE MUSIC RESOLUTION
+# ============================================================
+
+class AppleResolveJob:
+    def __init__(self, song_key: str, title: str, artist: str):
+        self.song_key = song_key
+        self.title = title
+        self.artist = artist
+        self.attempts = 0
+        # Set when retries ran out, as opposed to Bing having no match.
+        self.failed = False
+        # (channel_id, message_id) of every posted message waiting on this song
+        self.targets: List[Tuple[int, int]] = []
+
+
+class AppleMusicResolver:
+    """Resolves Apple Music links off the interaction path. Jobs are keyed
+    by song_key so several posts of the same song share one scrape. A fixed
+    number of workers caps the number of in-flight scrapes, and transient
+    failures are retried with exponential backoff."""
+
+    def __init__(self,
+                 lookup: Callable[[str, str], Awaitable[Optional[str]]],
+                 on_resolved: Callable[[AppleResolveJob, Optional[str]], Awaitable[None]],
+                 workers: int = 3, max_queue: int = 500, max_attempts: int = 4,
+                 base_delay: float = 2.0, max_delay: float = 60.0):
+        self.lookup = lookup
+        self.on_resolved = on_resolved
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._queue: "asyncio.Queue[AppleResolveJob]" = asyncio.Queue(maxsize=max_queue)
+        self._pending: Dict[str, AppleResolveJob] = {}
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self):
+        if self._tasks:
+            return
+        for _ in range(self.workers):
+            self._tasks.append(asyncio.ensure_future(self._worker()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def is_pending(self, song_key: str) -> bool:
+        return song_key in self._pending
+
+    def stats(self) -> Dict[str, int]:
+        return {"queued": self._queue.qsize(), "pending": len(self._pending)}
+
+    def submit(self, song_key: str, title: str, artist: str,
+               target: Optional[Tuple[int, int]] = None,
+               background: bool = False) -> bool:
+        job = self._pending.get(song_key)
+        if job is not None:
+            if target:
+                job.targets.append(target)
+            return True
+
+        # Bulk work may only use half the queue, leaving room for /recommend.
+        if background and self._queue.qsize() >= self._queue.maxsize // 2:
+            return False
+
+        job = AppleResolveJob(song_key, title, artist)
+        if target:
+            job.targets.append(target)
+
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            print("Apple resolve queue full, dropping:", song_key)
+            return False
+
+        self._pending[song_key] = job
+        return True
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._run(job)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job: AppleResolveJob):
+        job.attempts += 1
+        try:
+            apple_url = await self.lookup(job.title, job.artist)
+        except Exception as e:
+            if job.attempts < self.max_attempts:
+                delay = min(self.base_delay * (2 ** (job.attempts - 1)), self.max_delay)
+                delay *= random.uniform(0.8, 1.2)
+                asyncio.ensure_future(self._requeue_later(job, delay))
+                return
+            print("Apple resolve failed:", job.song_key, e)
+            job.failed = True
+            apple_url = None
+
+        self._pending.pop(job.song_key, None)
+        try:
+            await self.on_resolved(job, apple_url)
+        except Exception as e:
+            print("Apple resolve callback error:", e)
+
+    async def _requeue_later(self, job: AppleResolveJob, delay: float):
+        await asyncio.sleep(delay)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self._pending.pop(job.song_key, None)
+            job.failed = True
+            try:
+                await self.on_resolved(job, None)
+            except Exception as e:
+                print("Apple resolve callback error:", e)
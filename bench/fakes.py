@@ -0,0 +1,239 @@
+import random
+import asyncio
+import hashlib
+import itertools
+from typing import Any, Dict, List, Optional, Set
+
+import discord
+from aiohttp import web
+
+BASE62 = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+
+
+def fake_track_id(seed: str) -> str:
+    n = int(hashlib.sha1(seed.encode("utf-8")).hexdigest(), 16)
+    chars = []
+    for _ in range(22):
+        n, r = divmod(n, 62)
+        chars.append(BASE62[r])
+    return "".join(chars)
+
+
+def fake_track(track_id: str) -> Dict[str, Any]:
+    return {
+        "id": track_id,
+        "name": f"Bench Song {track_id[:6]}",
+        "artists": [{"name": f"Bench Artist {track_id[6:9]}"}],
+        "external_urls": {"spotify": f"https://open.spotify.com/track/{track_id}"},
+        "album": {"images": [{"url": f"https://i.scdn.co/image/{track_id}"}]},
+    }
+
+
+# ============================================================
+# FAKE SPOTIFY / BING / ITUNES
+# ============================================================
+
+class FakeServices:
+    """One local aiohttp app standing in for every outbound host.
+
+    Each request sleeps latency ± jitter seconds, then fails with a 500
+    with probability error_rate, or a 429 with probability
+    rate_limit_rate, before answering."""
+
+    def __init__(self, latency: float = 0.05, jitter: float = 0.02,
+                 error_rate: float = 0.0, rate_limit_rate: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.requests: Dict[str, int] = {}
+        self._runner: Optional[web.AppRunner] = None
+        self.base_url = ""
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        app = web.Application(middlewares=[self._inject])
+        app.router.add_post("/api/token", self._token)
+        app.router.add_get("/v1/search", self._search)
+        app.router.add_get("/v1/tracks", self._tracks)
+        app.router.add_get("/search", self._bing)
+        app.router.add_get("/lookup", self._itunes)
+
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        bound_port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://{host}:{bound_port}"
+        return self.base_url
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    @web.middleware
+    async def _inject(self, request: web.Request, handler):
+        self.requests[request.path] = self.requests.get(request.path, 0) + 1
+        delay = self.latency + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        roll = random.random()
+        if roll < self.error_rate:
+            return web.Response(status=500, text="injected error")
+        if roll < self.error_rate + self.rate_limit_rate:
+            return web.Response(status=429, text="injected rate limit",
+                                headers={"Retry-After": "1"})
+        return await handler(request)
+
+    async def _token(self, request: web.Request) -> web.Response:
+        return web.json_response({"access_token": "bench-token", "expires_in": 3600})
+
+    async def _search(self, request: web.Request) -> web.Response:
+        query = request.query.get("q", "")
+        kind = request.query.get("type", "track")
+        limit = int(request.query.get("limit", "5"))
+        items = [fake_track(fake_track_id(f"{query}:{i}")) for i in range(limit)]
+        return web.json_response({f"{kind}s": {"items": items}})
+
+    async def _tracks(self, request: web.Request) -> web.Response:
+        ids = [i for i in request.query.get("ids", "").split(",") if i]
+        return web.json_response({"tracks": [fake_track(i) for i in ids]})
+
+    async def _bing(self, request: web.Request) -> web.Response:
+        query = request.query.get("q", "").split(" site:", 1)[0]
+        song_id = int(hashlib.sha1(query.encode("utf-8")).hexdigest()[:9], 16)
+        slug = "-".join(query.lower().split())
+        # An unrelated result first, then the real match, then page filler.
+        html = (
+            "<html><body><ol>"
+            f'<li><a href="https://music.apple.com/us/song/other/{song_id + 1}">Other - Song</a></li>'
+            f'<li><a href="https://music.apple.com/us/song/{slug}/{song_id}">{query} - Apple Music</a></li>'
+            + "<li>filler result</li>" * 2000
+            + "</ol></body></html>"
+        )
+        return web.Response(text=html, content_type="text/html")
+
+    async def _itunes(self, request: web.Request) -> web.Response:
+        return web.json_response({"resultCount": 1, "results": [{
+            "trackName": "Bench Song", "artistName": "Bench Artist",
+        }]})
+
+
+# ============================================================
+# FAKE DISCORD OBJECTS
+# ============================================================
+
+class _NotFoundResponse:
+    status = 404
+    reason = "Not Found"
+
+
+class FakeDiscord:
+    """Shared state for fake channels and messages. Every call that would
+    hit the Discord API sleeps for latency seconds."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.message_ids = itertools.count(10 ** 17)
+        self.channels: Dict[int, "FakeChannel"] = {}
+        self.deleted: Set[int] = set()
+        self.calls: Dict[str, int] = {}
+
+    async def api_call(self, name: str):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+
+    def get_channel(self, channel_id: int) -> "FakeChannel":
+        channel = self.channels.get(channel_id)
+        if channel is None:
+            channel = self.channels[channel_id] = FakeChannel(self, channel_id)
+        return channel
+
+    def interaction(self, user_id: int, channel_id: int,
+                    message: Optional["FakeMessage"] = None,
+                    guild_id: Optional[int] = None) -> "FakeInteraction":
+        return FakeInteraction(self, user_id, self.get_channel(channel_id), message, guild_id)
+
+
+class FakeMessage:
+    def __init__(self, discord_state: FakeDiscord, channel: "FakeChannel", message_id: int):
+        self._discord = discord_state
+        self.channel = channel
+        self.id = message_id
+
+    async def edit(self, **kwargs):
+        await self._discord.api_call("message.edit")
+
+
+class FakeChannel:
+    def __init__(self, discord_state: FakeDiscord, channel_id: int):
+        self._discord = discord_state
+        self.id = channel_id
+
+    def get_partial_message(self, message_id: int) -> FakeMessage:
+        return FakeMessage(self._discord, self, message_id)
+
+    async def fetch_message(self, message_id: int) -> FakeMessage:
+        await self._discord.api_call("channel.fetch_message")
+        if message_id in self._discord.deleted:
+            raise discord.NotFound(_NotFoundResponse(), "Unknown Message")
+        return FakeMessage(self._discord, self, message_id)
+
+
+class FakeResponse:
+    def __init__(self, interaction: "FakeInteraction"):
+        self._interaction = interaction
+        self._done = False
+
+    def is_done(self) -> bool:
+        return self._done
+
+    async def _respond(self, name: str):
+        if self._done:
+            raise discord.InteractionResponded(self._interaction)
+        self._done = True
+        await self._interaction.discord.api_call(name)
+
+    async def defer(self, **kwargs):
+        await self._respond("response.defer")
+
+    async def send_message(self, *args, **kwargs):
+        await self._respond("response.send_message")
+
+    async def edit_message(self, **kwargs):
+        await self._respond("response.edit_message")
+
+
+class FakeFollowup:
+    def __init__(self, interaction: "FakeInteraction"):
+        self._interaction = interaction
+        self.sent: List[Dict[str, Any]] = []
+
+    async def send(self, content: Optional[str] = None, **kwargs) -> FakeMessage:
+        discord_state = self._interaction.discord
+        await discord_state.api_call("followup.send")
+        self.sent.append({"content": content, **kwargs})
+        return FakeMessage(discord_state, self._interaction.channel, next(discord_state.message_ids))
+
+
+class FakeUser:
+    def __init__(self, user_id: int):
+        self.id = user_id
+
+
+class FakeInteraction:
+    def __init__(self, discord_state: FakeDiscord, user_id: int, channel: FakeChannel,
+                 message: Optional[FakeMessage] = None, guild_id: Optional[int] = None):
+        self.discord = discord_state
+        self.user = FakeUser(user_id)
+        self.channel = channel
+        self.channel_id = channel.id
+        self.guild_id = guild_id
+        self.message = message
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+
+    async def edit_original_response(self, **kwargs):
+        await self.discord.api_call("edit_original_response")
@@ -0,0 +1,321 @@
+"""Offline benchmark for the bot's command handlers.
+
+Runs the real handlers from bot.py against local stand-ins: one aiohttp
+server fakes Spotify, Bing and iTunes, and fake interaction objects
+replace Discord. Storage is the one real dependency: point the usual PG*
+variables at a scratch database, or set STORAGE_BACKEND=sqlite and
+SQLITE_PATH to a scratch file, because --reset empties it.
+
+    python -m bench.run --concurrency 20 --iterations 500 --latency-ms 80 --error-rate 0.01
+
+Run it before and after a change with the same flags and compare the
+p50/p95/p99 and throughput columns. The bot's own settings still apply;
+SPOTIFY_RATE_PER_SEC in particular caps Spotify traffic to the fakes.
+"""
+
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+from typing import Awaitable, Callable, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("SPOTIFY_CLIENT_ID", "bench")
+os.environ.setdefault("SPOTIFY_CLIENT_SECRET", "bench")
+os.environ.setdefault("SPOTIFY_REFRESH_TOKEN", "bench")
+os.environ.setdefault("METRICS_PORT", "0")
+
+import bot as app  # noqa: E402
+import catalog  # noqa: E402
+import spotify_auth  # noqa: E402
+from bench.fakes import FakeDiscord, FakeMessage, FakeServices  # noqa: E402
+from sqlite_storage import SqliteStorage  # noqa: E402
+from storage import MYRATINGS_SORTS  # noqa: E402
+
+SCENARIOS = ["recommend", "search", "rate", "myratings", "leaderboard", "trending", "foryou",
+             "restore"]
+BENCH_USER_BASE = 900_000_000_000_000_000
+BENCH_CHANNEL_ID = 800_000_000_000_000_000
+BENCH_GUILD_BASE = 700_000_000_000_000_000
+
+
+# ============================================================
+# MEASUREMENT
+# ============================================================
+
+class ScenarioResult:
+    def __init__(self, name: str):
+        self.name = name
+        self.samples: List[float] = []
+        self.errors = 0
+        self.wall = 0.0
+
+    def percentile(self, q: float) -> float:
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        idx = min(len(ordered) - 1, max(0, int(round(q * len(ordered))) - 1))
+        return ordered[idx]
+
+    def row(self) -> str:
+        ops = len(self.samples)
+        throughput = ops / self.wall if self.wall else 0.0
+        return (
+            f"{self.name:<12} {ops:>7} {self.errors:>6} "
+            f"{self.percentile(0.50) * 1000:>9.1f} {self.percentile(0.95) * 1000:>9.1f} "
+            f"{self.percentile(0.99) * 1000:>9.1f} {max(self.samples, default=0) * 1000:>9.1f} "
+            f"{throughput:>9.1f}"
+        )
+
+
+async def run_scenario(name: str, op: Callable[[int], Awaitable[None]],
+                       iterations: int, concurrency: int) -> ScenarioResult:
+    result = ScenarioResult(name)
+    counter = iter(range(iterations))
+
+    async def worker():
+        for i in counter:
+            start = time.perf_counter()
+            try:
+                await op(i)
+            except Exception as e:
+                result.errors += 1
+                if result.errors <= 3:
+                    print(f"[{name}] error: {e!r}")
+            result.samples.append(time.perf_counter() - start)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    result.wall = time.perf_counter() - started
+    return result
+
+
+# ============================================================
+# SETUP
+# ============================================================
+
+def point_at_fakes(base_url: str):
+    app.SPOTIFY_SEARCH_URL = f"{base_url}/v1/search"
+    app.SPOTIFY_TRACKS_URL = f"{base_url}/v1/tracks"
+    app.SPOTIFY_API_URL = f"{base_url}/v1"
+    app.ITUNES_LOOKUP_URL = f"{base_url}/lookup"
+    app.BING_SEARCH_URL = f"{base_url}/search"
+    catalog.SPOTIFY_API_URL = f"{base_url}/v1"
+    spotify_auth.SPOTIFY_TOKEN_URL = f"{base_url}/api/token"
+
+
+async def reset_database():
+    if isinstance(app.database, SqliteStorage):
+        def truncate(conn):
+            for table in ("songs", "ratings", "views", "rating_rollups", "apple_lookup_attempts"):
+                conn.execute(f"DELETE FROM {table}")
+        await app.database.write(truncate)
+        return
+    async with app.db_pool.acquire() as conn:
+        await conn.execute(
+            "TRUNCATE songs, ratings, views, rating_rollups, apple_lookup_attempts, search_cache"
+        )
+
+
+async def load_song_keys() -> List[str]:
+    sql = "SELECT song_key FROM songs ORDER BY song_key"
+    if isinstance(app.database, SqliteStorage):
+        rows = await app.database.read(lambda conn: conn.execute(sql).fetchall())
+    else:
+        async with app.db_pool.acquire() as conn:
+            rows = await conn.fetch(sql)
+    return [row["song_key"] for row in rows]
+
+
+async def seed_views(song_keys: List[str], count: int, deleted_ratio: float,
+                     fake_discord: FakeDiscord):
+    views = []
+    for i in range(count):
+        message_id = next(fake_discord.message_ids)
+        views.append((BENCH_CHANNEL_ID, message_id, song_keys[i % len(song_keys)],
+                      BENCH_GUILD_BASE, time.time()))
+        if random.random() < deleted_ratio:
+            fake_discord.deleted.add(message_id)
+    async with app.database.session() as db:
+        await db.add_views(views)
+
+
+# ============================================================
+# MAIN
+# ============================================================
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help="Comma-separated subset of: " + ", ".join(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--distinct-queries", type=int, default=50,
+                        help="Query pool size; lower means more cache and single-flight hits")
+    parser.add_argument("--users", type=int, default=25)
+    parser.add_argument("--guilds", type=int, default=3,
+                        help="Users are spread across this many fake guilds")
+    parser.add_argument("--latency-ms", type=float, default=50.0,
+                        help="Fake Spotify/Bing/iTunes latency")
+    parser.add_argument("--jitter-ms", type=float, default=20.0)
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="Fraction of fake HTTP calls answered with 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0,
+                        help="Fraction of fake HTTP calls answered with 429")
+    parser.add_argument("--discord-latency-ms", type=float, default=30.0)
+    parser.add_argument("--direct-ratings", action="store_true",
+                        help="Bypass the rating coalescer (RATING_FLUSH_INTERVAL=0)")
+    parser.add_argument("--views", type=int, default=2000,
+                        help="Stored views seeded for the restore scenario")
+    parser.add_argument("--deleted-ratio", type=float, default=0.1)
+    parser.add_argument("--restore-iterations", type=int, default=3)
+    parser.add_argument("--reset", action="store_true",
+                        help="Truncate songs, ratings and views before running")
+    parser.add_argument("--seed", type=int, default=1)
+    return parser.parse_args(argv)
+
+
+async def bench(args: argparse.Namespace):
+    random.seed(args.seed)
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    services = FakeServices(
+        latency=args.latency_ms / 1000,
+        jitter=args.jitter_ms / 1000,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+    )
+    point_at_fakes(await services.start())
+
+    fake_discord = FakeDiscord(latency=args.discord_latency_ms / 1000)
+    app.bot.get_channel = fake_discord.get_channel
+    app.bot.get_partial_messageable = lambda channel_id, **_: fake_discord.get_channel(channel_id)
+    # The bot never logs in; keep the periodic view sweeper parked.
+    app.bot.wait_until_ready = asyncio.Event().wait
+    if args.direct_ratings:
+        app.RATING_FLUSH_INTERVAL = 0
+
+    await app.init_db()
+    if args.reset:
+        await reset_database()
+    app.spotify_scheduler.start()
+    app.apple_resolver.start()
+    app.rating_coalescer.start()
+    app.view_writer.start()
+
+    def user_id(i: int) -> int:
+        return BENCH_USER_BASE + i % args.users
+
+    def guild_id(i: int) -> int:
+        return BENCH_GUILD_BASE + (i % args.users) % args.guilds
+
+    async def recommend(i: int):
+        interaction = fake_discord.interaction(user_id(i), BENCH_CHANNEL_ID, guild_id=guild_id(i))
+        await app.recommend.callback(interaction, f"bench query {i % args.distinct_queries}")
+
+    async def search(i: int):
+        interaction = fake_discord.interaction(user_id(i), BENCH_CHANNEL_ID)
+        await app.search.callback(interaction, f"bench search {i % args.distinct_queries}")
+
+    song_keys: List[str] = []
+
+    async def rate(i: int):
+        song_key = song_keys[random.randrange(len(song_keys))]
+        message = FakeMessage(fake_discord, fake_discord.get_channel(BENCH_CHANNEL_ID),
+                              next(fake_discord.message_ids))
+        interaction = fake_discord.interaction(user_id(i), BENCH_CHANNEL_ID, message, guild_id(i))
+        await app.RatingView(song_key).handle_rating(interaction, random.randint(1, 5))
+
+    async def myratings(i: int):
+        interaction = fake_discord.interaction(user_id(i), BENCH_CHANNEL_ID)
+        await app.myratings.callback(interaction, random.choice(list(MYRATINGS_SORTS)))
+
+    async def leaderboard(i: int):
+        interaction = fake_discord.interaction(user_id(i), BENCH_CHANNEL_ID)
+        await app.leaderboard.callback(interaction)
+
+    async def trending(i: int):
+        interaction = fake_discord.interaction(user_id(i), BENCH_CHANNEL_ID, guild_id=guild_id(i))
+        await app.trending.callback(interaction, random.choice(list(app.TRENDING_WINDOWS)),
+                                    random.choice(["server", "global"]))
+
+    async def foryou(i: int):
+        interaction = fake_discord.interaction(user_id(i), BENCH_CHANNEL_ID)
+        await app.foryou.callback(interaction)
+
+    async def restore(i: int):
+        await app.restore_persistent_views()
+        await app.sweep_deleted_views()
+
+    results: List[ScenarioResult] = []
+    ops: Dict[str, Callable[[int], Awaitable[None]]] = {
+        "recommend": recommend, "search": search, "rate": rate,
+        "myratings": myratings, "leaderboard": leaderboard, "trending": trending, "foryou": foryou,
+        "restore": restore,
+    }
+
+    try:
+        for name in SCENARIOS:
+            if name not in scenarios:
+                continue
+
+            if name in ("rate", "restore") and not song_keys:
+                song_keys = await load_song_keys()
+                if not song_keys:
+                    print(f"[{name}] skipped: no songs; run the recommend scenario first.")
+                    continue
+
+            if name == "foryou":
+                await app.similar_songs.rebuild()
+
+            if name == "restore":
+                await seed_views(song_keys, args.views, args.deleted_ratio, fake_discord)
+                results.append(await run_scenario(name, ops[name], args.restore_iterations, 1))
+                continue
+
+            results.append(await run_scenario(name, ops[name], args.iterations, args.concurrency))
+            if name == "rate":
+                # Let batched writes land before the read-heavy scenarios.
+                await app.rating_coalescer.stop()
+                app.rating_coalescer.start()
+    finally:
+        if app.view_sweeper_task is not None:
+            app.view_sweeper_task.cancel()
+        await app.apple_resolver.stop()
+        await app.similar_songs.stop()
+        await app.rating_coalescer.stop()
+        await app.view_writer.stop()
+        await app.spotify_scheduler.stop()
+        await app.spotify_tokens.stop()
+        await app.http_client.close()
+        await app.database.close()
+        await services.stop()
+
+    print()
+    print(f"concurrency={args.concurrency} iterations={args.iterations} "
+          f"latency={args.latency_ms}±{args.jitter_ms}ms error_rate={args.error_rate} "
+          f"rate_limit_rate={args.rate_limit_rate} discord_latency={args.discord_latency_ms}ms")
+    print(f"{'scenario':<12} {'ops':>7} {'errors':>6} {'p50 ms':>9} {'p95 ms':>9} "
+          f"{'p99 ms':>9} {'max ms':>9} {'ops/s':>9}")
+    for result in results:
+        print(result.row())
+    print()
+    print("fake HTTP requests:", dict(sorted(services.requests.items())))
+    print("fake Discord calls:", dict(sorted(fake_discord.calls.items())))
+    print("spotify scheduler:", app.spotify_scheduler.stats())
+    print("search cache:", app.search_cache.stats())
+    print("single-flight:", app.track_lookups.stats(), app.song_loads.stats())
+
+
+def main(argv: Optional[List[str]] = None):
+    asyncio.run(bench(parse_args(argv)))
+
+
+if __name__ == "__main__":
+    main()
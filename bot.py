@@ -2,158 +2,598 @@ import os
 import re
 import json
 import sys
+import time
+import signal
 import asyncio
-import base64
-from typing import Any, Dict, List, Optional, Tuple
+import subprocess
+import urllib.request
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Set, Tuple
 from html import unescape
 
 import discord
 from discord import app_commands
 from discord.ext import commands
 
-import asyncpg
-import requests
+from http_client import HttpClient
+from spotify_auth import SpotifyTokenManager
+from search_cache import SearchCache, normalize_query
+from apple_resolver import AppleLookupError, AppleMusicResolver, AppleResolveJob
+from apple_match import AppleCandidateScanner
+from rating_coalescer import RatingCoalescer
+from leaderboard import LeaderboardEngine, LeaderboardEntry, LeaderboardScoring
+from leaderboard_sync import LeaderboardSync
+from similarity import SimilarSongs
+from catalog import CatalogStore
+from genre_pool import GENRES, GenrePoolService
+from singleflight import SingleFlight
+from links import parse_apple_music_link, parse_spotify_link
+from storage import GLOBAL_SCOPE, Song, Storage, StoredView, ViewWriter
+from sqlite_storage import SqliteStorage
+from metrics import Counter, Gauge, Histogram, InstrumentedPool, Registry, start_metrics_server, timed
+from spotify_scheduler import (
+    PRIORITY_BACKGROUND,
+    PRIORITY_INTERACTIVE,
+    PRIORITY_PREFETCH,
+    SpotifyScheduler,
+    SpotifyUnavailable,
+)
 
 # ============================================================
 # CONFIG
 # ============================================================
 
-SPOTIFY_TOKEN_URL = "https://accounts.spotify.com/api/token"
 SPOTIFY_SEARCH_URL = "https://api.spotify.com/v1/search"
+SPOTIFY_TRACKS_URL = "https://api.spotify.com/v1/tracks"
+SPOTIFY_API_URL = "https://api.spotify.com/v1"
+ITUNES_LOOKUP_URL = "https://itunes.apple.com/lookup"
 APPLE_MUSIC_DOMAIN = "music.apple.com"
+APPLE_MISS_TTL_HOURS = float(os.getenv("APPLE_MISS_TTL_HOURS", "24"))
+RATING_FLUSH_INTERVAL = float(os.getenv("RATING_FLUSH_INTERVAL", "0.5"))
+RATING_EDIT_INTERVAL = float(os.getenv("RATING_EDIT_INTERVAL", "1.5"))
+VIEW_SWEEP_INTERVAL_HOURS = float(os.getenv("VIEW_SWEEP_INTERVAL_HOURS", "24"))
+VIEW_SWEEP_CONCURRENCY = int(os.getenv("VIEW_SWEEP_CONCURRENCY", "4"))
+VIEW_SWEEP_BATCH = 500
+SIMILARITY_REBUILD_MINUTES = float(os.getenv("SIMILARITY_REBUILD_MINUTES", "30"))
+MYRATINGS_PAGE_SIZE = 10
+# /trending window -> (days counting today, label).
+TRENDING_WINDOWS = {"today": (1, "today"), "week": (7, "this week"), "month": (30, "this month")}
+IMPORT_MAX_QUERIES = 100
+IMPORT_SEARCH_CONCURRENCY = 4
 BING_SEARCH_URL = "https://www.bing.com/search"
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+# "postgres" (default) or "sqlite" for a single-node install without a database server.
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "postgres").lower()
+SQLITE_PATH = os.getenv("SQLITE_PATH", "bot.sqlite3")
+# Sharding: SHARD_COUNT unset runs one unsharded connection; "auto" lets
+# Discord pick. SHARD_IDS ("0-3", "0,2") limits this process to some
+# shards; BOT_PROCESSES > 1 makes this entry point start that many
+# workers, each with its own contiguous shard range and an equal share of
+# SPOTIFY_RATE_PER_SEC and SPOTIFY_BURST.
+SHARD_COUNT = os.getenv("SHARD_COUNT", "").strip().lower()
+SHARD_IDS = os.getenv("SHARD_IDS", "").strip()
+BOT_PROCESSES = int(os.getenv("BOT_PROCESSES", "1"))
+DISCORD_GATEWAY_BOT_URL = "https://discord.com/api/v10/gateway/bot"
+
+
+
+def parse_shard_ids(spec: str) -> List[int]:
+    ids = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            first, last = part.split("-", 1)
+            ids.extend(range(int(first), int(last) + 1))
+        else:
+            ids.append(int(part))
+    return sorted(set(ids))
+
+
+def shard_ranges(shard_count: int, processes: int) -> List[str]:
+    ranges = []
+    for i in range(processes):
+        first = shard_count * i // processes
+        last = shard_count * (i + 1) // processes - 1
+        if last >= first:
+            ranges.append(f"{first}-{last}")
+    return ranges
+
+
+# Set when this process owns only some shards and shares state with others.
+SHARED_STATE = bool(SHARD_IDS)
+OWNED_SHARDS = parse_shard_ids(SHARD_IDS)
 
 intents = discord.Intents.default()
 intents.message_content = True
-bot = commands.Bot(command_prefix="!", intents=intents)
 
-db_pool: Optional[asyncpg.pool.Pool] = None
+
+def shard_config_error() -> Optional[str]:
+    if not SHARD_COUNT:
+        if SHARD_IDS:
+            return "SHARD_IDS needs SHARD_COUNT set to the total number of shards."
+        return None
+    if SHARD_COUNT == "auto":
+        if SHARD_IDS:
+            return "SHARD_IDS needs a numeric SHARD_COUNT, not auto."
+        return None
+    if not SHARD_COUNT.isdigit() or int(SHARD_COUNT) < 1:
+        return f"SHARD_COUNT must be a positive number or auto, got {SHARD_COUNT!r}."
+    outside = [i for i in OWNED_SHARDS if i >= int(SHARD_COUNT)]
+    if outside:
+        return f"SHARD_IDS {outside} are outside SHARD_COUNT {SHARD_COUNT}."
+    return None
+
+
+def make_bot() -> commands.Bot:
+    error = shard_config_error()
+    if error:
+        print(error)
+        sys.exit(1)
+    if not SHARD_COUNT:
+        return commands.Bot(command_prefix="!", intents=intents)
+    return commands.AutoShardedBot(
+        command_prefix="!",
+        intents=intents,
+        shard_count=None if SHARD_COUNT == "auto" else int(SHARD_COUNT),
+        shard_ids=OWNED_SHARDS or None,
+    )
+
+
+bot = make_bot()
+
+db_pool: Optional[InstrumentedPool] = None
+http_client = HttpClient()
+spotify_tokens = SpotifyTokenManager(http_client)
+spotify_scheduler = SpotifyScheduler(
+    rate=float(os.getenv("SPOTIFY_RATE_PER_SEC", "10")),
+    burst=int(os.getenv("SPOTIFY_BURST", "20")),
+    max_queue=int(os.getenv("SPOTIFY_MAX_QUEUE", "200")),
+)
+track_lookups = SingleFlight("track_lookup")
+song_loads = SingleFlight("song_load")
+search_cache = SearchCache(max_entries=int(os.getenv("SEARCH_CACHE_SIZE", "5000")))
+leaderboard_scoring = LeaderboardScoring(
+    mode=os.getenv("LEADERBOARD_SCORING", "bayesian"),
+    prior_mean=float(os.getenv("LEADERBOARD_PRIOR_MEAN", "3.0")),
+    prior_weight=float(os.getenv("LEADERBOARD_PRIOR_WEIGHT", "5")),
+)
+leaderboard_engine = LeaderboardEngine(leaderboard_scoring)
+
+
+# ============================================================
+# METRICS
+# ============================================================
+
+metrics = Registry()
+command_latency = metrics.register(Histogram(
+    "bot_command_seconds", "Slash command handling time.", labels=("command",),
+))
+rating_click_latency = metrics.register(Histogram(
+    "bot_rating_click_seconds", "RatingView button handling time.",
+))
+outbound_latency = metrics.register(Histogram(
+    "bot_outbound_seconds", "Outbound HTTP call time.", labels=("endpoint",),
+))
+outbound_status = metrics.register(Counter(
+    "bot_outbound_responses_total", "Outbound HTTP calls by status.", labels=("endpoint", "status"),
+))
+db_acquire_wait = metrics.register(Histogram(
+    "bot_db_acquire_wait_seconds", "Time spent waiting for a pool connection.",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0),
+))
+
+
+def read_pool_gauge() -> Dict[Tuple[str, ...], float]:
+    if db_pool is None:
+        return {}
+    size = db_pool.get_size()
+    idle = db_pool.get_idle_size()
+    return {("in_use",): size - idle, ("idle",): idle, ("max",): db_pool.get_max_size()}
+
+
+def read_internal_gauge() -> Dict[Tuple[str, ...], float]:
+    values: Dict[Tuple[str, ...], float] = {}
+    for name, value in spotify_scheduler.counters.items():
+        values[("spotify_scheduler", name)] = value
+    values[("spotify_scheduler", "queued")] = spotify_scheduler.stats()["queued"]
+    for name in ("entries", "hits", "misses"):
+        values[("search_cache", name)] = search_cache.stats()[name]
+    for flight in (track_lookups, song_loads):
+        for name, value in flight.stats().items():
+            values[(flight.name, name)] = value
+    for name, value in apple_resolver.stats().items():
+        values[("apple_resolver", name)] = value
+    for genre, size in genre_pools.stats().items():
+        values[("genre_pool", genre)] = size
+    return values
+
+
+metrics.register(Gauge(
+    "bot_db_pool_connections", "Database pool connections.", read_pool_gauge, labels=("state",),
+))
+metrics.register(Gauge(
+    "bot_internal", "Queue, cache and coalescing counters.", read_internal_gauge,
+    labels=("component", "name"),
+))
+
+OUTBOUND_ENDPOINTS = [
+    ("/api/token", "spotify_token"),
+    ("/v1/search", "spotify_search"),
+    ("/top-tracks", "spotify_top_tracks"),
+    ("/v1/albums/", "spotify_album_tracks"),
+    ("/v1/playlists/", "spotify_playlist"),
+    ("/v1/tracks", "spotify_tracks"),
+    ("/search", "bing"),
+    ("/lookup", "itunes"),
+]
+
+
+def outbound_endpoint(url: str) -> str:
+    for fragment, name in OUTBOUND_ENDPOINTS:
+        if fragment in url:
+            return name
+    return "other"
+
+
+def observe_outbound(method: str, url: str, status: str, seconds: float):
+    endpoint = outbound_endpoint(url)
+    outbound_latency.observe(seconds, endpoint)
+    outbound_status.inc(endpoint, status)
+
+
+http_client.observer = observe_outbound
 
 
 # ============================================================
 # DATABASE INITIALIZATION
 # ============================================================
 
+def pg_connect_args() -> Dict[str, Any]:
+    return {
+        "host": os.getenv("PGHOST"),
+        "port": os.getenv("PGPORT"),
+        "user": os.getenv("PGUSER"),
+        "password": os.getenv("PGPASSWORD"),
+        "database": os.getenv("PGDATABASE"),
+    }
+
+
 async def init_db():
     global db_pool
-    db_pool = await asyncpg.create_pool(
-        host=os.getenv("PGHOST"),
-        port=os.getenv("PGPORT"),
-        user=os.getenv("PGUSER"),
-        password=os.getenv("PGPASSWORD"),
-        database=os.getenv("PGDATABASE"),
-        min_size=1,
-        max_size=5,
-    )
+    if isinstance(database, SqliteStorage):
+        # Catalog snapshots and the persistent search cache are Postgres-only;
+        # both work without it.
+        await database.open()
+        await load_leaderboard()
+        return
 
-    async with db_pool.acquire() as conn:
-        try:
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS songs (
-                    song_key TEXT PRIMARY KEY,
-                    title TEXT NOT NULL,
-                    artist TEXT NOT NULL,
-                    spotify_url TEXT NOT NULL,
-                    apple_url TEXT,
-                    average FLOAT DEFAULT 0,
-                    count INT DEFAULT 0
-                );
-            """)
-
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS ratings (
-                    song_key TEXT NOT NULL,
-                    user_id TEXT NOT NULL,
-                    rating INT NOT NULL,
-                    PRIMARY KEY (song_key, user_id)
-                );
-            """)
-
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS views (
-                    channel_id BIGINT NOT NULL,
-                    message_id BIGINT NOT NULL,
-                    song_key TEXT NOT NULL
-                );
-            """)
+    import asyncpg
+    from migrations import run_migrations
 
-        except Exception as e:
-            print("DB INIT ERROR:", e)
+    pool = await asyncpg.create_pool(**pg_connect_args(), min_size=1, max_size=5)
+    db_pool = InstrumentedPool(pool, db_acquire_wait)
+
+    await run_migrations(db_pool)
+    database.attach(db_pool)
+    catalog_store.attach(db_pool)
+
+    # Other shard processes read the same search results, token and leaderboard.
+    if SHARED_STATE or os.getenv("SEARCH_CACHE_PERSIST", "").lower() in ("1", "true", "yes"):
+        await search_cache.attach(db_pool)
+    if SHARED_STATE:
+        spotify_tokens.attach(db_pool)
+        leaderboard_sync.start(db_pool, lambda: asyncpg.connect(**pg_connect_args()))
+
+    await load_leaderboard()
+
+
+async def load_leaderboard():
+    try:
+        async with database.session() as db:
+            leaderboard_engine.rebuild(await db.rated_songs())
+    except Exception as e:
+        # /leaderboard falls back to SQL until the engine is loaded.
+        print("LEADERBOARD LOAD ERROR:", e)
+
+
+async def reload_leaderboard_songs(song_keys: Set[str]):
+    async with database.session() as db:
+        for song_key in song_keys:
+            song = await db.get_song(song_key)
+            if song is not None:
+                leaderboard_engine.update(song)
+
+
+leaderboard_sync = LeaderboardSync(reload_leaderboard_songs, load_leaderboard)
 
 
 # ============================================================
 # SPOTIFY AUTH (REFRESH TOKEN)
 # ============================================================
 
-def get_spotify_access_token() -> Optional[str]:
-    client_id = os.getenv("SPOTIFY_CLIENT_ID")
-    client_secret = os.getenv("SPOTIFY_CLIENT_SECRET")
-    refresh_token = os.getenv("SPOTIFY_REFRESH_TOKEN")
+async def get_spotify_access_token() -> Optional[str]:
+    return await spotify_tokens.get_token()
 
-    if not all([client_id, client_secret, refresh_token]):
-        print("Missing Spotify environment variables.")
-        return None
 
-    auth_header = f"{client_id}:{client_secret}".encode("utf-8")
-    auth_b64 = base64.b64encode(auth_header).decode()
+async def spotify_api_get(url: str, params: Optional[Dict[str, Any]] = None,
+                          headers: Optional[Dict[str, str]] = None,
+                          priority: int = PRIORITY_INTERACTIVE):
+    async def send():
+        token = await get_spotify_access_token()
+        if not token:
+            return None
 
-    try:
-        resp = requests.post(
-            SPOTIFY_TOKEN_URL,
-            data={
-                "grant_type": "refresh_token",
-                "refresh_token": refresh_token,
-            },
-            headers={
-                "Authorization": f"Basic {auth_b64}",
-                "Content-Type": "application/x-www-form-urlencoded",
-            },
-            timeout=10,
+        resp = await http_client.get(
+            url,
+            params=params,
+            headers={**(headers or {}), "Authorization": f"Bearer {token}"},
         )
-        if resp.status_code != 200:
-            print("Spotify token refresh failed:", resp.status_code, resp.text)
-            return None
 
-        return resp.json().get("access_token")
+        # Token revoked or expired early: force one refresh and retry once.
+        if resp.status_code == 401:
+            spotify_tokens.invalidate(token)
+            token = await get_spotify_access_token()
+            if not token:
+                return resp
+            resp = await http_client.get(
+                url,
+                params=params,
+                headers={**(headers or {}), "Authorization": f"Bearer {token}"},
+            )
 
+        return resp
+
+    try:
+        return await spotify_scheduler.submit(send, priority=priority)
+    except SpotifyUnavailable as e:
+        print("Spotify request not sent:", e)
+        return None
     except Exception as e:
-        print("Spotify token error:", e)
+        # Transport errors surface here; callers treat None as "no result".
+        print("Spotify request error:", e)
         return None
 
 
+catalog_store = CatalogStore(
+    fetch=spotify_api_get,
+    artist_ttl=float(os.getenv("CATALOG_ARTIST_TTL_HOURS", "24")) * 3600,
+    album_ttl=float(os.getenv("CATALOG_ALBUM_TTL_HOURS", "168")) * 3600,
+)
+
+
 # ============================================================
 # SPOTIFY SEARCH (OFFICIAL API)
 # ============================================================
 
-def spotify_search_track(query: str) -> Optional[Dict[str, Any]]:
-    token = get_spotify_access_token()
-    if not token:
+def simplify_track(track: Dict[str, Any]) -> Dict[str, Any]:
+    images = track.get("album", {}).get("images") or []
+    return {
+        "id": track.get("id"),
+        "title": track["name"],
+        "artist": ", ".join(a["name"] for a in track["artists"]),
+        "spotify_url": track["external_urls"]["spotify"],
+        "thumbnail_url": images[0]["url"] if images else None,
+    }
+
+
+async def spotify_search(query: str, kind: str, limit: int, offset: int = 0,
+                         priority: int = PRIORITY_INTERACTIVE) -> Optional[List[Dict[str, Any]]]:
+    resp = await spotify_api_get(
+        SPOTIFY_SEARCH_URL,
+        params={"q": query, "type": kind, "limit": limit, "offset": offset},
+        priority=priority,
+    )
+    if resp is None:
         return None
+    if resp.status_code != 200:
+        print("Spotify search failed:", resp.status_code, resp.text)
+        return None
+
+    return resp.json().get(f"{kind}s", {}).get("items", [])
+
+
+async def fetch_genre_page(genre: str, offset: int, limit: int) -> Optional[List[Dict[str, Any]]]:
+    items = await spotify_search(f"genre:{genre}", "track", limit, offset,
+                                 priority=PRIORITY_PREFETCH)
+    if items is None:
+        return None
+    return [simplify_track(t) for t in items]
+
+
+genre_pools = GenrePoolService(
+    fetch_page=fetch_genre_page,
+    target_size=int(os.getenv("GENRE_POOL_SIZE", "300")),
+    low_watermark=int(os.getenv("GENRE_POOL_LOW_WATERMARK", "100")),
+)
+
+
+async def spotify_search_track(query: str,
+                               priority: int = PRIORITY_INTERACTIVE) -> Optional[Dict[str, Any]]:
+    cached = await search_cache.get("track", query)
+    if cached is not None:
+        return cached
 
     try:
-        resp = requests.get(
-            SPOTIFY_SEARCH_URL,
-            params={"q": query, "type": "track", "limit": 1},
-            headers={"Authorization": f"Bearer {token}"},
-            timeout=10,
+        items = await spotify_search(query, "track", 1, priority=priority)
+        if not items:
+            return None
+
+        result = simplify_track(items[0])
+        await search_cache.set("track", query, result)
+        return result
+
+    except Exception as e:
+        print("Spotify search error:", e)
+        return None
+
+
+async def spotify_get_tracks(track_ids: List[str],
+                             priority: int = PRIORITY_INTERACTIVE) -> Dict[str, Dict[str, Any]]:
+    found: Dict[str, Dict[str, Any]] = {}
+    missing = []
+    for track_id in dict.fromkeys(track_ids):
+        cached = await search_cache.get("track_id", track_id)
+        if cached is not None:
+            found[track_id] = cached
+        else:
+            missing.append(track_id)
+
+    # /v1/tracks takes up to 50 IDs per call.
+    for start in range(0, len(missing), 50):
+        batch = missing[start:start + 50]
+        resp = await spotify_api_get(
+            SPOTIFY_TRACKS_URL,
+            params={"ids": ",".join(batch)},
+            priority=priority,
         )
+        if resp is None or resp.status_code != 200:
+            if resp is not None:
+                print("Spotify tracks lookup failed:", resp.status_code, resp.text)
+            continue
+
+        for track in resp.json().get("tracks", []):
+            if not track:
+                continue
+            result = simplify_track(track)
+            found[track["id"]] = result
+            await search_cache.set("track_id", track["id"], result)
+
+    return found
+
+
+async def itunes_lookup_track(track_id: str) -> Optional[Dict[str, Any]]:
+    try:
+        resp = await http_client.get(ITUNES_LOOKUP_URL, params={"id": track_id})
         if resp.status_code != 200:
-            print("Spotify search failed:", resp.status_code, resp.text)
             return None
+        results = resp.json().get("results", [])
+    except Exception as e:
+        print("iTunes lookup error:", e)
+        return None
+
+    for result in results:
+        if result.get("wrapperType") == "track":
+            return result
+    return None
+
+
+async def resolve_track_query(query: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """Turn /recommend input into (spotify track, known Apple Music URL)."""
+    link = parse_spotify_link(query)
+    if link:
+        kind, item_id = link
+        if kind == "album":
+            album_tracks = await catalog_store.album_tracks(item_id)
+            if not album_tracks:
+                return None, None
+            item_id = album_tracks[0]["id"]
+        elif kind != "track":
+            return None, None
+
+        tracks = await spotify_get_tracks([item_id])
+        return tracks.get(item_id), None
+
+    apple = parse_apple_music_link(query)
+    if apple:
+        apple_id, apple_url = apple
+        meta = await itunes_lookup_track(apple_id)
+        if not meta:
+            return None, None
+        spotify_data = await spotify_search_track(
+            f'track:"{meta["trackName"]}" artist:"{meta["artistName"]}"'
+        )
+        return spotify_data, apple_url
+
+    return await spotify_search_track(query), None
 
-        items = resp.json().get("tracks", {}).get("items", [])
+
+async def spotify_playlist_tracks(playlist_id: str,
+                                  priority: int = PRIORITY_INTERACTIVE) -> Optional[List[Dict[str, Any]]]:
+    url = f"{SPOTIFY_API_URL}/playlists/{playlist_id}/tracks"
+    params: Optional[Dict[str, Any]] = {
+        "limit": 100,
+        "fields": "items(track(id,name,artists(name),external_urls,album(images))),next",
+    }
+    tracks = []
+    while url:
+        resp = await spotify_api_get(url, params=params, priority=priority)
+        if resp is None or resp.status_code != 200:
+            if resp is not None:
+                print("Spotify playlist lookup failed:", resp.status_code, resp.text)
+            return None
+
+        page = resp.json()
+        for item in page.get("items", []):
+            track = item.get("track")
+            # Local files and removed tracks come back without an ID.
+            if track and track.get("id"):
+                tracks.append(simplify_track(track))
+
+        # `next` already carries the query string.
+        url, params = page.get("next"), None
+
+    return tracks
+
+
+async def spotify_search_tracks(query: str, limit: int = 5) -> Optional[List[Dict[str, Any]]]:
+    cached = await search_cache.get("search", query)
+    if cached is not None:
+        return cached
+
+    try:
+        items = await spotify_search(query, "track", limit)
+        if items is None:
+            return None
+
+        results = [simplify_track(t) for t in items]
+        if results:
+            await search_cache.set("search", query, results)
+        return results
+
+    except Exception as e:
+        print("Spotify search error:", e)
+        return None
+
+
+async def spotify_search_artist(name: str) -> Optional[Dict[str, Any]]:
+    cached = await search_cache.get("artist", name)
+    if cached is not None:
+        return cached
+
+    try:
+        items = await spotify_search(name, "artist", 1)
         if not items:
             return None
 
-        track = items[0]
-        return {
-            "title": track["name"],
-            "artist": ", ".join(a["name"] for a in track["artists"]),
-            "spotify_url": track["external_urls"]["spotify"],
-            "thumbnail_url": track["album"]["images"][0]["url"]
-            if track["album"]["images"]
-            else None,
+        result = {"id": items[0]["id"], "name": items[0]["name"]}
+        await search_cache.set("artist", name, result)
+        return result
+
+    except Exception as e:
+        print("Spotify search error:", e)
+        return None
+
+
+async def spotify_search_album(name: str) -> Optional[Dict[str, Any]]:
+    cached = await search_cache.get("album", name)
+    if cached is not None:
+        return cached
+
+    try:
+        items = await spotify_search(name, "album", 1)
+        if not items:
+            return None
+
+        result = {
+            "id": items[0]["id"],
+            "name": items[0]["name"],
+            "url": items[0]["external_urls"]["spotify"],
         }
+        await search_cache.set("album", name, result)
+        return result
 
     except Exception as e:
         print("Spotify search error:", e)
@@ -164,7 +604,7 @@ def spotify_search_track(query: str) -> Optional[Dict[str, Any]]:
 # APPLE MUSIC FALLBACK (BING HTML)
 # ============================================================
 
-def bing_search_html(query: str) -> Optional[str]:
+async def bing_scan(query: str, scanner: AppleCandidateScanner):
     headers = {
         "User-Agent": (
             "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
@@ -173,133 +613,94 @@ def bing_search_html(query: str) -> Optional[str]:
         )
     }
     try:
-        resp = requests.get(
+        status = await http_client.scan(
             BING_SEARCH_URL,
+            scanner.feed,
             params={"q": query, "mkt": "en-US"},
             headers=headers,
-            timeout=10,
         )
-        if resp.status_code == 200:
-            return resp.text
-    except Exception:
-        pass
-    return None
-
-
-def extract_apple_music_track_urls_from_html(html: str) -> List[str]:
-    pattern = re.compile(r"https?://music\.apple\.com/[^\s\"'<>]+")
-    urls = []
-    seen = set()
-
-    for m in pattern.finditer(html):
-        url = m.group(0)
-        if "/album/" in url or "/playlist/" in url:
-            continue
-        if url not in seen:
-            seen.add(url)
-            urls.append(url)
+    except Exception as e:
+        raise AppleLookupError(f"Bing request failed: {e}") from e
 
-    return urls
+    if status != 200:
+        raise AppleLookupError(f"Bing returned {status}")
 
 
-def find_apple_music_track(query: str) -> Optional[str]:
-    html = bing_search_html(f"{query} site:{APPLE_MUSIC_DOMAIN}")
-    if not html:
-        return None
+async def find_apple_music_track(title: str, artist: str) -> Optional[str]:
+    scanner = AppleCandidateScanner(title, artist)
+    await bing_scan(f"{title} {artist} site:{APPLE_MUSIC_DOMAIN}", scanner)
+    scanner.finish()
+    return scanner.best()
 
-    urls = extract_apple_music_track_urls_from_html(html)
-    return urls[0] if urls else None
 
+async def on_apple_resolved(job: AppleResolveJob, apple_url: Optional[str]):
+    async with database.session() as db:
+        if apple_url:
+            song = await db.set_apple_url(job.song_key, apple_url)
+        elif not job.failed:
+            song = await db.record_apple_miss(job.song_key, APPLE_MISS_TTL_HOURS * 3600)
+        else:
+            song = await db.get_song(job.song_key)
+    if not song:
+        return
 
-# ============================================================
-# DATABASE HELPERS
-# ============================================================
+    embed = build_song_embed(
+        song.title,
+        song.artist,
+        song.spotify_url,
+        song.apple_url,
+        song.average,
+        song.count,
+    )
 
-async def db_get_song(song_key: str) -> Optional[asyncpg.Record]:
-    async with db_pool.acquire() as conn:
+    for channel_id, message_id in job.targets:
+        message = bot.get_partial_messageable(channel_id).get_partial_message(message_id)
         try:
-            return await conn.fetchrow(
-                "SELECT * FROM songs WHERE song_key=$1", song_key
-            )
+            await message.edit(embed=embed)
         except Exception as e:
-            print("DB GET SONG ERROR:", e)
-            return None
+            print("Apple resolve edit error:", e)
 
 
-async def db_upsert_song(song_key: str, title: str, artist: str,
-                         spotify_url: str, apple_url: Optional[str]):
-    async with db_pool.acquire() as conn:
-        try:
-            await conn.execute("""
-                INSERT INTO songs (song_key, title, artist, spotify_url, apple_url)
-                VALUES ($1, $2, $3, $4, $5)
-                ON CONFLICT (song_key)
-                DO UPDATE SET apple_url = COALESCE(songs.apple_url, EXCLUDED.apple_url);
-            """, song_key, title, artist, spotify_url, apple_url)
-        except Exception as e:
-            print("DB UPSERT SONG ERROR:", e)
+apple_resolver = AppleMusicResolver(
+    lookup=find_apple_music_track,
+    on_resolved=on_apple_resolved,
+    workers=int(os.getenv("APPLE_RESOLVE_WORKERS", "3")),
+)
 
 
-async def db_set_rating(song_key: str, user_id: str, rating: int):
-    async with db_pool.acquire() as conn:
-        try:
-            await conn.execute("""
-                INSERT INTO ratings (song_key, user_id, rating)
-                VALUES ($1, $2, $3)
-                ON CONFLICT (song_key, user_id)
-                DO UPDATE SET rating = EXCLUDED.rating;
-            """, song_key, user_id, rating)
-        except Exception as e:
-            print("DB SET RATING ERROR:", e)
+# ============================================================
+# DATABASE HELPERS
+# ============================================================
 
+def make_storage() -> Storage:
+    if STORAGE_BACKEND == "sqlite":
+        return SqliteStorage(SQLITE_PATH)
+    if STORAGE_BACKEND != "postgres":
+        print(f"Unknown STORAGE_BACKEND {STORAGE_BACKEND!r}; using postgres.")
+    # Imported here so a SQLite install runs without asyncpg.
+    from pg_storage import PostgresStorage
+    return PostgresStorage()
 
-async def db_get_ratings(song_key: str) -> List[asyncpg.Record]:
-    async with db_pool.acquire() as conn:
-        try:
-            return await conn.fetch(
-                "SELECT * FROM ratings WHERE song_key=$1", song_key
-            )
-        except Exception as e:
-            print("DB GET RATINGS ERROR:", e)
-            return []
 
+database = make_storage()
+view_writer = ViewWriter(database, flush_interval=float(os.getenv("VIEW_FLUSH_INTERVAL", "1.0")))
 
-async def db_update_song_stats(song_key: str, average: float, count: int):
-    async with db_pool.acquire() as conn:
-        try:
-            await conn.execute("""
-                UPDATE songs
-                SET average=$2, count=$3
-                WHERE song_key=$1;
-            """, song_key, average, count)
-        except Exception as e:
-            print("DB UPDATE SONG STATS ERROR:", e)
 
+async def load_all_ratings() -> List[Tuple[str, str, int]]:
+    async with database.session() as db:
+        return await db.all_ratings()
 
-async def db_add_view(channel_id: int, message_id: int, song_key: str):
-    async with db_pool.acquire() as conn:
-        try:
-            await conn.execute("""
-                INSERT INTO views (channel_id, message_id, song_key)
-                VALUES ($1, $2, $3);
-            """, channel_id, message_id, song_key)
-        except Exception as e:
-            print("DB ADD VIEW ERROR:", e)
+
+similar_songs = SimilarSongs(load_all_ratings, rebuild_interval=SIMILARITY_REBUILD_MINUTES * 60)
 
 
-async def db_get_views() -> List[asyncpg.Record]:
-    async with db_pool.acquire() as conn:
-        try:
-            return await conn.fetch("SELECT * FROM views")
-        except Exception as e:
-            print("DB GET VIEWS ERROR:", e)
-            return []
 # ============================================================
 # EMBEDS & UI
 # ============================================================
 
 def build_song_embed(title: str, artist: str, spotify_url: str,
-                     apple_url: Optional[str], average: float, count: int):
+                     apple_url: Optional[str], average: float, count: int,
+                     apple_pending: bool = False):
     desc = f"**{title}** — {artist}"
     embed = discord.Embed(
         title="Recommended Track",
@@ -309,6 +710,8 @@ def build_song_embed(title: str, artist: str, spotify_url: str,
     embed.add_field(name="Spotify", value=spotify_url, inline=False)
     if apple_url:
         embed.add_field(name="Apple Music", value=apple_url, inline=False)
+    elif apple_pending:
+        embed.add_field(name="Apple Music", value="Resolving Apple Music…", inline=False)
 
     if count > 0:
         embed.add_field(
@@ -322,89 +725,235 @@ def build_song_embed(title: str, artist: str, spotify_url: str,
     return embed
 
 
+def build_song_embed_from_row(song_key: str, song: Song) -> discord.Embed:
+    return build_song_embed(
+        song.title,
+        song.artist,
+        song.spotify_url,
+        song.apple_url,
+        song.average,
+        song.count,
+        apple_pending=apple_resolver.is_pending(song_key),
+    )
+
+
+async def render_rated_message(channel_id: int, message_id: int, song_key: str, song):
+    # Partial messageable, not get_channel: DM and uncached thread channels
+    # aren't in the cache but can still be edited by ID.
+    await bot.get_partial_messageable(channel_id).get_partial_message(message_id).edit(
+        embed=build_song_embed_from_row(song_key, song)
+    )
+
+
+async def notify_missing_song(song_key: str, interactions: List[discord.Interaction]):
+    # The clicks were deferred, so the direct path's reply goes out as a followup.
+    for interaction in interactions:
+        try:
+            await interaction.followup.send("This song is no longer available.", ephemeral=True)
+        except Exception as e:
+            print("Missing song notice error:", e)
+
+
+async def flush_ratings(rows: List[Tuple[str, str, int, Optional[int]]]) -> Dict[str, Song]:
+    async with database.session() as db:
+        songs = await db.apply_ratings(rows)
+    for song in songs.values():
+        leaderboard_engine.update(song)
+        leaderboard_sync.publish(song.song_key)
+    for song_key, user_id, rating, _ in rows:
+        if song_key in songs:
+            similar_songs.record(song_key, user_id, rating)
+    return songs
+
+
+rating_coalescer = RatingCoalescer(
+    flush=flush_ratings,
+    render=render_rated_message,
+    flush_interval=RATING_FLUSH_INTERVAL,
+    edit_interval=RATING_EDIT_INTERVAL,
+    missing=notify_missing_song,
+)
+
+
+def chunk_lines(lines: List[str], sep: str, limit: int = 4000) -> List[str]:
+    # Embed descriptions are capped at 4096 characters.
+    pages: List[str] = []
+    current: List[str] = []
+    size = 0
+    for line in lines:
+        extra = len(line) + (len(sep) if current else 0)
+        if current and size + extra > limit:
+            pages.append(sep.join(current))
+            current, size = [], 0
+            extra = len(line)
+        current.append(line)
+        size += extra
+    if current:
+        pages.append(sep.join(current))
+    return pages
+
+
+class EmbedPagerView(discord.ui.View):
+    def __init__(self, embeds: List[discord.Embed], timeout: Optional[float] = 300):
+        super().__init__(timeout=timeout)
+        self.embeds = embeds
+        self.index = 0
+        self._sync_buttons()
+
+    def _sync_buttons(self):
+        self.prev_page.disabled = self.index == 0
+        self.next_page.disabled = self.index >= len(self.embeds) - 1
+
+    @discord.ui.button(label="◀ Prev", style=discord.ButtonStyle.secondary)
+    async def prev_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.index = max(self.index - 1, 0)
+        self._sync_buttons()
+        await interaction.response.edit_message(embed=self.embeds[self.index], view=self)
+
+    @discord.ui.button(label="Next ▶", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.index = min(self.index + 1, len(self.embeds) - 1)
+        self._sync_buttons()
+        await interaction.response.edit_message(embed=self.embeds[self.index], view=self)
+
+
+class RatingButton(discord.ui.DynamicItem[discord.ui.Button],
+                   template=r"rate:(?P<value>[1-5]):(?P<song_key>.+)"):
+    # The song key lives in the custom_id, so one registered handler serves
+    # the buttons of every message ever posted, across restarts.
+    def __init__(self, song_key: str, value: int):
+        super().__init__(
+            discord.ui.Button(
+                label=str(value),
+                style=discord.ButtonStyle.primary if value == 5 else discord.ButtonStyle.secondary,
+                custom_id=f"rate:{value}:{song_key}",
+            )
+        )
+        self.song_key = song_key
+        self.value = value
+
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction,
+                             item: discord.ui.Button, match: re.Match):
+        return cls(match["song_key"], int(match["value"]))
+
+    async def callback(self, interaction: discord.Interaction):
+        await RatingView(self.song_key).handle_rating(interaction, self.value)
+
+
 class RatingView(discord.ui.View):
     def __init__(self, song_key: str, timeout: Optional[float] = None):
         super().__init__(timeout=timeout)
         self.song_key = song_key
+        for value in range(1, 6):
+            self.add_item(RatingButton(song_key, value))
 
+    @timed(rating_click_latency)
     async def handle_rating(self, interaction: discord.Interaction, rating_value: int):
         user_id = str(interaction.user.id)
 
-        await db_set_rating(self.song_key, user_id, rating_value)
-        ratings = await db_get_ratings(self.song_key)
-
-        if not ratings:
-            avg = 0.0
-            count = 0
-        else:
-            values = [r["rating"] for r in ratings]
-            avg = sum(values) / len(values)
-            count = len(values)
-
-        await db_update_song_stats(self.song_key, avg, count)
+        if RATING_FLUSH_INTERVAL > 0 and interaction.message is not None:
+            # Acknowledge right away; the write and the embed edit are batched.
+            await interaction.response.defer()
+            rating_coalescer.submit(
+                self.song_key,
+                user_id,
+                rating_value,
+                (interaction.channel_id, interaction.message.id),
+                interaction.guild_id,
+                interaction,
+            )
+            return
 
-        song = await db_get_song(self.song_key)
+        async with database.session() as db:
+            song = await db.apply_rating(
+                self.song_key, user_id, rating_value, interaction.guild_id
+            )
         if not song:
             await interaction.response.send_message(
                 "This song is no longer available.", ephemeral=True
             )
             return
 
-        embed = build_song_embed(
-            song["title"],
-            song["artist"],
-            song["spotify_url"],
-            song["apple_url"],
-            avg,
-            count,
-        )
+        leaderboard_engine.update(song)
+        leaderboard_sync.publish(song.song_key)
+        similar_songs.record(self.song_key, user_id, rating_value)
+
+        embed = build_song_embed_from_row(self.song_key, song)
 
         try:
             await interaction.response.edit_message(embed=embed, view=self)
         except discord.InteractionResponded:
             await interaction.edit_original_response(embed=embed, view=self)
 
-    @discord.ui.button(label="1", style=discord.ButtonStyle.secondary)
-    async def rate_1(self, interaction, button):
-        await self.handle_rating(interaction, 1)
-
-    @discord.ui.button(label="2", style=discord.ButtonStyle.secondary)
-    async def rate_2(self, interaction, button):
-        await self.handle_rating(interaction, 2)
-
-    @discord.ui.button(label="3", style=discord.ButtonStyle.secondary)
-    async def rate_3(self, interaction, button):
-        await self.handle_rating(interaction, 3)
-
-    @discord.ui.button(label="4", style=discord.ButtonStyle.secondary)
-    async def rate_4(self, interaction, button):
-        await self.handle_rating(interaction, 4)
-
-    @discord.ui.button(label="5", style=discord.ButtonStyle.primary)
-    async def rate_5(self, interaction, button):
-        await self.handle_rating(interaction, 5)
-
 
 # ============================================================
 # RESTORE PERSISTENT VIEWS
 # ============================================================
 
+view_sweeper_task: Optional[asyncio.Task] = None
+
+
 async def restore_persistent_views():
-    await bot.wait_until_ready()
-    rows = await db_get_views()
+    # Constant cost: the dynamic handler covers every stored message.
+    bot.add_dynamic_items(RatingButton)
 
-    for row in rows:
-        channel = bot.get_channel(row["channel_id"])
-        if not channel or not isinstance(channel, discord.TextChannel):
-            continue
+    global view_sweeper_task
+    if view_sweeper_task is None or view_sweeper_task.done():
+        view_sweeper_task = asyncio.ensure_future(view_sweep_loop())
+
+
+async def message_is_gone(view: StoredView, sem: asyncio.Semaphore) -> bool:
+    channel = bot.get_channel(view.channel_id)
+    if channel is None:
+        # Not in cache (another shard, or the guild is unavailable); keep it.
+        return False
 
+    async with sem:
         try:
-            await channel.fetch_message(row["message_id"])
+            await channel.fetch_message(view.message_id)
+        except discord.NotFound:
+            return True
         except Exception:
-            continue
+            return False
+    return False
+
+
+async def sweep_deleted_views():
+    sem = asyncio.Semaphore(VIEW_SWEEP_CONCURRENCY)
+    after = 0
+    removed = 0
+    # A shard worker only sweeps its own guilds; the others cover the rest.
+    shard_count = int(SHARD_COUNT) if OWNED_SHARDS else None
 
-        view = RatingView(song_key=row["song_key"], timeout=None)
-        bot.add_view(view, message_id=row["message_id"])
+    while True:
+        async with database.session() as db:
+            views = await db.views_page(after, VIEW_SWEEP_BATCH, shard_count, OWNED_SHARDS)
+        if not views:
+            break
+        after = views[-1].message_id
+
+        gone = await asyncio.gather(*(message_is_gone(view, sem) for view in views))
+        dead = [view.message_id for view, is_gone in zip(views, gone) if is_gone]
+        if dead:
+            async with database.session() as db:
+                await db.delete_views(dead)
+            removed += len(dead)
+
+    if removed:
+        print(f"Pruned {removed} views for deleted messages.")
+
+
+async def view_sweep_loop():
+    await bot.wait_until_ready()
+    # Stay out of the way of startup traffic and of quick restarts.
+    await asyncio.sleep(600)
+    while True:
+        try:
+            await sweep_deleted_views()
+        except Exception as e:
+            print("View sweep error:", e)
+        await asyncio.sleep(VIEW_SWEEP_INTERVAL_HOURS * 3600)
 
 
 # ============================================================
@@ -413,10 +962,16 @@ async def restore_persistent_views():
 
 @bot.tree.command(name="recommend", description="Recommend a song by name or link.")
 @app_commands.describe(query="Song name or link")
+@timed(command_latency, "recommend")
 async def recommend(interaction: discord.Interaction, query: str):
     await interaction.response.defer()
 
-    spotify_data = spotify_search_track(query)
+    # Guilds recommending the same trending song share one lookup.
+    link = parse_spotify_link(query)
+    lookup_key = link if link else normalize_query(query)
+    spotify_data, given_apple_url = await track_lookups.do(
+        lookup_key, lambda: resolve_track_query(query)
+    )
     if not spotify_data:
         await interaction.followup.send("I couldn't find a Spotify track for that query.")
         return
@@ -425,126 +980,281 @@ async def recommend(interaction: discord.Interaction, query: str):
     artist = spotify_data["artist"]
     spotify_url = spotify_data["spotify_url"]
 
-    apple_url = find_apple_music_track(f"{title} {artist}")
-
     song_key = spotify_url
 
-    await db_upsert_song(song_key, title, artist, spotify_url, apple_url)
+    async def load_song() -> Optional[Song]:
+        async with database.session() as db:
+            return await db.get_or_create_song(song_key, title, artist, spotify_url)
+
+    song = await song_loads.do(song_key, load_song)
+    # Applied per caller: the shared load only knows the first caller's query.
+    if song and song.apple_url is None and given_apple_url:
+        # A pasted Apple Music link is taken as is; no Bing scrape.
+        async with database.session() as db:
+            song = await db.set_apple_url(song_key, given_apple_url) or song
+    if not song:
+        await interaction.followup.send("Couldn't load that song right now. Try again.")
+        return
 
-    song = await db_get_song(song_key)
-    avg = song["average"]
-    count = song["count"]
+    apple_url = song.apple_url
+    avg = song.average
+    count = song.count
+    needs_apple = apple_url is None and not song.apple_miss
 
-    embed = build_song_embed(title, artist, spotify_url, apple_url, avg, count)
+    embed = build_song_embed(title, artist, spotify_url, apple_url, avg, count,
+                             apple_pending=needs_apple)
     view = RatingView(song_key=song_key, timeout=None)
 
     msg = await interaction.followup.send(embed=embed, view=view)
-    await db_add_view(msg.channel.id, msg.id, song_key)
+    view_writer.add(msg.channel.id, msg.id, song_key, interaction.guild_id)
+
+    if needs_apple:
+        queued = apple_resolver.submit(song_key, title, artist,
+                                       target=(msg.channel.id, msg.id))
+        if not queued:
+            embed = build_song_embed(title, artist, spotify_url, None, avg, count)
+            await msg.edit(embed=embed)
+
+
+class MyRatingsView(discord.ui.View):
+    def __init__(self, user_id: str, sort: str, timeout: Optional[float] = 300):
+        super().__init__(timeout=timeout)
+        self.user_id = user_id
+        self.sort = sort
+        self.first: Optional[Tuple[Any, str]] = None
+        self.last: Optional[Tuple[Any, str]] = None
+        self.has_prev = False
+        self.has_next = False
+        self.page = 1
+
+    async def load(self, cursor: Optional[Tuple[Any, str]] = None,
+                   backward: bool = False) -> Optional[discord.Embed]:
+        async with database.session() as db:
+            rows, has_more = await db.user_ratings_page(
+                self.user_id, self.sort, cursor, backward, MYRATINGS_PAGE_SIZE
+            )
+        if not rows:
+            return None
+
+        self.first = (rows[0].sort_value, rows[0].song_key)
+        self.last = (rows[-1].sort_value, rows[-1].song_key)
+        if backward:
+            self.has_prev, self.has_next = has_more, True
+        else:
+            self.has_prev, self.has_next = cursor is not None, has_more
+
+        self.prev_page.disabled = not self.has_prev
+        self.next_page.disabled = not self.has_next
+
+        lines = []
+        for row in rows:
+            lines.append(
+                f"**{row.title}** — {row.artist}\n"
+                f"Your rating: {row.rating}/5 | Avg: {row.average:.2f}/5 ({row.count})\n"
+                f"{row.spotify_url}"
+            )
+
+        embed = discord.Embed(
+            title="Your Ratings",
+            description="\n\n".join(lines),
+            color=0x1DB954,
+        )
+        embed.set_footer(text=f"Page {self.page} · sorted by {self.sort}")
+        return embed
+
+    def no_ratings(self) -> discord.Embed:
+        # The ratings went away after the first page was shown.
+        self.prev_page.disabled = True
+        self.next_page.disabled = True
+        return discord.Embed(
+            title="Your Ratings",
+            description="You haven't rated any songs yet.",
+            color=0x1DB954,
+        )
+
+    @discord.ui.button(label="◀ Prev", style=discord.ButtonStyle.secondary, disabled=True)
+    async def prev_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.page -= 1
+        embed = await self.load(self.first, backward=True) or self.no_ratings()
+        await interaction.response.edit_message(embed=embed, view=self)
+
+    @discord.ui.button(label="Next ▶", style=discord.ButtonStyle.secondary, disabled=True)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.page += 1
+        embed = await self.load(self.last) or self.no_ratings()
+        await interaction.response.edit_message(embed=embed, view=self)
 
 
 @bot.tree.command(name="myratings", description="Show songs you have rated.")
-async def myratings(interaction: discord.Interaction):
+@app_commands.describe(sort="How to order your ratings")
+@app_commands.choices(sort=[
+    app_commands.Choice(name="Title", value="title"),
+    app_commands.Choice(name="Your rating", value="rating"),
+    app_commands.Choice(name="Most recent", value="recent"),
+])
+@timed(command_latency, "myratings")
+async def myratings(interaction: discord.Interaction, sort: str = "title"):
     await interaction.response.defer(ephemeral=True)
 
     user_id = str(interaction.user.id)
 
-    async with db_pool.acquire() as conn:
-        rows = await conn.fetch("""
-            SELECT s.*, r.rating
-            FROM ratings r
-            JOIN songs s ON s.song_key = r.song_key
-            WHERE r.user_id=$1
-            ORDER BY s.title
-            LIMIT 20;
-        """, user_id)
-
-    if not rows:
+    view = MyRatingsView(user_id, sort)
+    embed = await view.load()
+    if embed is None:
         await interaction.followup.send("You haven't rated any songs yet.", ephemeral=True)
         return
 
+    await interaction.followup.send(embed=embed, view=view, ephemeral=True)
+
+
+async def top_entries(k: int) -> List[LeaderboardEntry]:
+    if leaderboard_engine.loaded:
+        return leaderboard_engine.top(k)
+    async with database.session() as db:
+        songs = await db.top_songs(k, leaderboard_scoring.sql())
+    return [leaderboard_engine.make_entry(song) for song in songs]
+
+
+def leaderboard_lines(entries: List[LeaderboardEntry]) -> str:
     lines = []
-    for row in rows:
+    for idx, entry in enumerate(entries, start=1):
         lines.append(
-            f"**{row['title']}** — {row['artist']}\n"
-            f"Your rating: {row['rating']}/5 | Avg: {row['average']:.2f}/5 ({row['count']})\n"
-            f"{row['spotify_url']}"
+            f"**#{idx}** — **{entry.title}** — {entry.artist}\n"
+            f"Avg: {entry.average:.2f}/5 ({entry.count})\n"
+            f"{entry.spotify_url}"
         )
-
-    embed = discord.Embed(
-        title="Your Ratings",
-        description="\n\n".join(lines),
-        color=0x1DB954,
-    )
-    await interaction.followup.send(embed=embed, ephemeral=True)
+    return "\n\n".join(lines)
 
 
 @bot.tree.command(name="leaderboard", description="Show top rated songs.")
+@timed(command_latency, "leaderboard")
 async def leaderboard(interaction: discord.Interaction):
     await interaction.response.defer()
 
-    async with db_pool.acquire() as conn:
-        rows = await conn.fetch("""
-            SELECT *
-            FROM songs
-            WHERE count > 0
-            ORDER BY average DESC, count DESC
-            LIMIT 10;
-        """)
-
-    if not rows:
+    entries = await top_entries(10)
+    if not entries:
         await interaction.followup.send("No rated songs yet.")
         return
 
-    lines = []
-    for idx, row in enumerate(rows, start=1):
-        lines.append(
-            f"**#{idx}** — **{row['title']}** — {row['artist']}\n"
-            f"Avg: {row['average']:.2f}/5 ({row['count']})\n"
-            f"{row['spotify_url']}"
+    embed = discord.Embed(
+        title="Top Rated Songs",
+        description=leaderboard_lines(entries),
+        color=0x1DB954,
+    )
+    await interaction.followup.send(embed=embed)
+
+
+# ============================================================
+# TRENDING
+# ============================================================
+
+@bot.tree.command(name="trending", description="Show what's hot in this server or everywhere.")
+@app_commands.describe(window="How far back to look", scope="This server or all servers")
+@app_commands.choices(
+    window=[
+        app_commands.Choice(name="Today", value="today"),
+        app_commands.Choice(name="This week", value="week"),
+        app_commands.Choice(name="This month", value="month"),
+    ],
+    scope=[
+        app_commands.Choice(name="This server", value="server"),
+        app_commands.Choice(name="Global", value="global"),
+    ],
+)
+@timed(command_latency, "trending")
+async def trending(interaction: discord.Interaction, window: str = "week", scope: str = "server"):
+    await interaction.response.defer()
+
+    days, label = TRENDING_WINDOWS.get(window, TRENDING_WINDOWS["week"])
+    since = datetime.now(timezone.utc).date() - timedelta(days=days - 1)
+    # DMs have no server chart.
+    in_server = scope == "server" and interaction.guild_id is not None
+    scope_id = interaction.guild_id if in_server else GLOBAL_SCOPE
+
+    async with database.session() as db:
+        songs = await db.trending_songs(
+            scope_id, since, 10, leaderboard_scoring.sql("t.rating_sum", "t.count")
         )
 
+    if not songs:
+        await interaction.followup.send(f"No songs rated {label} yet.")
+        return
+
+    entries = [leaderboard_engine.make_entry(song) for song in songs]
     embed = discord.Embed(
-        title="Top Rated Songs",
-        description="\n\n".join(lines),
+        title=f"Trending {'in this server' if in_server else 'everywhere'} {label}",
+        description=leaderboard_lines(entries),
         color=0x1DB954,
     )
     await interaction.followup.send(embed=embed)
+
+
+# ============================================================
+# FOR YOU
+# ============================================================
+
+async def entries_for(song_keys: List[str]) -> List[LeaderboardEntry]:
+    entries = {key: leaderboard_engine.get(key) for key in song_keys}
+    missing = [key for key, entry in entries.items() if entry is None]
+    if missing:
+        # Only before the leaderboard has loaded.
+        async with database.session() as db:
+            for key in missing:
+                song = await db.get_song(key)
+                if song is not None:
+                    entries[key] = leaderboard_engine.make_entry(song)
+    return [entries[key] for key in song_keys if entries[key] is not None]
+
+
+@bot.tree.command(name="foryou", description="Songs picked for you from your ratings.")
+@timed(command_latency, "foryou")
+async def foryou(interaction: discord.Interaction):
+    await interaction.response.defer()
+    user_id = str(interaction.user.id)
+
+    picks = similar_songs.for_user(user_id, 10)
+    entries = await entries_for([song_key for song_key, _ in picks])
+    title = "Picked For You"
+    footer = "Based on songs you rated highly and what others who liked them rated."
+
+    if not entries:
+        # No history yet, or nothing liked that others have rated too.
+        rated = similar_songs.rated_by(user_id)
+        entries = [e for e in await top_entries(10 + len(rated)) if e.song_key not in rated][:10]
+        title = "Top Rated Songs"
+        footer = "Rate a few songs with the buttons to get picks of your own."
+
+    if not entries:
+        await interaction.followup.send("No rated songs yet.")
+        return
+
+    embed = discord.Embed(title=title, description=leaderboard_lines(entries), color=0x1DB954)
+    embed.set_footer(text=footer)
+    await interaction.followup.send(embed=embed)
+
+
 # ============================================================
 # EXTRA COMMANDS
 # ============================================================
 
 @bot.tree.command(name="search", description="Search Spotify and show multiple results.")
 @app_commands.describe(query="Song name to search")
+@timed(command_latency, "search")
 async def search(interaction: discord.Interaction, query: str):
     await interaction.response.defer()
 
-    token = get_spotify_access_token()
-    if not token:
-        await interaction.followup.send("Spotify authentication failed.")
-        return
-
-    resp = requests.get(
-        SPOTIFY_SEARCH_URL,
-        params={"q": query, "type": "track", "limit": 5},
-        headers={"Authorization": f"Bearer {token}"},
-        timeout=10,
-    )
-
-    if resp.status_code != 200:
+    items = await spotify_search_tracks(query, limit=5)
+    if items is None:
         await interaction.followup.send("Spotify search failed.")
         return
 
-    items = resp.json().get("tracks", {}).get("items", [])
     if not items:
         await interaction.followup.send("No results found.")
         return
 
     lines = []
     for idx, track in enumerate(items, start=1):
-        title = track["name"]
-        artist = ", ".join(a["name"] for a in track["artists"])
-        url = track["external_urls"]["spotify"]
-        lines.append(f"**{idx}. {title}** — {artist}\n{url}")
+        lines.append(f"**{idx}. {track['title']}** — {track['artist']}\n{track['spotify_url']}")
 
     embed = discord.Embed(
         title=f"Search results for: {query}",
@@ -557,47 +1267,26 @@ async def search(interaction: discord.Interaction, query: str):
 
 @bot.tree.command(name="artist", description="Show top tracks for an artist.")
 @app_commands.describe(name="Artist name")
+@timed(command_latency, "artist")
 async def artist(interaction: discord.Interaction, name: str):
     await interaction.response.defer()
 
-    token = get_spotify_access_token()
-    if not token:
-        await interaction.followup.send("Spotify authentication failed.")
-        return
-
-    resp = requests.get(
-        SPOTIFY_SEARCH_URL,
-        params={"q": name, "type": "artist", "limit": 1},
-        headers={"Authorization": f"Bearer {token}"},
-        timeout=10,
-    )
-
-    items = resp.json().get("artists", {}).get("items", [])
-    if not items:
+    artist_data = await spotify_search_artist(name)
+    if not artist_data:
         await interaction.followup.send("Artist not found.")
         return
 
-    artist_data = items[0]
     artist_id = artist_data["id"]
     artist_name = artist_data["name"]
 
-    top_resp = requests.get(
-        f"https://api.spotify.com/v1/artists/{artist_id}/top-tracks",
-        params={"market": "US"},
-        headers={"Authorization": f"Bearer {token}"},
-        timeout=10,
-    )
-
-    tracks = top_resp.json().get("tracks", [])
+    tracks = await catalog_store.artist_top_tracks(artist_id)
     if not tracks:
         await interaction.followup.send("No top tracks found.")
         return
 
     lines = []
     for idx, t in enumerate(tracks[:10], start=1):
-        title = t["name"]
-        url = t["external_urls"]["spotify"]
-        lines.append(f"**{idx}. {title}**\n{url}")
+        lines.append(f"**{idx}. {t['title']}**\n{t['spotify_url']}")
 
     embed = discord.Embed(
         title=f"Top Tracks — {artist_name}",
@@ -610,118 +1299,343 @@ async def artist(interaction: discord.Interaction, name: str):
 
 @bot.tree.command(name="album", description="Show tracks from an album.")
 @app_commands.describe(name="Album name")
+@timed(command_latency, "album")
 async def album(interaction: discord.Interaction, name: str):
     await interaction.response.defer()
 
-    token = get_spotify_access_token()
-    if not token:
-        await interaction.followup.send("Spotify authentication failed.")
-        return
-
-    resp = requests.get(
-        SPOTIFY_SEARCH_URL,
-        params={"q": name, "type": "album", "limit": 1},
-        headers={"Authorization": f"Bearer {token}"},
-        timeout=10,
-    )
-
-    items = resp.json().get("albums", {}).get("items", [])
-    if not items:
+    album_data = await spotify_search_album(name)
+    if not album_data:
         await interaction.followup.send("Album not found.")
         return
 
-    album_data = items[0]
     album_id = album_data["id"]
     album_name = album_data["name"]
-    album_url = album_data["external_urls"]["spotify"]
+    album_url = album_data["url"]
 
-    tracks_resp = requests.get(
-        f"https://api.spotify.com/v1/albums/{album_id}/tracks",
-        headers={"Authorization": f"Bearer {token}"},
-        timeout=10,
-    )
-
-    tracks = tracks_resp.json().get("items", [])
+    tracks = await catalog_store.album_tracks(album_id)
     if not tracks:
         await interaction.followup.send("No tracks found.")
         return
 
     lines = []
     for idx, t in enumerate(tracks, start=1):
-        title = t["name"]
-        lines.append(f"**{idx}. {title}**")
+        lines.append(f"**{idx}. {t['title']}**")
+
+    embeds = []
+    pages = chunk_lines(lines, "\n")
+    for page_no, page in enumerate(pages, start=1):
+        embed = discord.Embed(
+            title=f"Album — {album_name}",
+            description=page,
+            color=0x1DB954,
+        )
+        embed.add_field(name="Spotify", value=album_url, inline=False)
+        if len(pages) > 1:
+            embed.set_footer(text=f"Page {page_no}/{len(pages)} · {len(tracks)} tracks")
+        embeds.append(embed)
+
+    if len(embeds) == 1:
+        await interaction.followup.send(embed=embeds[0])
+    else:
+        await interaction.followup.send(embed=embeds[0], view=EmbedPagerView(embeds))
+
+
+@bot.tree.command(name="random", description="Get a random popular track.")
+@app_commands.describe(genre="Pick from one genre (random genre if omitted)")
+@app_commands.choices(genre=[app_commands.Choice(name=g, value=g) for g in GENRES])
+@timed(command_latency, "random")
+async def random_track(interaction: discord.Interaction, genre: Optional[str] = None):
+    await interaction.response.defer()
+
+    picked = await genre_pools.pick(interaction.channel_id, genre)
+    if not picked:
+        await interaction.followup.send("No tracks found.")
+        return
+
+    genre, track = picked
 
     embed = discord.Embed(
-        title=f"Album — {album_name}",
-        description="\n".join(lines),
+        title="Random Track",
+        description=f"**{track['title']}** — {track['artist']}\nGenre: {genre}",
         color=0x1DB954,
     )
-    embed.add_field(name="Spotify", value=album_url, inline=False)
+    embed.add_field(name="Spotify", value=track["spotify_url"], inline=False)
 
     await interaction.followup.send(embed=embed)
 
 
-@bot.tree.command(name="random", description="Get a random popular track.")
-async def random_track(interaction: discord.Interaction):
-    await interaction.response.defer()
+# ============================================================
+# BULK IMPORT
+# ============================================================
 
-    token = get_spotify_access_token()
-    if not token:
-        await interaction.followup.send("Spotify authentication failed.")
+async def collect_import_tracks(source: str) -> Tuple[Optional[List[Dict[str, Any]]], str]:
+    link = parse_spotify_link(source)
+    if link:
+        kind, item_id = link
+        if kind == "playlist":
+            return await spotify_playlist_tracks(item_id, priority=PRIORITY_BACKGROUND), "playlist"
+        if kind == "album":
+            album_tracks = await catalog_store.album_tracks(item_id)
+            if album_tracks is None:
+                return None, "album"
+            # Album track objects lack artwork; fetch full tracks 50 IDs at a time.
+            ids = [t["id"] for t in album_tracks]
+            found = await spotify_get_tracks(ids, priority=PRIORITY_BACKGROUND)
+            return [found[i] for i in ids if i in found], "album"
+        found = await spotify_get_tracks([item_id], priority=PRIORITY_BACKGROUND)
+        return list(found.values()), "track"
+
+    queries = [q.strip() for q in re.split(r"[;\n]", source) if q.strip()]
+    # Background lane, a few at a time: an import must not queue ahead of
+    # interactive commands.
+    sem = asyncio.Semaphore(IMPORT_SEARCH_CONCURRENCY)
+
+    async def search_one(query: str) -> Optional[Dict[str, Any]]:
+        async with sem:
+            return await spotify_search_track(query, priority=PRIORITY_BACKGROUND)
+
+    results = await asyncio.gather(*(search_one(q) for q in queries[:IMPORT_MAX_QUERIES]))
+    return [r for r in results if r], "query list"
+
+
+@bot.tree.command(name="import", description="Bulk add songs from a playlist, album, or list of queries.")
+@app_commands.describe(source="Spotify playlist/album link, or song queries separated by ';'")
+@app_commands.default_permissions(manage_guild=True)
+@timed(command_latency, "import")
+async def import_songs(interaction: discord.Interaction, source: str):
+    await interaction.response.defer(ephemeral=True)
+
+    tracks, kind = await collect_import_tracks(source)
+    if not tracks:
+        await interaction.followup.send(f"Nothing to import from that {kind}.", ephemeral=True)
         return
 
-    import random
-    genres = ["pop", "rock", "rap", "edm", "indie", "metal", "country", "rnb"]
-    genre = random.choice(genres)
+    try:
+        async with database.session() as db:
+            new_keys = await db.insert_songs(tracks)
+    except Exception as e:
+        print("DB BULK IMPORT ERROR:", e)
+        await interaction.followup.send("Import failed while writing songs.", ephemeral=True)
+        return
 
-    resp = requests.get(
-        SPOTIFY_SEARCH_URL,
-        params={"q": f"genre:{genre}", "type": "track", "limit": 50},
-        headers={"Authorization": f"Bearer {token}"},
-        timeout=10,
+    # Apple Music links are resolved later, without crowding out /recommend.
+    by_key = {t["spotify_url"]: t for t in tracks}
+    queued = 0
+    for song_key in new_keys:
+        track = by_key[song_key]
+        if apple_resolver.submit(song_key, track["title"], track["artist"], background=True):
+            queued += 1
+
+    await interaction.followup.send(
+        f"Imported {len(by_key)} tracks from the {kind} ({len(new_keys)} new, "
+        f"{queued} queued for Apple Music).",
+        ephemeral=True,
     )
 
-    items = resp.json().get("tracks", {}).get("items", [])
-    if not items:
-        await interaction.followup.send("No tracks found.")
-        return
 
-    track = random.choice(items)
+# ============================================================
+# ADMIN STATS
+# ============================================================
+
+def format_latency(histogram: Histogram, *labels: str) -> str:
+    count = histogram.count(*labels)
+    p50 = histogram.quantile(0.5, *labels) or 0.0
+    p95 = histogram.quantile(0.95, *labels) or 0.0
+    return f"{count} × p50 {p50 * 1000:.0f}ms / p95 {p95 * 1000:.0f}ms"
+
+
+def build_stats_embed() -> discord.Embed:
+    embed = discord.Embed(title="Bot Stats", color=0x1DB954)
+
+    commands_lines = [
+        f"`/{labels[0]}` {format_latency(command_latency, *labels)}"
+        for labels in sorted(command_latency.series)
+    ]
+    commands_lines.append(f"rating clicks {format_latency(rating_click_latency)}")
+    embed.add_field(name="Commands", value="\n".join(commands_lines), inline=False)
+
+    outbound_lines = []
+    for labels in sorted(outbound_latency.series):
+        statuses = ", ".join(
+            f"{status}: {int(n)}"
+            for (endpoint, status), n in sorted(outbound_status.values.items())
+            if endpoint == labels[0]
+        )
+        outbound_lines.append(
+            f"`{labels[0]}` {format_latency(outbound_latency, *labels)} ({statuses})"
+        )
+    embed.add_field(
+        name="Outbound", value="\n".join(outbound_lines) or "No calls yet.", inline=False
+    )
 
-    title = track["name"]
-    artist = ", ".join(a["name"] for a in track["artists"])
-    url = track["external_urls"]["spotify"]
+    pool = read_pool_gauge()
+    embed.add_field(
+        name="Database pool",
+        value=(
+            f"In use {int(pool.get(('in_use',), 0))}/{int(pool.get(('max',), 0))}, "
+            f"acquire wait {format_latency(db_acquire_wait)}"
+        ),
+        inline=False,
+    )
 
-    embed = discord.Embed(
-        title="Random Track",
-        description=f"**{title}** — {artist}\nGenre: {genre}",
-        color=0x1DB954,
+    cache = search_cache.stats()
+    scheduler = spotify_scheduler.stats()
+    embed.add_field(
+        name="Internals",
+        value=(
+            f"Search cache {cache['entries']} entries, {cache['hit_ratio']:.0%} hits\n"
+            f"Spotify scheduler {scheduler['circuit']}, {scheduler['queued']} queued, "
+            f"{scheduler['rate_limited']} rate limited, {scheduler['shed']} shed\n"
+            f"Collapsed lookups {track_lookups.collapsed + song_loads.collapsed}, "
+            f"Apple queue {apple_resolver.stats()['queued']}\n"
+            f"For-you index {similar_songs.stats()['indexed']} songs"
+        ),
+        inline=False,
     )
-    embed.add_field(name="Spotify", value=url, inline=False)
+    return embed
 
-    await interaction.followup.send(embed=embed)
+
+@bot.tree.command(name="stats", description="Show bot latency and health stats.")
+@app_commands.default_permissions(administrator=True)
+async def stats(interaction: discord.Interaction):
+    await interaction.response.send_message(embed=build_stats_embed(), ephemeral=True)
 
 
 # ============================================================
 # BOT STARTUP
 # ============================================================
 
+def owns_command_sync() -> bool:
+    # Commands are global; the process holding shard 0 syncs them for everyone.
+    return not OWNED_SHARDS or 0 in OWNED_SHARDS
+
+
+@bot.event
+async def setup_hook():
+    # Runs once per process, unlike on_ready, which fires again on every
+    # reconnect and, with several shards, once per shard.
+    if owns_command_sync():
+        try:
+            await bot.tree.sync()
+        except Exception as e:
+            print("Slash sync error:", e)
+
+    await restore_persistent_views()
+
+
 @bot.event
 async def on_ready():
-    print(f"Logged in as {bot.user}")
-    try:
-        await bot.tree.sync()
-    except Exception as e:
-        print("Slash sync error:", e)
+    shards = SHARD_IDS or ("all" if SHARD_COUNT else "none")
+    print(f"Logged in as {bot.user} (shards: {shards})")
+
 
-    bot.loop.create_task(restore_persistent_views())
+def discord_token() -> Optional[str]:
+    return os.getenv("DISCORD_TOKEN") or os.getenv("TOKEN")
 
 
 async def main():
+    if SHARED_STATE and isinstance(database, SqliteStorage):
+        print("Running a shard range per process needs STORAGE_BACKEND=postgres.")
+        sys.exit(1)
+
     await init_db()
+    spotify_tokens.start()
+    spotify_scheduler.start()
+    apple_resolver.start()
+    rating_coalescer.start()
+    view_writer.start()
+    genre_pools.start()
+    similar_songs.start()
+
+    if METRICS_PORT:
+        try:
+            await start_metrics_server(metrics, METRICS_HOST, METRICS_PORT)
+        except OSError as e:
+            print("METRICS SERVER ERROR:", e)
+
+    token = discord_token()
+    if not token:
+        print("No DISCORD_TOKEN found.")
+        sys.exit(1)
+
+    async with bot:
+        await bot.start(token)
+
+
+# ============================================================
+# SHARD WORKER PROCESSES
+# ============================================================
+
+def recommended_shard_count(token: str) -> int:
+    request = urllib.request.Request(
+        DISCORD_GATEWAY_BOT_URL,
+        headers={"Authorization": f"Bot {token}", "User-Agent": "DiscordBot"},
+    )
+    with urllib.request.urlopen(request, timeout=10) as resp:
+        return int(json.load(resp)["shards"])
+
+
+def start_shard_worker(index: int, shard_range: str, shard_count: int,
+                       workers: int) -> subprocess.Popen:
+    env = dict(os.environ, SHARD_COUNT=str(shard_count), SHARD_IDS=shard_range)
+    # Each worker has its own Spotify token bucket, so they split the quota.
+    env["SPOTIFY_RATE_PER_SEC"] = str(float(os.getenv("SPOTIFY_RATE_PER_SEC", "10")) / workers)
+    env["SPOTIFY_BURST"] = str(max(1, int(os.getenv("SPOTIFY_BURST", "20")) // workers))
+    if METRICS_PORT:
+        env["METRICS_PORT"] = str(METRICS_PORT + index)
+    print(f"Starting worker {index} for shards {shard_range} of {shard_count}.")
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__)], env=env)
+
+
+def run_shard_workers():
+    """Start one worker process per shard range and restart any that exit."""
+    if STORAGE_BACKEND == "sqlite":
+        print("BOT_PROCESSES > 1 needs STORAGE_BACKEND=postgres.")
+        sys.exit(1)
 
-    token = os.getenv("DISCORD_TOKEN") or os.getenv("TOKEN")
+    token = discord_token()
     if not token:
         print("No DISCORD_TOKEN found.")
         sys.exit(1)
 
+    if SHARD_COUNT and SHARD_COUNT != "auto":
+        shard_count = int(SHARD_COUNT)
+    else:
+        shard_count = recommended_shard_count(token)
+    ranges = shard_ranges(shard_count, BOT_PROCESSES)
+
+    # Turn SIGTERM into SystemExit so the workers are stopped below.
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    workers = [start_shard_worker(i, r, shard_count, len(ranges)) for i, r in enumerate(ranges)]
+    try:
+        while True:
+            time.sleep(1)
+            for i, proc in enumerate(workers):
+                code = proc.poll()
+                if code is None:
+                    continue
+                print(f"Worker {i} (shards {ranges[i]}) exited with code {code}; restarting.")
+                time.sleep(5)
+                workers[i] = start_shard_worker(i, ranges[i], shard_count, len(ranges))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for proc in workers:
+            if proc.poll() is None:
+                proc.terminate()
+        for proc in workers:
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+
+def run():
+    if BOT_PROCESSES > 1 and not SHARD_IDS:
+        run_shard_workers()
+    else:
+        asyncio.run(main())
+
+
+if __name__ == "__main__":
+    run()
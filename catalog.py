@@ -0,0 +1,254 @@
+import json
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, TYPE_CHECKING, Tuple
+
+if TYPE_CHECKING:
+    import asyncpg
+
+from spotify_scheduler import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE
+
+SPOTIFY_API_URL = "https://api.spotify.com/v1"
+
+# kind -> (table, id column, payload column)
+CATALOG_TABLES = {
+    "artist": ("catalog_artists", "artist_id", "top_tracks"),
+    "album": ("catalog_albums", "album_id", "tracks"),
+}
+
+
+class CatalogEntry:
+    __slots__ = ("payload", "etag", "fetched_at")
+
+    def __init__(self, payload: List[Dict[str, Any]], etag: Optional[str], fetched_at: float):
+        self.payload = payload
+        self.etag = etag
+        self.fetched_at = fetched_at
+
+
+def catalog_track(track: Dict[str, Any], album_id: Optional[str] = None) -> Dict[str, Any]:
+    return {
+        "id": track["id"],
+        "title": track["name"],
+        "artist": ", ".join(a["name"] for a in track["artists"]),
+        "spotify_url": track["external_urls"]["spotify"],
+        "album_id": album_id or (track.get("album") or {}).get("id"),
+        "track_number": track.get("track_number"),
+    }
+
+
+# ============================================================
+# CATALOG STORE
+# ============================================================
+
+class CatalogStore:
+    """Artist top tracks and album track lists, keyed by Spotify ID.
+
+    Lookups are served from memory, then from the catalog tables. A stale
+    entry is still returned right away, and a background revalidation with
+    If-None-Match is started for it. Spotify answers 304 when nothing
+    changed, so revalidating unchanged data is cheap. Only a cold miss
+    waits on Spotify."""
+
+    def __init__(self, fetch: Callable[..., Awaitable[Any]],
+                 artist_ttl: float = 24 * 3600, album_ttl: float = 7 * 24 * 3600,
+                 max_memory: int = 2000):
+        self.fetch = fetch
+        self.ttls = {"artist": artist_ttl, "album": album_ttl}
+        self.max_memory = max_memory
+        self._memory: "OrderedDict[Tuple[str, str], CatalogEntry]" = OrderedDict()
+        self._revalidating: Dict[Tuple[str, str], asyncio.Task] = {}
+        self._pool: Optional["asyncpg.pool.Pool"] = None
+
+    def attach(self, pool: "asyncpg.pool.Pool"):
+        self._pool = pool
+
+    async def artist_top_tracks(self, artist_id: str) -> Optional[List[Dict[str, Any]]]:
+        return await self._get("artist", artist_id)
+
+    async def album_tracks(self, album_id: str) -> Optional[List[Dict[str, Any]]]:
+        return await self._get("album", album_id)
+
+    async def _get(self, kind: str, item_id: str) -> Optional[List[Dict[str, Any]]]:
+        key = (kind, item_id)
+        entry = self._memory.get(key)
+        if entry is not None:
+            self._memory.move_to_end(key)
+        else:
+            entry = await self._load(kind, item_id)
+            if entry is not None:
+                self._remember(key, entry)
+
+        if entry is None:
+            entry = await self._refresh(kind, item_id, None)
+            return entry.payload if entry else None
+
+        if time.time() - entry.fetched_at > self.ttls[kind] and key not in self._revalidating:
+            self._revalidating[key] = asyncio.ensure_future(self._revalidate(kind, item_id, entry))
+
+        return entry.payload
+
+    async def _revalidate(self, kind: str, item_id: str, entry: CatalogEntry):
+        try:
+            await self._refresh(kind, item_id, entry)
+        except Exception as e:
+            print("Catalog revalidate error:", e)
+        finally:
+            self._revalidating.pop((kind, item_id), None)
+
+    async def _refresh(self, kind: str, item_id: str,
+                       current: Optional[CatalogEntry]) -> Optional[CatalogEntry]:
+        etag = current.etag if current else None
+        # A cold miss has a user waiting on it; revalidation does not.
+        priority = PRIORITY_BACKGROUND if current else PRIORITY_INTERACTIVE
+        if kind == "artist":
+            result = await self._fetch_artist(item_id, etag, priority)
+        else:
+            result = await self._fetch_album(item_id, etag, priority)
+
+        if result is None:
+            return current
+        if result == "not-modified":
+            current.fetched_at = time.time()
+            await self._touch(kind, item_id)
+            return current
+
+        payload, new_etag = result
+        entry = CatalogEntry(payload, new_etag, time.time())
+        self._remember((kind, item_id), entry)
+        await self._store(kind, item_id, entry)
+        return entry
+
+    # --------------------------------------------------------
+    # SPOTIFY
+    # --------------------------------------------------------
+
+    async def _fetch_artist(self, artist_id: str, etag: Optional[str], priority: int):
+        headers = {"If-None-Match": etag} if etag else None
+        resp = await self.fetch(
+            f"{SPOTIFY_API_URL}/artists/{artist_id}/top-tracks",
+            params={"market": "US"},
+            headers=headers,
+            priority=priority,
+        )
+        if resp is None:
+            return None
+        if resp.status_code == 304:
+            return "not-modified"
+        if resp.status_code != 200:
+            print("Spotify top tracks failed:", resp.status_code, resp.text)
+            return None
+
+        tracks = [catalog_track(t) for t in resp.json().get("tracks", [])]
+        return tracks, resp.headers.get("ETag")
+
+    async def _fetch_album(self, album_id: str, etag: Optional[str], priority: int):
+        headers = {"If-None-Match": etag} if etag else None
+        resp = await self.fetch(
+            f"{SPOTIFY_API_URL}/albums/{album_id}/tracks",
+            params={"limit": 50},
+            headers=headers,
+            priority=priority,
+        )
+        if resp is None:
+            return None
+        if resp.status_code == 304:
+            return "not-modified"
+        if resp.status_code != 200:
+            print("Spotify album tracks failed:", resp.status_code, resp.text)
+            return None
+
+        new_etag = resp.headers.get("ETag")
+        page = resp.json()
+        tracks = [catalog_track(t, album_id) for t in page.get("items", [])]
+
+        # Long albums span several pages; `next` is a full URL.
+        while page.get("next"):
+            resp = await self.fetch(page["next"], priority=priority)
+            if resp is None or resp.status_code != 200:
+                return None
+            page = resp.json()
+            tracks.extend(catalog_track(t, album_id) for t in page.get("items", []))
+
+        return tracks, new_etag
+
+    # --------------------------------------------------------
+    # STORAGE
+    # --------------------------------------------------------
+
+    def _remember(self, key: Tuple[str, str], entry: CatalogEntry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory:
+            self._memory.popitem(last=False)
+
+    async def _load(self, kind: str, item_id: str) -> Optional[CatalogEntry]:
+        if self._pool is None:
+            return None
+        table, id_col, payload_col = CATALOG_TABLES[kind]
+        try:
+            async with self._pool.acquire() as conn:
+                row = await conn.fetchrow(f"""
+                    SELECT {payload_col} AS payload, etag,
+                           EXTRACT(EPOCH FROM fetched_at) AS fetched_at
+                    FROM {table}
+                    WHERE {id_col}=$1;
+                """, item_id)
+        except Exception as e:
+            print("CATALOG LOAD ERROR:", e)
+            return None
+
+        if not row:
+            return None
+        return CatalogEntry(json.loads(row["payload"]), row["etag"], float(row["fetched_at"]))
+
+    async def _store(self, kind: str, item_id: str, entry: CatalogEntry):
+        if self._pool is None:
+            return
+        table, id_col, payload_col = CATALOG_TABLES[kind]
+        tracks = entry.payload
+        try:
+            async with self._pool.acquire() as conn:
+                async with conn.transaction():
+                    await conn.execute(f"""
+                        INSERT INTO {table} ({id_col}, {payload_col}, etag, fetched_at)
+                        VALUES ($1, $2::jsonb, $3, now())
+                        ON CONFLICT ({id_col})
+                        DO UPDATE SET {payload_col} = EXCLUDED.{payload_col},
+                                      etag = EXCLUDED.etag,
+                                      fetched_at = EXCLUDED.fetched_at;
+                    """, item_id, json.dumps(tracks), entry.etag)
+
+                    await conn.execute("""
+                        INSERT INTO catalog_tracks
+                            (track_id, title, artist, spotify_url, album_id, fetched_at)
+                        SELECT * , now()
+                        FROM unnest($1::text[], $2::text[], $3::text[], $4::text[], $5::text[])
+                        ON CONFLICT (track_id)
+                        DO UPDATE SET title = EXCLUDED.title,
+                                      artist = EXCLUDED.artist,
+                                      spotify_url = EXCLUDED.spotify_url,
+                                      album_id = COALESCE(EXCLUDED.album_id, catalog_tracks.album_id),
+                                      fetched_at = EXCLUDED.fetched_at;
+                    """,
+                        [t["id"] for t in tracks],
+                        [t["title"] for t in tracks],
+                        [t["artist"] for t in tracks],
+                        [t["spotify_url"] for t in tracks],
+                        [t["album_id"] for t in tracks],
+                    )
+        except Exception as e:
+            print("CATALOG STORE ERROR:", e)
+
+    async def _touch(self, kind: str, item_id: str):
+        if self._pool is None:
+            return
+        table, id_col, _ = CATALOG_TABLES[kind]
+        try:
+            async with self._pool.acquire() as conn:
+                await conn.execute(
+                    f"UPDATE {table} SET fetched_at = now() WHERE {id_col}=$1", item_id
+                )
+        except Exception as e:
+            print("CATALOG TOUCH ERROR:", e)
@@ -0,0 +1,138 @@
+import time
+import random
+import asyncio
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+GENRES = ["pop", "rock", "rap", "edm", "indie", "metal", "country", "rnb"]
+
+
+class GenrePool:
+    def __init__(self):
+        self.tracks: List[Dict[str, Any]] = []
+        self.filled_at = 0.0
+        self.refill_task: Optional[asyncio.Task] = None
+
+
+# ============================================================
+# PREWARMED GENRE POOLS FOR /random
+# ============================================================
+
+class GenrePoolService:
+    """Keeps a few hundred candidate tracks per genre in memory, so /random
+    is answered without any outbound call. Picks drain the pool. A pool that
+    drops below low_watermark, or is older than max_age, is refilled in the
+    background. Each channel remembers its recent picks to avoid repeats."""
+
+    def __init__(self,
+                 fetch_page: Callable[[str, int, int], Awaitable[Optional[List[Dict[str, Any]]]]],
+                 genres: Optional[List[str]] = None, target_size: int = 300,
+                 low_watermark: int = 100, max_age: float = 6 * 3600,
+                 recent_per_channel: int = 50, page_size: int = 50):
+        self.fetch_page = fetch_page
+        self.genres = list(genres or GENRES)
+        self.target_size = target_size
+        self.low_watermark = low_watermark
+        self.max_age = max_age
+        self.page_size = page_size
+        self.recent_per_channel = recent_per_channel
+        self._pools: Dict[str, GenrePool] = {g: GenrePool() for g in self.genres}
+        self._recent: Dict[int, Deque[str]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._maintain_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _maintain_loop(self):
+        while True:
+            for genre in self.genres:
+                if self._needs_refill(self._pools[genre]):
+                    # One genre at a time so prewarming doesn't burst the quota.
+                    await self._schedule_refill(genre)
+            await asyncio.sleep(60)
+
+    def _needs_refill(self, pool: GenrePool) -> bool:
+        return (
+            len(pool.tracks) < self.low_watermark
+            or time.time() - pool.filled_at > self.max_age
+        )
+
+    def _schedule_refill(self, genre: str) -> asyncio.Task:
+        pool = self._pools[genre]
+        if pool.refill_task is None or pool.refill_task.done():
+            pool.refill_task = asyncio.ensure_future(self._refill(genre))
+        return pool.refill_task
+
+    async def _refill(self, genre: str):
+        seen = set()
+        tracks: List[Dict[str, Any]] = []
+        for offset in range(0, self.target_size, self.page_size):
+            try:
+                page = await self.fetch_page(genre, offset, self.page_size)
+            except Exception as e:
+                print("Genre pool refill error:", genre, e)
+                page = None
+            if not page:
+                break
+            for track in page:
+                if track["spotify_url"] not in seen:
+                    seen.add(track["spotify_url"])
+                    tracks.append(track)
+
+        if tracks:
+            pool = self._pools[genre]
+            pool.tracks = tracks
+            pool.filled_at = time.time()
+
+    async def pick(self, channel_id: int,
+                   genre: Optional[str] = None) -> Optional[Tuple[str, Dict[str, Any]]]:
+        if genre is None:
+            ready = [g for g in self.genres if self._pools[g].tracks]
+            genre = random.choice(ready or self.genres)
+        elif genre not in self._pools:
+            return None
+
+        pool = self._pools[genre]
+        if not pool.tracks:
+            # Cold pool (e.g. right after startup): wait for its first fill.
+            await self._schedule_refill(genre)
+            if not pool.tracks:
+                return None
+
+        track = self._take(pool, self._recent.setdefault(
+            channel_id, deque(maxlen=self.recent_per_channel)
+        ))
+
+        if self._needs_refill(pool):
+            self._schedule_refill(genre)
+
+        return genre, track
+
+    def _take(self, pool: GenrePool, recent: Deque[str]) -> Dict[str, Any]:
+        tracks = pool.tracks
+        idx = random.randrange(len(tracks))
+        for _ in range(8):
+            if tracks[idx]["spotify_url"] not in recent:
+                break
+            idx = random.randrange(len(tracks))
+
+        # Swap-remove so draining the pool is O(1).
+        track = tracks[idx]
+        tracks[idx] = tracks[-1]
+        tracks.pop()
+
+        recent.append(track["spotify_url"])
+        return track
+
+    def stats(self) -> Dict[str, int]:
+        return {genre: len(pool.tracks) for genre, pool in self._pools.items()}
@@ -0,0 +1,133 @@
+import ssl
+import json
+import codecs
+import time
+import asyncio
+from typing import Any, Callable, Dict, Mapping, Optional
+
+import aiohttp
+from multidict import CIMultiDict
+
+
+# ============================================================
+# SHARED ASYNC HTTP CLIENT
+# ============================================================
+
+class HttpResponse:
+    def __init__(self, status_code: int, headers: Mapping[str, str], text: str):
+        self.status_code = status_code
+        self.headers = headers
+        self.text = text
+
+    def json(self) -> Any:
+        return json.loads(self.text)
+
+
+class HttpClient:
+    """One aiohttp session for every outbound call. The connector keeps
+    connections alive per host and a single SSL context is shared, so TLS
+    sessions are resumed instead of renegotiated on each request.
+
+    If set, observer(method, url, status, seconds) is called after every
+    request; status is "error" when the request raised."""
+
+    def __init__(self, limit: int = 100, limit_per_host: int = 20,
+                 keepalive_timeout: float = 30.0, default_timeout: float = 10.0,
+                 observer: Optional[Callable[[str, str, str, float], None]] = None):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.default_timeout = default_timeout
+        self.observer = observer
+        self._ssl_context = ssl.create_default_context()
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._lock = asyncio.Lock()
+
+    async def session(self) -> aiohttp.ClientSession:
+        if self._session is not None and not self._session.closed:
+            return self._session
+
+        async with self._lock:
+            if self._session is None or self._session.closed:
+                connector = aiohttp.TCPConnector(
+                    limit=self.limit,
+                    limit_per_host=self.limit_per_host,
+                    keepalive_timeout=self.keepalive_timeout,
+                    ttl_dns_cache=300,
+                    ssl=self._ssl_context,
+                )
+                self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def request(self, method: str, url: str, *,
+                      params: Optional[Dict[str, Any]] = None,
+                      data: Optional[Dict[str, Any]] = None,
+                      headers: Optional[Dict[str, str]] = None,
+                      timeout: Optional[float] = None) -> HttpResponse:
+        session = await self.session()
+        client_timeout = aiohttp.ClientTimeout(total=timeout or self.default_timeout)
+        start = time.perf_counter()
+        status = "error"
+
+        try:
+            async with session.request(
+                method,
+                url,
+                params=params,
+                data=data,
+                headers=headers,
+                timeout=client_timeout,
+            ) as resp:
+                text = await resp.text(errors="replace")
+                status = str(resp.status)
+                return HttpResponse(resp.status, CIMultiDict(resp.headers), text)
+        finally:
+            if self.observer is not None:
+                self.observer(method, url, status, time.perf_counter() - start)
+
+    async def scan(self, url: str, consume: Callable[[str], bool], *,
+                   params: Optional[Dict[str, Any]] = None,
+                   headers: Optional[Dict[str, str]] = None,
+                   timeout: Optional[float] = None,
+                   chunk_size: int = 16384) -> int:
+        """GET url and feed the decoded body to consume() chunk by chunk,
+        closing the connection as soon as it returns True. Returns the
+        status code; the body is not read unless it is 200."""
+        session = await self.session()
+        client_timeout = aiohttp.ClientTimeout(total=timeout or self.default_timeout)
+        start = time.perf_counter()
+        status = "error"
+
+        try:
+            async with session.get(
+                url,
+                params=params,
+                headers=headers,
+                timeout=client_timeout,
+            ) as resp:
+                status = str(resp.status)
+                if resp.status != 200:
+                    return resp.status
+
+                decoder = codecs.getincrementaldecoder(resp.charset or "utf-8")(errors="replace")
+                async for chunk in resp.content.iter_chunked(chunk_size):
+                    if consume(decoder.decode(chunk)):
+                        # Skip the rest of the page instead of draining it.
+                        resp.close()
+                        return resp.status
+                consume(decoder.decode(b"", final=True))
+                return resp.status
+        finally:
+            if self.observer is not None:
+                self.observer("GET", url, status, time.perf_counter() - start)
+
+    async def get(self, url: str, **kwargs) -> HttpResponse:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> HttpResponse:
+        return await self.request("POST", url, **kwargs)
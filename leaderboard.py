@@ -0,0 +1,134 @@
+import bisect
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+
+# ============================================================
+# SCORING
+# ============================================================
+# Bayesian average: every song starts with `prior_weight` virtual ratings
+# of `prior_mean`, so a single 5-star vote can't outrank a song with
+# hundreds of 4.8s. The prior is a fixed config value rather than the
+# live global mean so one rating never changes every other song's score.
+
+def bayesian_score(rating_sum: float, count: int,
+                   prior_mean: float, prior_weight: float) -> float:
+    return (prior_mean * prior_weight + rating_sum) / (prior_weight + count)
+
+
+class LeaderboardScoring:
+    def __init__(self, mode: str = "bayesian", prior_mean: float = 3.0,
+                 prior_weight: float = 5.0):
+        if mode not in ("bayesian", "average"):
+            raise ValueError(f"Unknown leaderboard scoring mode: {mode}")
+        self.mode = mode
+        self.prior_mean = float(prior_mean)
+        self.prior_weight = float(prior_weight)
+
+    def score(self, rating_sum: float, count: int) -> float:
+        if count <= 0:
+            return 0.0
+        if self.mode == "average":
+            return rating_sum / count
+        return bayesian_score(rating_sum, count, self.prior_mean, self.prior_weight)
+
+    def sql(self, sum_col: str = "rating_sum", count_col: str = "count") -> str:
+        # Same formula as score(), for ORDER BY in SQL fallbacks.
+        if self.mode == "average":
+            return f"({sum_col} * 1.0 / NULLIF({count_col}, 0))"
+        return (
+            f"(({self.prior_mean!r} * {self.prior_weight!r} + {sum_col})"
+            f" / ({self.prior_weight!r} + {count_col}))"
+        )
+
+
+# ============================================================
+# IN-MEMORY LEADERBOARD
+# ============================================================
+
+class LeaderboardEntry:
+    __slots__ = ("song_key", "title", "artist", "spotify_url",
+                 "rating_sum", "count", "score")
+
+    def __init__(self, song_key: str, title: str, artist: str, spotify_url: str,
+                 rating_sum: int, count: int, score: float):
+        self.song_key = song_key
+        self.title = title
+        self.artist = artist
+        self.spotify_url = spotify_url
+        self.rating_sum = rating_sum
+        self.count = count
+        self.score = score
+
+    @property
+    def average(self) -> float:
+        return self.rating_sum / self.count if self.count else 0.0
+
+
+class LeaderboardEngine:
+    """Every rated song kept in a list sorted by (score, count) descending.
+    Updates find the old and new positions by binary search. top(k) is a
+    slice, so the command is served without touching the database."""
+
+    def __init__(self, scoring: LeaderboardScoring):
+        self.scoring = scoring
+        self.loaded = False
+        self._order: List[Tuple[float, int, str]] = []
+        self._entries: Dict[str, LeaderboardEntry] = {}
+
+    @staticmethod
+    def _sort_key(entry: LeaderboardEntry) -> Tuple[float, int, str]:
+        return (-entry.score, -entry.count, entry.song_key)
+
+    def rebuild(self, rows: Iterable[Any]):
+        entries = {}
+        for row in rows:
+            entry = self.make_entry(row)
+            if entry.count > 0:
+                entries[entry.song_key] = entry
+
+        self._entries = entries
+        self._order = sorted(self._sort_key(e) for e in entries.values())
+        self.loaded = True
+
+    def make_entry(self, row: Any) -> LeaderboardEntry:
+        rating_sum = int(row.rating_sum)
+        count = int(row.count)
+        return LeaderboardEntry(
+            row.song_key,
+            row.title,
+            row.artist,
+            row.spotify_url,
+            rating_sum,
+            count,
+            self.scoring.score(rating_sum, count),
+        )
+
+    def update(self, row: Any):
+        old = self._entries.pop(row.song_key, None)
+        if old is not None:
+            key = self._sort_key(old)
+            idx = bisect.bisect_left(self._order, key)
+            if idx < len(self._order) and self._order[idx] == key:
+                del self._order[idx]
+
+        entry = self.make_entry(row)
+        if entry.count <= 0:
+            return
+
+        self._entries[entry.song_key] = entry
+        bisect.insort(self._order, self._sort_key(entry))
+
+    def top(self, k: int = 10) -> List[LeaderboardEntry]:
+        return [self._entries[key[2]] for key in self._order[:k]]
+
+    def get(self, song_key: str) -> Optional[LeaderboardEntry]:
+        return self._entries.get(song_key)
+
+    def rank_of(self, song_key: str) -> Optional[int]:
+        entry = self._entries.get(song_key)
+        if entry is None:
+            return None
+        return bisect.bisect_left(self._order, self._sort_key(entry)) + 1
+
+    def __len__(self) -> int:
+        return len(self._entries)
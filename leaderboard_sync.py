@@ -0,0 +1,138 @@
+import json
+import uuid
+import asyncio
+from typing import Awaitable, Callable, Optional, Set, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import asyncpg
+
+CHANNEL = "leaderboard_changes"
+# NOTIFY payloads are capped at 8000 bytes.
+MAX_PAYLOAD = 7000
+
+
+# ============================================================
+# CROSS-PROCESS LEADERBOARD UPDATES
+# ============================================================
+
+class LeaderboardSync:
+    """Keeps the in-memory leaderboards of several bot processes in step.
+
+    A process that applies ratings publishes the changed song keys with
+    Postgres NOTIFY, batched on a short timer. Every other process LISTENs
+    on a dedicated connection and passes the keys to on_changed, which
+    reloads those songs. After the listener reconnects, on_resync runs
+    instead, because notifications sent while it was away are lost."""
+
+    def __init__(self, on_changed: Callable[[Set[str]], Awaitable[None]],
+                 on_resync: Callable[[], Awaitable[None]],
+                 flush_interval: float = 0.5, reconnect_delay: float = 5.0):
+        self.on_changed = on_changed
+        self.on_resync = on_resync
+        self.flush_interval = flush_interval
+        self.reconnect_delay = reconnect_delay
+        self.origin = uuid.uuid4().hex[:12]
+        self._pool: Optional["asyncpg.pool.Pool"] = None
+        self._connect: Optional[Callable[[], Awaitable["asyncpg.Connection"]]] = None
+        self._pending: Set[str] = set()
+        self._tasks = []
+
+    def start(self, pool: "asyncpg.pool.Pool",
+              connect: Callable[[], Awaitable["asyncpg.Connection"]]):
+        self._pool = pool
+        self._connect = connect
+        self._tasks = [
+            asyncio.ensure_future(self._listen_loop()),
+            asyncio.ensure_future(self._flush_loop()),
+        ]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        await self.flush()
+
+    def publish(self, song_key: str):
+        if self._pool is not None:
+            self._pending.add(song_key)
+
+    # --------------------------------------------------------
+    # PUBLISH
+    # --------------------------------------------------------
+
+    async def flush(self):
+        if not self._pending or self._pool is None:
+            return
+        keys = sorted(self._pending)
+        self._pending.clear()
+
+        payloads = []
+        batch = []
+        size = 0
+        for key in keys:
+            if batch and size + len(key) > MAX_PAYLOAD:
+                payloads.append(batch)
+                batch, size = [], 0
+            batch.append(key)
+            size += len(key) + 4
+        payloads.append(batch)
+
+        try:
+            async with self._pool.acquire() as conn:
+                for batch in payloads:
+                    payload = json.dumps({"origin": self.origin, "keys": batch})
+                    await conn.execute("SELECT pg_notify($1, $2)", CHANNEL, payload)
+        except Exception as e:
+            print("LEADERBOARD NOTIFY ERROR:", e)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    # --------------------------------------------------------
+    # LISTEN
+    # --------------------------------------------------------
+
+    def _on_notify(self, conn, pid, channel, payload):
+        try:
+            message = json.loads(payload)
+        except ValueError:
+            return
+        if message.get("origin") == self.origin:
+            return
+        asyncio.ensure_future(self._apply(set(message.get("keys") or [])))
+
+    async def _apply(self, keys: Set[str]):
+        try:
+            await self.on_changed(keys)
+        except Exception as e:
+            print("LEADERBOARD SYNC ERROR:", e)
+
+    async def _listen_loop(self):
+        first = True
+        while True:
+            conn = None
+            try:
+                conn = await self._connect()
+                lost = asyncio.Event()
+                conn.add_termination_listener(lambda _: lost.set())
+                await conn.add_listener(CHANNEL, self._on_notify)
+                if not first:
+                    await self.on_resync()
+                first = False
+                await lost.wait()
+                print("Leaderboard listener disconnected; reconnecting.")
+            except asyncio.CancelledError:
+                if conn is not None and not conn.is_closed():
+                    await conn.close()
+                raise
+            except Exception as e:
+                print("LEADERBOARD LISTEN ERROR:", e)
+                first = False
+            await asyncio.sleep(self.reconnect_delay)
@@ -0,0 +1,33 @@
+import re
+from typing import Optional, Tuple
+
+# open.spotify.com/track/<id>, /intl-de/track/<id>, /embed/track/<id>, ...
+SPOTIFY_LINK_RE = re.compile(
+    r"https?://open\.spotify\.com/(?:intl-[a-zA-Z-]+/)?(?:embed/)?"
+    r"(track|album|playlist)/([A-Za-z0-9]{22})"
+)
+SPOTIFY_URI_RE = re.compile(r"spotify:(track|album|playlist):([A-Za-z0-9]{22})")
+
+# music.apple.com/us/song/<slug>/<id> or /album/<slug>/<album id>?i=<track id>
+APPLE_SONG_RE = re.compile(r"https?://(?:geo\.)?music\.apple\.com/[a-z]{2}/song/(?:[^/\s?]+/)?(\d+)")
+APPLE_ALBUM_TRACK_RE = re.compile(
+    r"https?://(?:geo\.)?music\.apple\.com/[a-z]{2}/album/[^\s?]+\?(?:[^\s]*&)?i=(\d+)"
+)
+APPLE_URL_RE = re.compile(r"https?://(?:geo\.)?music\.apple\.com/[^\s<>]+")
+
+
+def parse_spotify_link(text: str) -> Optional[Tuple[str, str]]:
+    """Return (kind, id) for a Spotify track/album/playlist link or URI."""
+    m = SPOTIFY_LINK_RE.search(text) or SPOTIFY_URI_RE.search(text)
+    if not m:
+        return None
+    return m.group(1), m.group(2)
+
+
+def parse_apple_music_link(text: str) -> Optional[Tuple[str, str]]:
+    """Return (track id, link as pasted) for an Apple Music song link."""
+    m = APPLE_SONG_RE.search(text) or APPLE_ALBUM_TRACK_RE.search(text)
+    if not m:
+        return None
+    url = APPLE_URL_RE.search(text).group(0)
+    return m.group(1), url
@@ -0,0 +1,173 @@
+"""Copy the bot's data between the Postgres and SQLite backends.
+
+    python migrate_storage.py --from postgres --to sqlite --sqlite-path bot.sqlite3
+    python migrate_storage.py --from sqlite --to postgres --sqlite-path bot.sqlite3
+
+Copies songs, ratings, views, rating rollups and Apple Music lookup
+misses. Postgres is reached through the usual PG* variables. Stop the
+bot first and copy into an empty target: song totals are copied, not
+recomputed. Rows whose key already exists are left alone, so rerunning
+an interrupted copy is safe.
+
+Postgres is migrated before anything is read, so ratings from before
+rated_at existed arrive dated 1970-01-01 and stay out of /trending.
+"""
+
+import os
+import asyncio
+import sqlite3
+import argparse
+from datetime import date, datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import asyncpg
+
+from migrations import run_migrations
+from sqlite_storage import run_sqlite_migrations
+
+TABLES = ["songs", "ratings", "views", "rating_rollups", "apple_lookup_attempts"]
+BATCH_SIZE = 1000
+
+# Column lists in copy order; timestamp columns are moved as unix seconds
+# and date columns as 'YYYY-MM-DD'.
+COLUMNS: Dict[str, List[str]] = {
+    "songs": ["song_key", "title", "artist", "spotify_url", "apple_url", "average", "count", "rating_sum"],
+    "ratings": ["song_key", "user_id", "rating", "song_title", "rated_at", "guild_id"],
+    "views": ["message_id", "channel_id", "song_key", "guild_id", "posted_at"],
+    "rating_rollups": ["guild_id", "day", "song_key", "rating_sum", "count"],
+    "apple_lookup_attempts": ["song_key", "misses", "retry_after"],
+}
+TIMESTAMPS = {"rated_at", "posted_at", "retry_after"}
+DATES = {"day"}
+CONFLICT_KEYS = {
+    "songs": "song_key",
+    "ratings": "song_key, user_id",
+    "views": "message_id",
+    "rating_rollups": "guild_id, day, song_key",
+    "apple_lookup_attempts": "song_key",
+}
+
+
+def to_sqlite(column: str, value: Any) -> Any:
+    if column in TIMESTAMPS and isinstance(value, datetime):
+        return value.timestamp()
+    if column in DATES and isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def to_postgres(column: str, value: Any) -> Any:
+    if column in TIMESTAMPS and isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value, tz=timezone.utc)
+    if column in DATES and isinstance(value, str):
+        return date.fromisoformat(value)
+    return value
+
+
+# ============================================================
+# READ
+# ============================================================
+
+async def read_postgres(conn: asyncpg.Connection, table: str) -> List[Tuple]:
+    columns = COLUMNS[table]
+    rows = await conn.fetch(f"SELECT {', '.join(columns)} FROM {table}")
+    return [
+        tuple(to_sqlite(c, row[c]) for c in columns)
+        for row in rows
+    ]
+
+
+def read_sqlite(conn: sqlite3.Connection, table: str) -> List[Tuple]:
+    return [tuple(row) for row in conn.execute(f"SELECT {', '.join(COLUMNS[table])} FROM {table}")]
+
+
+# ============================================================
+# WRITE
+# ============================================================
+
+async def write_postgres(conn: asyncpg.Connection, table: str, rows: List[Tuple]) -> int:
+    columns = COLUMNS[table]
+    placeholders = ", ".join(f"${i}" for i in range(1, len(columns) + 1))
+    sql = (
+        f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders}) "
+        f"ON CONFLICT ({CONFLICT_KEYS[table]}) DO NOTHING"
+    )
+    records = [tuple(to_postgres(c, v) for c, v in zip(columns, row)) for row in rows]
+    async with conn.transaction():
+        for start in range(0, len(records), BATCH_SIZE):
+            await conn.executemany(sql, records[start:start + BATCH_SIZE])
+    return len(records)
+
+
+def write_sqlite(conn: sqlite3.Connection, table: str, rows: List[Tuple]) -> int:
+    columns = COLUMNS[table]
+    sql = (
+        f"INSERT OR IGNORE INTO {table} ({', '.join(columns)}) "
+        f"VALUES ({', '.join('?' * len(columns))})"
+    )
+    with conn:
+        conn.executemany(sql, rows)
+    return len(rows)
+
+
+# ============================================================
+# MAIN
+# ============================================================
+
+async def connect_postgres() -> asyncpg.pool.Pool:
+    pool = await asyncpg.create_pool(
+        host=os.getenv("PGHOST"),
+        port=os.getenv("PGPORT"),
+        user=os.getenv("PGUSER"),
+        password=os.getenv("PGPASSWORD"),
+        database=os.getenv("PGDATABASE"),
+        min_size=1,
+        max_size=1,
+    )
+    await run_migrations(pool)
+    return pool
+
+
+def connect_sqlite(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = WAL")
+    run_sqlite_migrations(conn)
+    return conn
+
+
+async def migrate(source: str, sqlite_path: str):
+    pool = await connect_postgres()
+    lite = connect_sqlite(sqlite_path)
+    try:
+        async with pool.acquire() as pg:
+            for table in TABLES:
+                if source == "postgres":
+                    rows = await read_postgres(pg, table)
+                    written = write_sqlite(lite, table, rows)
+                else:
+                    rows = read_sqlite(lite, table)
+                    written = await write_postgres(pg, table, rows)
+                print(f"{table}: copied {written} rows")
+    finally:
+        await pool.close()
+        lite.close()
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--from", dest="source", choices=["postgres", "sqlite"], required=True)
+    parser.add_argument("--to", dest="target", choices=["postgres", "sqlite"], required=True)
+    parser.add_argument("--sqlite-path", default=os.getenv("SQLITE_PATH", "bot.sqlite3"))
+    args = parser.parse_args(argv)
+    if args.source == args.target:
+        parser.error("--from and --to must differ")
+    return args
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    asyncio.run(migrate(args.source, args.sqlite_path))
+
+
+if __name__ == "__main__":
+    main()
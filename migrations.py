@@ -0,0 +1,248 @@
+from typing import List, Tuple
+
+import asyncpg
+
+# Arbitrary constant shared by every instance so only one runs migrations.
+MIGRATION_LOCK_ID = 8142_2024
+
+
+# ============================================================
+# MIGRATIONS
+# ============================================================
+# Append new steps at the end; never edit or reorder an applied one.
+# Every statement should be safe to re-run on a database that already
+# has the change, so databases created before versioning upgrade cleanly.
+
+MIGRATIONS: List[Tuple[int, str, List[str]]] = [
+    (1, "base tables", [
+        """
+        CREATE TABLE IF NOT EXISTS songs (
+            song_key TEXT PRIMARY KEY,
+            title TEXT NOT NULL,
+            artist TEXT NOT NULL,
+            spotify_url TEXT NOT NULL,
+            apple_url TEXT,
+            average FLOAT DEFAULT 0,
+            count INT DEFAULT 0
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS ratings (
+            song_key TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            rating INT NOT NULL,
+            PRIMARY KEY (song_key, user_id)
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS views (
+            channel_id BIGINT NOT NULL,
+            message_id BIGINT NOT NULL,
+            song_key TEXT NOT NULL
+        );
+        """,
+    ]),
+    (2, "songs.rating_sum", [
+        """
+        ALTER TABLE songs
+        ADD COLUMN IF NOT EXISTS rating_sum BIGINT NOT NULL DEFAULT 0;
+        """,
+        """
+        UPDATE songs s
+        SET rating_sum = r.total,
+            count = r.n,
+            average = r.total::float / r.n
+        FROM (
+            SELECT song_key, SUM(rating) AS total, COUNT(*) AS n
+            FROM ratings
+            GROUP BY song_key
+        ) r
+        WHERE s.song_key = r.song_key AND s.rating_sum = 0;
+        """,
+    ]),
+    (3, "apple lookup miss cache", [
+        """
+        CREATE TABLE IF NOT EXISTS apple_lookup_attempts (
+            song_key TEXT PRIMARY KEY,
+            misses INT NOT NULL DEFAULT 1,
+            retry_after TIMESTAMPTZ NOT NULL
+        );
+        """,
+    ]),
+    (4, "search cache", [
+        """
+        CREATE TABLE IF NOT EXISTS search_cache (
+            kind TEXT NOT NULL,
+            query_key TEXT NOT NULL,
+            payload JSONB NOT NULL,
+            expires_at TIMESTAMPTZ NOT NULL,
+            PRIMARY KEY (kind, query_key)
+        );
+        """,
+    ]),
+    (5, "indexes for myratings, leaderboard and views", [
+        "CREATE INDEX IF NOT EXISTS ratings_user_id_idx ON ratings (user_id);",
+        """
+        CREATE INDEX IF NOT EXISTS songs_leaderboard_idx
+        ON songs (average DESC, count DESC)
+        WHERE count > 0;
+        """,
+        # Older deployments inserted a views row on every post.
+        """
+        DELETE FROM views a
+        USING views b
+        WHERE a.message_id = b.message_id AND a.ctid < b.ctid;
+        """,
+        """
+        DO $$
+        BEGIN
+            IF NOT EXISTS (
+                SELECT 1 FROM pg_constraint WHERE conname = 'views_pkey'
+            ) THEN
+                ALTER TABLE views ADD CONSTRAINT views_pkey PRIMARY KEY (message_id);
+            END IF;
+        END $$;
+        """,
+    ]),
+    (6, "keyset paging for myratings", [
+        """
+        ALTER TABLE ratings
+        ADD COLUMN IF NOT EXISTS rated_at TIMESTAMPTZ NOT NULL DEFAULT now();
+        """,
+        # Copy of songs.title so every sort order is a range scan on ratings.
+        """
+        ALTER TABLE ratings
+        ADD COLUMN IF NOT EXISTS song_title TEXT NOT NULL DEFAULT '';
+        """,
+        """
+        UPDATE ratings r
+        SET song_title = s.title
+        FROM songs s
+        WHERE s.song_key = r.song_key AND r.song_title = '';
+        """,
+        "CREATE INDEX IF NOT EXISTS ratings_user_title_idx ON ratings (user_id, song_title, song_key);",
+        "CREATE INDEX IF NOT EXISTS ratings_user_rating_idx ON ratings (user_id, rating, song_key);",
+        "CREATE INDEX IF NOT EXISTS ratings_user_recent_idx ON ratings (user_id, rated_at, song_key);",
+        # Superseded by the composite indexes above.
+        "DROP INDEX IF EXISTS ratings_user_id_idx;",
+    ]),
+    (7, "catalog store", [
+        """
+        CREATE TABLE IF NOT EXISTS catalog_artists (
+            artist_id TEXT PRIMARY KEY,
+            top_tracks JSONB NOT NULL,
+            etag TEXT,
+            fetched_at TIMESTAMPTZ NOT NULL
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS catalog_albums (
+            album_id TEXT PRIMARY KEY,
+            tracks JSONB NOT NULL,
+            etag TEXT,
+            fetched_at TIMESTAMPTZ NOT NULL
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS catalog_tracks (
+            track_id TEXT PRIMARY KEY,
+            title TEXT NOT NULL,
+            artist TEXT NOT NULL,
+            spotify_url TEXT NOT NULL,
+            album_id TEXT,
+            fetched_at TIMESTAMPTZ NOT NULL
+        );
+        """,
+    ]),
+    (8, "shared spotify token", [
+        """
+        CREATE TABLE IF NOT EXISTS spotify_tokens (
+            name TEXT PRIMARY KEY,
+            access_token TEXT NOT NULL,
+            refresh_token TEXT,
+            expires_at TIMESTAMPTZ NOT NULL
+        );
+        """,
+    ]),
+    (9, "guilds and daily rating rollups", [
+        "ALTER TABLE ratings ADD COLUMN IF NOT EXISTS guild_id BIGINT;",
+        "ALTER TABLE views ADD COLUMN IF NOT EXISTS guild_id BIGINT;",
+        "ALTER TABLE views ADD COLUMN IF NOT EXISTS posted_at TIMESTAMPTZ NOT NULL DEFAULT now();",
+        # guild_id 0 holds the totals across every guild and DMs.
+        """
+        CREATE TABLE IF NOT EXISTS rating_rollups (
+            guild_id BIGINT NOT NULL,
+            day DATE NOT NULL,
+            song_key TEXT NOT NULL,
+            rating_sum BIGINT NOT NULL DEFAULT 0,
+            count INT NOT NULL DEFAULT 0,
+            PRIMARY KEY (guild_id, day, song_key)
+        );
+        """,
+        # Earlier ratings have no guild, so they only count globally.
+        """
+        INSERT INTO rating_rollups (guild_id, day, song_key, rating_sum, count)
+        SELECT 0, (rated_at AT TIME ZONE 'UTC')::date, song_key, SUM(rating), COUNT(*)
+        FROM ratings
+        GROUP BY 2, 3
+        ON CONFLICT (guild_id, day, song_key) DO NOTHING;
+        """,
+    ]),
+    # Step 6 gave ratings made before it rated_at = now(), which step 9
+    # then filed under the upgrade day, so /trending showed the all-time
+    # chart for a month. Those rows all carry step 6's transaction time;
+    # move them to the epoch, outside every trending window.
+    (10, "date legacy ratings at the epoch", [
+        """
+        UPDATE ratings
+        SET rated_at = 'epoch'
+        WHERE rated_at = (SELECT applied_at FROM schema_migrations WHERE version = 6);
+        """,
+        # Legacy ratings have no guild, so only the global rows move.
+        "DELETE FROM rating_rollups WHERE guild_id = 0;",
+        """
+        INSERT INTO rating_rollups (guild_id, day, song_key, rating_sum, count)
+        SELECT 0, (rated_at AT TIME ZONE 'UTC')::date, song_key, SUM(rating), COUNT(*)
+        FROM ratings
+        GROUP BY 2, 3;
+        """,
+    ]),
+    # The leaderboard orders by a score built from LEADERBOARD_* settings,
+    # which no fixed index matches, so this one only slowed rating writes.
+    (11, "drop unused leaderboard index", [
+        "DROP INDEX IF EXISTS songs_leaderboard_idx;",
+    ]),
+]
+
+
+async def run_migrations(pool: asyncpg.pool.Pool):
+    async with pool.acquire() as conn:
+        # Session-level lock: a second instance starting at the same time
+        # waits here until the first has finished migrating.
+        await conn.execute("SELECT pg_advisory_lock($1)", MIGRATION_LOCK_ID)
+        try:
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INT PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+                );
+            """)
+
+            rows = await conn.fetch("SELECT version FROM schema_migrations")
+            applied = {r["version"] for r in rows}
+
+            for version, name, statements in sorted(MIGRATIONS, key=lambda m: m[0]):
+                if version in applied:
+                    continue
+
+                async with conn.transaction():
+                    for statement in statements:
+                        await conn.execute(statement)
+                    await conn.execute(
+                        "INSERT INTO schema_migrations (version, name) VALUES ($1, $2)",
+                        version, name,
+                    )
+                print(f"Applied migration {version}: {name}")
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATION_LOCK_ID)
@@ -0,0 +1,394 @@
+from datetime import date
+from typing import Any, Dict, List, Optional, Tuple
+
+import asyncpg
+
+from storage import (
+    MYRATINGS_SORTS,
+    Song,
+    Storage,
+    StorageSession,
+    StoredView,
+    TrendingSong,
+    UserRating,
+)
+
+# Queries are module constants so every call sends identical text and
+# asyncpg's per-connection statement cache reuses one server-side
+# prepared statement per query instead of re-parsing it.
+
+SONG_COLUMNS = "song_key, title, artist, spotify_url, apple_url, average, count, rating_sum"
+
+GET_SONG_SQL = f"""
+    SELECT {SONG_COLUMNS}, COALESCE(a.retry_after > now(), FALSE) AS apple_miss
+    FROM songs s
+    LEFT JOIN apple_lookup_attempts a USING (song_key)
+    WHERE s.song_key = $1;
+"""
+
+# The insert and the read of an existing row happen in one statement.
+GET_OR_CREATE_SONG_SQL = f"""
+    WITH ins AS (
+        INSERT INTO songs (song_key, title, artist, spotify_url)
+        VALUES ($1, $2, $3, $4)
+        ON CONFLICT (song_key) DO NOTHING
+        RETURNING {SONG_COLUMNS}
+    )
+    SELECT {SONG_COLUMNS}, FALSE AS apple_miss FROM ins
+    UNION ALL
+    SELECT {SONG_COLUMNS}, COALESCE(a.retry_after > now(), FALSE)
+    FROM songs s
+    LEFT JOIN apple_lookup_attempts a USING (song_key)
+    WHERE s.song_key = $1 AND NOT EXISTS (SELECT 1 FROM ins);
+"""
+
+SET_APPLE_URL_SQL = f"""
+    WITH cleared AS (
+        DELETE FROM apple_lookup_attempts WHERE song_key = $1
+    )
+    UPDATE songs
+    SET apple_url = COALESCE(apple_url, $2)
+    WHERE song_key = $1
+    RETURNING {SONG_COLUMNS};
+"""
+
+RECORD_APPLE_MISS_SQL = f"""
+    WITH miss AS (
+        INSERT INTO apple_lookup_attempts (song_key, misses, retry_after)
+        VALUES ($1, 1, now() + make_interval(secs => $2))
+        ON CONFLICT (song_key)
+        DO UPDATE SET misses = apple_lookup_attempts.misses + 1,
+                      retry_after = EXCLUDED.retry_after
+    )
+    SELECT {SONG_COLUMNS}, TRUE AS apple_miss
+    FROM songs
+    WHERE song_key = $1;
+"""
+
+LOCK_SONGS_SQL = """
+    SELECT 1 FROM songs
+    WHERE song_key = ANY($1::text[])
+    ORDER BY song_key
+    FOR UPDATE;
+"""
+
+APPLY_RATINGS_SQL = """
+    WITH input AS (
+        SELECT t.song_key, t.user_id, t.rating, t.guild_id
+        FROM unnest($1::text[], $2::text[], $3::int[], $4::bigint[])
+            AS t(song_key, user_id, rating, guild_id)
+    ),
+    prev AS (
+        SELECT r.song_key, r.user_id, r.rating, r.guild_id, r.rated_at
+        FROM ratings r
+        JOIN input i ON i.song_key = r.song_key AND i.user_id = r.user_id
+    ),
+    upsert AS (
+        INSERT INTO ratings (song_key, user_id, rating, song_title, guild_id)
+        SELECT i.song_key, i.user_id, i.rating, s.title, i.guild_id
+        FROM input i
+        JOIN songs s ON s.song_key = i.song_key
+        ON CONFLICT (song_key, user_id)
+        DO UPDATE SET rating = EXCLUDED.rating, guild_id = EXCLUDED.guild_id, rated_at = now()
+        RETURNING song_key, user_id, rating, guild_id, rated_at
+    ),
+    -- A new rating counts on today's rollups; the rating it replaces
+    -- comes off the rollups of the day and guild it was made in.
+    changes AS (
+        SELECT u.song_key, u.guild_id, u.rated_at, u.rating AS d_sum, 1 AS d_count
+        FROM upsert u
+        UNION ALL
+        SELECT p.song_key, p.guild_id, p.rated_at, -p.rating, -1
+        FROM prev p
+        JOIN upsert u ON u.song_key = p.song_key AND u.user_id = p.user_id
+    ),
+    rollup AS (
+        INSERT INTO rating_rollups (guild_id, day, song_key, rating_sum, count)
+        SELECT g.scope, (c.rated_at AT TIME ZONE 'UTC')::date, c.song_key,
+               SUM(c.d_sum), SUM(c.d_count)
+        FROM changes c
+        CROSS JOIN LATERAL (VALUES (0::bigint), (c.guild_id)) AS g(scope)
+        WHERE g.scope IS NOT NULL
+        GROUP BY 1, 2, 3
+        ON CONFLICT (guild_id, day, song_key)
+        DO UPDATE SET rating_sum = rating_rollups.rating_sum + EXCLUDED.rating_sum,
+                      count = rating_rollups.count + EXCLUDED.count
+    ),
+    delta AS (
+        SELECT u.song_key,
+               SUM(u.rating - COALESCE(p.rating, 0)) AS d_sum,
+               COUNT(*) FILTER (WHERE p.rating IS NULL) AS d_count
+        FROM upsert u
+        LEFT JOIN prev p ON p.song_key = u.song_key AND p.user_id = u.user_id
+        GROUP BY u.song_key
+    )
+    UPDATE songs s
+    SET rating_sum = s.rating_sum + d.d_sum,
+        count = s.count + d.d_count,
+        average = (s.rating_sum + d.d_sum)::float / (s.count + d.d_count)
+    FROM delta d
+    WHERE s.song_key = d.song_key
+    RETURNING s.song_key, s.title, s.artist, s.spotify_url, s.apple_url,
+              s.average, s.count, s.rating_sum;
+"""
+
+RATED_SONGS_SQL = f"SELECT {SONG_COLUMNS} FROM songs WHERE count > 0;"
+
+ALL_RATINGS_SQL = "SELECT song_key, user_id, rating FROM ratings;"
+
+ADD_VIEWS_SQL = """
+    INSERT INTO views (channel_id, message_id, song_key, guild_id, posted_at)
+    SELECT t.channel_id, t.message_id, t.song_key, t.guild_id, to_timestamp(t.posted_at)
+    FROM unnest($1::bigint[], $2::bigint[], $3::text[], $4::bigint[], $5::float8[])
+        AS t(channel_id, message_id, song_key, guild_id, posted_at)
+    ON CONFLICT (message_id) DO NOTHING;
+"""
+
+VIEWS_PAGE_SQL = """
+    SELECT channel_id, message_id
+    FROM views
+    WHERE message_id > $1
+      AND ($3::int IS NULL OR (COALESCE(guild_id, 0) >> 22) % $3 = ANY($4::int[]))
+    ORDER BY message_id
+    LIMIT $2;
+"""
+
+DELETE_VIEWS_SQL = "DELETE FROM views WHERE message_id = ANY($1::bigint[]);"
+
+
+# ============================================================
+# POSTGRES STORAGE
+# ============================================================
+
+class PostgresSession(StorageSession):
+    """Every query an interaction makes, on the one connection it holds."""
+
+    def __init__(self, conn: asyncpg.Connection):
+        self.conn = conn
+
+    async def get_song(self, song_key: str) -> Optional[Song]:
+        try:
+            row = await self.conn.fetchrow(GET_SONG_SQL, song_key)
+        except Exception as e:
+            print("DB GET SONG ERROR:", e)
+            return None
+        return Song.from_record(row) if row else None
+
+    async def get_or_create_song(self, song_key: str, title: str, artist: str,
+                                 spotify_url: str) -> Optional[Song]:
+        try:
+            row = await self.conn.fetchrow(
+                GET_OR_CREATE_SONG_SQL, song_key, title, artist, spotify_url
+            )
+            if row is None:
+                # Lost an insert race: the winner's row is newer than our
+                # snapshot, so read it in a fresh statement.
+                row = await self.conn.fetchrow(GET_SONG_SQL, song_key)
+        except Exception as e:
+            print("DB GET OR CREATE SONG ERROR:", e)
+            return None
+        return Song.from_record(row) if row else None
+
+    async def insert_songs(self, tracks: List[Dict[str, Any]]) -> List[str]:
+        # COPY into a temp table, then one INSERT ... SELECT, all in one
+        # transaction. Returns the keys of songs that were new.
+        records = list({
+            t["spotify_url"]: (t["spotify_url"], t["title"], t["artist"], t["spotify_url"])
+            for t in tracks
+        }.values())
+
+        async with self.conn.transaction():
+            await self.conn.execute("""
+                CREATE TEMP TABLE import_songs (
+                    song_key TEXT,
+                    title TEXT,
+                    artist TEXT,
+                    spotify_url TEXT
+                ) ON COMMIT DROP;
+            """)
+            await self.conn.copy_records_to_table(
+                "import_songs",
+                records=records,
+                columns=["song_key", "title", "artist", "spotify_url"],
+            )
+            rows = await self.conn.fetch("""
+                INSERT INTO songs (song_key, title, artist, spotify_url)
+                SELECT song_key, title, artist, spotify_url FROM import_songs
+                ON CONFLICT (song_key) DO NOTHING
+                RETURNING song_key;
+            """)
+
+        return [r["song_key"] for r in rows]
+
+    async def set_apple_url(self, song_key: str, apple_url: str) -> Optional[Song]:
+        try:
+            row = await self.conn.fetchrow(SET_APPLE_URL_SQL, song_key, apple_url)
+        except Exception as e:
+            print("DB SET APPLE URL ERROR:", e)
+            return None
+        return Song.from_record(row) if row else None
+
+    async def record_apple_miss(self, song_key: str, ttl_seconds: float) -> Optional[Song]:
+        try:
+            row = await self.conn.fetchrow(RECORD_APPLE_MISS_SQL, song_key, ttl_seconds)
+        except Exception as e:
+            print("DB RECORD APPLE MISS ERROR:", e)
+            return None
+        return Song.from_record(row) if row else None
+
+    async def apply_rating(self, song_key: str, user_id: str, rating: int,
+                           guild_id: Optional[int] = None) -> Optional[Song]:
+        try:
+            songs = await self.apply_ratings([(song_key, user_id, rating, guild_id)])
+        except Exception as e:
+            print("DB APPLY RATING ERROR:", e)
+            return None
+        return songs.get(song_key)
+
+    async def apply_ratings(self, rows: List[Tuple[str, str, int, Optional[int]]]) -> Dict[str, Song]:
+        song_keys = [r[0] for r in rows]
+
+        async with self.conn.transaction():
+            # Lock in a fixed order so concurrent batches can't deadlock. The
+            # lock also serializes raters of a song, so the old-vs-new delta
+            # always sees the latest committed rating.
+            await self.conn.execute(LOCK_SONGS_SQL, sorted(set(song_keys)))
+            updated = await self.conn.fetch(
+                APPLY_RATINGS_SQL,
+                song_keys,
+                [r[1] for r in rows],
+                [r[2] for r in rows],
+                [r[3] for r in rows],
+            )
+
+        return {row["song_key"]: Song.from_record(row) for row in updated}
+
+    async def user_ratings_page(self, user_id: str, sort: str,
+                                cursor: Optional[Tuple[Any, str]],
+                                backward: bool, limit: int) -> Tuple[List[UserRating], bool]:
+        column, direction = MYRATINGS_SORTS[sort]
+        if backward:
+            direction = "DESC" if direction == "ASC" else "ASC"
+        op = ">" if direction == "ASC" else "<"
+
+        args: List[Any] = [user_id, limit + 1]
+        keyset = ""
+        if cursor is not None:
+            keyset = f"AND ({column}, r.song_key) {op} ($3, $4)"
+            args.extend(cursor)
+
+        rows = await self.conn.fetch(f"""
+            SELECT s.title, s.artist, s.spotify_url, s.average, s.count,
+                   r.rating, r.song_key, {column} AS sort_value
+            FROM ratings r
+            JOIN songs s ON s.song_key = r.song_key
+            WHERE r.user_id=$1 {keyset}
+            ORDER BY {column} {direction}, r.song_key {direction}
+            LIMIT $2;
+        """, *args)
+
+        has_more = len(rows) > limit
+        page = [UserRating(**dict(row)) for row in rows[:limit]]
+        if backward:
+            page.reverse()
+        return page, has_more
+
+    async def top_songs(self, limit: int, score_sql: str) -> List[Song]:
+        try:
+            rows = await self.conn.fetch(f"""
+                SELECT {SONG_COLUMNS}
+                FROM songs
+                WHERE count > 0
+                ORDER BY {score_sql} DESC, count DESC
+                LIMIT $1;
+            """, limit)
+        except Exception as e:
+            print("DB GET TOP SONGS ERROR:", e)
+            return []
+        return [Song.from_record(row) for row in rows]
+
+    async def rated_songs(self) -> List[Song]:
+        return [Song.from_record(row) for row in await self.conn.fetch(RATED_SONGS_SQL)]
+
+    async def all_ratings(self) -> List[Tuple[str, str, int]]:
+        rows = await self.conn.fetch(ALL_RATINGS_SQL)
+        return [tuple(row) for row in rows]
+
+    async def trending_songs(self, scope: int, since: date, limit: int,
+                             score_sql: str) -> List[TrendingSong]:
+        try:
+            rows = await self.conn.fetch(f"""
+                SELECT s.song_key, s.title, s.artist, s.spotify_url, t.rating_sum, t.count
+                FROM (
+                    SELECT song_key, SUM(rating_sum) AS rating_sum, SUM(count) AS count
+                    FROM rating_rollups
+                    WHERE guild_id = $1 AND day >= $2
+                    GROUP BY song_key
+                    HAVING SUM(count) > 0
+                ) t
+                JOIN songs s ON s.song_key = t.song_key
+                ORDER BY {score_sql} DESC, t.count DESC
+                LIMIT $3;
+            """, scope, since, limit)
+        except Exception as e:
+            print("DB GET TRENDING ERROR:", e)
+            return []
+        return [TrendingSong(**dict(row)) for row in rows]
+
+    async def add_views(self, views: List[Tuple[int, int, str, Optional[int], float]]):
+        await self.conn.execute(
+            ADD_VIEWS_SQL,
+            [v[0] for v in views],
+            [v[1] for v in views],
+            [v[2] for v in views],
+            [v[3] for v in views],
+            [v[4] for v in views],
+        )
+
+    async def views_page(self, after_message_id: int, limit: int,
+                         shard_count: Optional[int] = None,
+                         shard_ids: Optional[List[int]] = None) -> List[StoredView]:
+        try:
+            rows = await self.conn.fetch(
+                VIEWS_PAGE_SQL, after_message_id, limit, shard_count, shard_ids or []
+            )
+        except Exception as e:
+            print("DB GET VIEWS ERROR:", e)
+            return []
+        return [StoredView(row["channel_id"], row["message_id"]) for row in rows]
+
+    async def delete_views(self, message_ids: List[int]):
+        try:
+            await self.conn.execute(DELETE_VIEWS_SQL, message_ids)
+        except Exception as e:
+            print("DB DELETE VIEWS ERROR:", e)
+
+
+class _SessionScope:
+    def __init__(self, pool):
+        self._acquire = pool.acquire()
+
+    async def __aenter__(self) -> PostgresSession:
+        return PostgresSession(await self._acquire.__aenter__())
+
+    async def __aexit__(self, *exc):
+        return await self._acquire.__aexit__(*exc)
+
+
+class PostgresStorage(Storage):
+    """Queries over an asyncpg pool. The pool is created and migrated by
+    the caller, which also shares it with the catalog and search cache."""
+
+    def __init__(self):
+        self.pool = None
+
+    def attach(self, pool):
+        self.pool = pool
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    def session(self) -> _SessionScope:
+        return _SessionScope(self.pool)
@@ -0,0 +1,137 @@
+import time
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+
+# ============================================================
+# RATING CLICK COALESCING
+# ============================================================
+
+class RatingCoalescer:
+    """Buffers rating clicks and writes them in batches.
+
+    Clicks are keyed by (song_key, user_id), so a user who clicks several
+    times in one window only produces their last rating. Every flush_interval
+    the buffer goes to `flush` as one multi-row write. `flush` returns the
+    fresh aggregates per song. Each message that received clicks is then
+    re-rendered through `render`, at most once per edit_interval. Songs
+    missing from the result no longer exist; the interactions that rated
+    them go to `missing` so the users can be told."""
+
+    def __init__(self,
+                 flush: Callable[[List[Tuple[str, str, int, Optional[int]]]], Awaitable[Dict[str, Any]]],
+                 render: Callable[[int, int, str, Any], Awaitable[None]],
+                 flush_interval: float = 0.5, edit_interval: float = 1.5,
+                 missing: Optional[Callable[[str, List[Any]], Awaitable[None]]] = None):
+        self.flush = flush
+        self.render = render
+        self.missing = missing
+        self.flush_interval = flush_interval
+        self.edit_interval = edit_interval
+        self._ratings: Dict[Tuple[str, str], Tuple[int, Optional[int]]] = {}
+        self._targets: Dict[str, Set[Tuple[int, int]]] = {}
+        self._clicks: Dict[str, List[Any]] = {}
+        self._latest: Dict[Tuple[int, int], Tuple[str, Any]] = {}
+        self._last_edit: Dict[Tuple[int, int], float] = {}
+        self._scheduled: Dict[Tuple[int, int], asyncio.Task] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._flush_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._flush_once()
+
+    def submit(self, song_key: str, user_id: str, rating: int,
+               target: Tuple[int, int], guild_id: Optional[int] = None,
+               interaction: Any = None):
+        self._ratings[(song_key, user_id)] = (rating, guild_id)
+        self._targets.setdefault(song_key, set()).add(target)
+        if interaction is not None:
+            self._clicks.setdefault(song_key, []).append(interaction)
+        self._wakeup.set()
+
+    async def _flush_loop(self):
+        while True:
+            await self._wakeup.wait()
+            # Let the rest of the burst arrive before writing.
+            await asyncio.sleep(self.flush_interval)
+            self._wakeup.clear()
+            await self._flush_once()
+
+    async def _flush_once(self):
+        if not self._ratings:
+            return
+
+        ratings, self._ratings = self._ratings, {}
+        targets, self._targets = self._targets, {}
+        clicks, self._clicks = self._clicks, {}
+        rows = [(song_key, user_id, rating, guild_id)
+                for (song_key, user_id), (rating, guild_id) in ratings.items()]
+
+        try:
+            songs = await self.flush(rows)
+        except Exception as e:
+            print("Rating flush error:", e)
+            # Put the batch back unless a newer click replaced it meanwhile.
+            for key, value in ratings.items():
+                self._ratings.setdefault(key, value)
+            for song_key, song_targets in targets.items():
+                self._targets.setdefault(song_key, set()).update(song_targets)
+            for song_key, song_clicks in clicks.items():
+                self._clicks.setdefault(song_key, []).extend(song_clicks)
+            self._wakeup.set()
+            return
+
+        if self.missing is not None:
+            for song_key, song_clicks in clicks.items():
+                if song_key in songs:
+                    continue
+                try:
+                    await self.missing(song_key, song_clicks)
+                except Exception as e:
+                    print("Rating missing-song notice error:", e)
+
+        for song_key, song in songs.items():
+            for target in targets.get(song_key, ()):
+                self._schedule_edit(target, song_key, song)
+
+    def _schedule_edit(self, target: Tuple[int, int], song_key: str, song: Any):
+        self._latest[target] = (song_key, song)
+        if target in self._scheduled:
+            # An edit is already queued; it will pick up the latest state.
+            return
+
+        wait = self._last_edit.get(target, 0.0) + self.edit_interval - time.monotonic()
+        self._scheduled[target] = asyncio.ensure_future(self._edit_later(target, max(wait, 0.0)))
+
+    async def _edit_later(self, target: Tuple[int, int], delay: float):
+        try:
+            if delay:
+                await asyncio.sleep(delay)
+            song_key, song = self._latest.pop(target)
+            self._last_edit[target] = time.monotonic()
+            await self.render(target[0], target[1], song_key, song)
+        except Exception as e:
+            print("Rating edit error:", e)
+        finally:
+            self._scheduled.pop(target, None)
+            if target in self._latest:
+                # Another flush landed while this edit was in flight.
+                self._schedule_edit(target, *self._latest.pop(target))
+            self._prune_edit_times()
+
+    def _prune_edit_times(self):
+        if len(self._last_edit) < 10000:
+            return
+        cutoff = time.monotonic() - self.edit_interval
+        self._last_edit = {t: ts for t, ts in self._last_edit.items() if ts > cutoff}
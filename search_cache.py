@@ -0,0 +1,159 @@
+import re
+import json
+import time
+import asyncio
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Optional, TYPE_CHECKING, Tuple
+
+if TYPE_CHECKING:
+    import asyncpg
+
+DEFAULT_TTLS = {
+    "track": 6 * 3600,
+    "track_id": 7 * 24 * 3600,
+    "search": 3600,
+    "artist": 24 * 3600,
+    "album": 24 * 3600,
+}
+
+# Kinds keyed on opaque IDs, which are case-sensitive and used verbatim.
+EXACT_KINDS = {"track_id"}
+
+_FEAT_RE = re.compile(r"\b(?:featuring|feat|ft)\b\.?")
+_PUNCT_RE = re.compile(r"[^\w\s]")
+_SPACE_RE = re.compile(r"\s+")
+
+
+def normalize_query(query: str) -> str:
+    q = unicodedata.normalize("NFKC", query).casefold()
+    q = _FEAT_RE.sub(" feat ", q)
+    q = _PUNCT_RE.sub(" ", q)
+    q = q.replace("_", " ")
+    return _SPACE_RE.sub(" ", q).strip()
+
+
+# ============================================================
+# SEARCH RESULT CACHE
+# ============================================================
+
+class SearchCache:
+    """LRU cache for Spotify search results keyed on (kind, normalized query).
+    Each kind has its own TTL. When a pool is attached, entries are also
+    written to the search_cache table so they survive restarts."""
+
+    def __init__(self, max_entries: int = 5000,
+                 ttls: Optional[Dict[str, float]] = None):
+        self.max_entries = max_entries
+        self.ttls = dict(DEFAULT_TTLS)
+        if ttls:
+            self.ttls.update(ttls)
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, Any]]" = OrderedDict()
+        self._pool: Optional["asyncpg.pool.Pool"] = None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(kind: str, query: str) -> Tuple[str, str]:
+        if kind in EXACT_KINDS:
+            return kind, query
+        return kind, normalize_query(query)
+
+    def ttl_for(self, kind: str) -> float:
+        return self.ttls.get(kind, 3600)
+
+    async def attach(self, pool: "asyncpg.pool.Pool"):
+        # The search_cache table is created by migrations.py.
+        self._pool = pool
+        async with pool.acquire() as conn:
+            try:
+                await conn.execute("DELETE FROM search_cache WHERE expires_at < now()")
+            except Exception as e:
+                print("SEARCH CACHE INIT ERROR:", e)
+                self._pool = None
+
+    def _get_local(self, key: Tuple[str, str]) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+
+        self._entries.move_to_end(key)
+        return value
+
+    def _set_local(self, key: Tuple[str, str], value: Any, ttl: float):
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get(self, kind: str, query: str) -> Optional[Any]:
+        key = self._key(kind, query)
+        value = self._get_local(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        if self._pool is not None:
+            value = await self._load(key)
+            if value is not None:
+                self.hits += 1
+                return value
+
+        self.misses += 1
+        return None
+
+    async def set(self, kind: str, query: str, value: Any):
+        if value is None:
+            return
+        key = self._key(kind, query)
+        ttl = self.ttl_for(kind)
+        self._set_local(key, value, ttl)
+
+        if self._pool is not None:
+            asyncio.ensure_future(self._store(key, value, ttl))
+
+    async def _load(self, key: Tuple[str, str]) -> Optional[Any]:
+        try:
+            async with self._pool.acquire() as conn:
+                row = await conn.fetchrow("""
+                    SELECT payload, EXTRACT(EPOCH FROM expires_at - now()) AS ttl
+                    FROM search_cache
+                    WHERE kind=$1 AND query_key=$2 AND expires_at > now();
+                """, key[0], key[1])
+        except Exception as e:
+            print("SEARCH CACHE LOAD ERROR:", e)
+            return None
+
+        if not row:
+            return None
+
+        value = json.loads(row["payload"])
+        self._set_local(key, value, float(row["ttl"]))
+        return value
+
+    async def _store(self, key: Tuple[str, str], value: Any, ttl: float):
+        try:
+            async with self._pool.acquire() as conn:
+                await conn.execute("""
+                    INSERT INTO search_cache (kind, query_key, payload, expires_at)
+                    VALUES ($1, $2, $3::jsonb, now() + make_interval(secs => $4))
+                    ON CONFLICT (kind, query_key)
+                    DO UPDATE SET payload = EXCLUDED.payload,
+                                  expires_at = EXCLUDED.expires_at;
+                """, key[0], key[1], json.dumps(value), float(ttl))
+        except Exception as e:
+            print("SEARCH CACHE STORE ERROR:", e)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": (self.hits / total) if total else 0.0,
+        }
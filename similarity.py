@@ -0,0 +1,281 @@
+import math
+import time
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from scipy import sparse
+
+# Ratings are centred on the middle of the 1-5 scale, so a 4 or 5 pulls
+# two songs together and a 1 or 2 pushes them apart.
+RATING_MIDPOINT = 3.0
+
+Neighbors = Dict[str, List[Tuple[str, float]]]
+RatingMap = Dict[str, Dict[str, int]]
+
+
+# ============================================================
+# FULL BUILD (runs in a worker process)
+# ============================================================
+
+def build_neighbor_index(rows: List[Tuple[str, str, int]], top_n: int = 30,
+                         shrink: float = 5.0) -> Neighbors:
+    """Item-item similarity over every (song_key, user_id, rating) row.
+
+    Similarity is the cosine of the centred rating columns of two songs,
+    damped by n / (n + shrink) where n is the number of users who rated
+    both, so a pair backed by one shared rater doesn't score like a pair
+    backed by fifty. Only the top_n positive neighbours of each song are
+    kept."""
+    if not rows:
+        return {}
+
+    songs = sorted({r[0] for r in rows})
+    users = sorted({r[1] for r in rows})
+    song_pos = {s: i for i, s in enumerate(songs)}
+    user_pos = {u: i for i, u in enumerate(users)}
+
+    n = len(rows)
+    song_idx = np.fromiter((song_pos[r[0]] for r in rows), dtype=np.int32, count=n)
+    user_idx = np.fromiter((user_pos[r[1]] for r in rows), dtype=np.int32, count=n)
+    values = np.fromiter((r[2] for r in rows), dtype=np.float64, count=n) - RATING_MIDPOINT
+    shape = (len(users), len(songs))
+
+    centred = sparse.csr_matrix((values, (user_idx, song_idx)), shape=shape)
+    rated = sparse.csr_matrix((np.ones(n), (user_idx, song_idx)), shape=shape)
+
+    dots = (centred.T @ centred).tocsr()
+    co_counts = (rated.T @ rated).tocsr()
+    co_counts.data = co_counts.data / (co_counts.data + shrink)
+
+    norms = np.sqrt(np.asarray(centred.multiply(centred).sum(axis=0)).ravel())
+    inv_norms = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+    scale = sparse.diags(inv_norms)
+
+    sims = (scale @ dots.multiply(co_counts) @ scale).tocsr()
+    sims.setdiag(0)
+    sims.eliminate_zeros()
+
+    neighbors: Neighbors = {}
+    for i in range(len(songs)):
+        start, end = sims.indptr[i], sims.indptr[i + 1]
+        if start == end:
+            continue
+        data = sims.data[start:end]
+        cols = sims.indices[start:end]
+        if len(data) > top_n:
+            keep = np.argpartition(-data, top_n)[:top_n]
+            data, cols = data[keep], cols[keep]
+        order = np.argsort(-data)
+        ranked = [(songs[cols[j]], float(data[j])) for j in order if data[j] > 0]
+        if ranked:
+            neighbors[songs[i]] = ranked
+    return neighbors
+
+
+def build_similarity_state(rows: List[Tuple[str, str, int]], top_n: int = 30,
+                           shrink: float = 5.0
+                           ) -> Tuple[Neighbors, RatingMap, RatingMap, Dict[str, float]]:
+    """The neighbour index plus the rating maps and per-song sums of
+    squared centred ratings that SimilarSongs keeps up to date between
+    rebuilds."""
+    song_users: RatingMap = {}
+    user_songs: RatingMap = {}
+    sum_squares: Dict[str, float] = {}
+    for song_key, user_id, rating in rows:
+        song_users.setdefault(song_key, {})[user_id] = rating
+        user_songs.setdefault(user_id, {})[song_key] = rating
+    for song_key, users in song_users.items():
+        sum_squares[song_key] = sum((r - RATING_MIDPOINT) ** 2 for r in users.values())
+    return build_neighbor_index(rows, top_n, shrink), song_users, user_songs, sum_squares
+
+
+# ============================================================
+# SIMILAR SONGS ENGINE
+# ============================================================
+
+class SimilarSongs:
+    """Serves "for you" picks from a precomputed top-N neighbour index.
+
+    A full rebuild runs build_similarity_state in a worker process every
+    rebuild_interval seconds. Between rebuilds, each new rating
+    recomputes the rated song's similarity to the other songs that user
+    rated (and to its current neighbours), so the index keeps up with
+    clicks without a rebuild."""
+
+    def __init__(self, load_ratings: Callable[[], Awaitable[List[Tuple[str, str, int]]]],
+                 top_n: int = 30, shrink: float = 5.0, rebuild_interval: float = 1800.0,
+                 max_corated: int = 50, max_profile: int = 50):
+        self.load_ratings = load_ratings
+        self.top_n = top_n
+        self.shrink = shrink
+        self.rebuild_interval = rebuild_interval
+        self.max_corated = max_corated
+        self.max_profile = max_profile
+
+        self.loaded = False
+        self.built_at = 0.0
+        self.neighbors: Neighbors = {}
+        self.song_users: RatingMap = {}
+        self.user_songs: RatingMap = {}
+        self.sum_squares: Dict[str, float] = {}
+
+        self._replay: Optional[List[Tuple[str, str, int]]] = None
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._rebuild_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    # --------------------------------------------------------
+    # FULL REBUILD
+    # --------------------------------------------------------
+
+    async def rebuild(self):
+        # Ratings recorded while the build runs are replayed onto its result.
+        self._replay = []
+        try:
+            rows = await self.load_ratings()
+            if self._executor is None:
+                # Not fork: by now the bot runs several threads, and a forked
+                # child can inherit a lock one of them was holding.
+                self._executor = ProcessPoolExecutor(
+                    max_workers=1, mp_context=multiprocessing.get_context("forkserver")
+                )
+            loop = asyncio.get_running_loop()
+            neighbors, song_users, user_songs, sum_squares = await loop.run_in_executor(
+                self._executor, build_similarity_state, rows, self.top_n, self.shrink
+            )
+            replay = self._replay
+        finally:
+            self._replay = None
+
+        self.neighbors = neighbors
+        self.song_users = song_users
+        self.user_songs = user_songs
+        self.sum_squares = sum_squares
+        self.loaded = True
+        self.built_at = time.time()
+
+        for song_key, user_id, rating in replay:
+            self.record(song_key, user_id, rating)
+
+    async def _rebuild_loop(self):
+        while True:
+            try:
+                await self.rebuild()
+            except Exception as e:
+                print("SIMILARITY REBUILD ERROR:", e)
+            await asyncio.sleep(self.rebuild_interval)
+
+    # --------------------------------------------------------
+    # INCREMENTAL UPDATES
+    # --------------------------------------------------------
+
+    def record(self, song_key: str, user_id: str, rating: int):
+        if self._replay is not None:
+            self._replay.append((song_key, user_id, rating))
+        if not self.loaded:
+            return
+
+        column = self.song_users.setdefault(song_key, {})
+        previous = column.get(user_id)
+        squares = self.sum_squares.get(song_key, 0.0) + (rating - RATING_MIDPOINT) ** 2
+        if previous is not None:
+            squares -= (previous - RATING_MIDPOINT) ** 2
+        self.sum_squares[song_key] = squares
+        column[user_id] = rating
+        user_songs = self.user_songs.setdefault(user_id, {})
+        # Move the song to the end so the profile stays in recency order.
+        user_songs.pop(song_key, None)
+        user_songs[song_key] = rating
+
+        # This song's column changed: its similarity to every song sharing
+        # a rater moved, but only these are worth the work per click.
+        targets = set(list(user_songs)[-self.max_corated - 1:])
+        targets.update(key for key, _ in self.neighbors.get(song_key, ()))
+        targets.discard(song_key)
+
+        for other in targets:
+            sim = self.similarity(song_key, other)
+            self._set_neighbor(song_key, other, sim)
+            self._set_neighbor(other, song_key, sim)
+
+    def similarity(self, a: str, b: str) -> float:
+        """The same formula as build_neighbor_index, for one pair."""
+        col_a = self.song_users.get(a, {})
+        col_b = self.song_users.get(b, {})
+        if len(col_a) > len(col_b):
+            col_a, col_b = col_b, col_a
+
+        common = 0
+        dot = 0.0
+        for user_id, rating in col_a.items():
+            other = col_b.get(user_id)
+            if other is not None:
+                common += 1
+                dot += (rating - RATING_MIDPOINT) * (other - RATING_MIDPOINT)
+        if not common or not dot:
+            return 0.0
+
+        norm_a = math.sqrt(self.sum_squares.get(a, 0.0))
+        norm_b = math.sqrt(self.sum_squares.get(b, 0.0))
+        return dot / (norm_a * norm_b) * common / (common + self.shrink)
+
+    def _set_neighbor(self, song_key: str, other: str, sim: float):
+        current = [n for n in self.neighbors.get(song_key, ()) if n[0] != other]
+        if sim > 0:
+            current.append((other, sim))
+            current.sort(key=lambda n: -n[1])
+            del current[self.top_n:]
+        if current:
+            self.neighbors[song_key] = current
+        else:
+            self.neighbors.pop(song_key, None)
+
+    # --------------------------------------------------------
+    # SERVING
+    # --------------------------------------------------------
+
+    def rated_by(self, user_id: str) -> Dict[str, int]:
+        return self.user_songs.get(user_id, {})
+
+    def for_user(self, user_id: str, k: int = 10) -> List[Tuple[str, float]]:
+        """Unrated songs ranked by similarity to the ones the user liked,
+        weighted by how much they liked each."""
+        rated = self.user_songs.get(user_id)
+        if not rated:
+            return []
+
+        liked = [(key, r - RATING_MIDPOINT) for key, r in rated.items() if r > RATING_MIDPOINT]
+        scores: Dict[str, float] = {}
+        for song_key, weight in liked[-self.max_profile:]:
+            for other, sim in self.neighbors.get(song_key, ()):
+                if other not in rated:
+                    scores[other] = scores.get(other, 0.0) + sim * weight
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return ranked[:k]
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "songs": len(self.song_users),
+            "users": len(self.user_songs),
+            "indexed": len(self.neighbors),
+            "age": time.time() - self.built_at if self.loaded else -1.0,
+        }
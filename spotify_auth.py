@@ -0,0 +1,211 @@
+import os
+import time
+import base64
+import asyncio
+from typing import Any, Dict, Optional, TYPE_CHECKING, Tuple
+
+if TYPE_CHECKING:
+    import asyncpg
+
+from http_client import HttpClient
+
+SPOTIFY_TOKEN_URL = "https://accounts.spotify.com/api/token"
+SHARED_TOKEN_NAME = "default"
+
+LOCK_SHARED_TOKEN_SQL = """
+    SELECT access_token, refresh_token,
+           EXTRACT(EPOCH FROM expires_at - now())::float AS ttl
+    FROM spotify_tokens
+    WHERE name = $1
+    FOR UPDATE;
+"""
+
+SEED_SHARED_TOKEN_SQL = """
+    INSERT INTO spotify_tokens (name, access_token, expires_at)
+    VALUES ($1, '', now())
+    ON CONFLICT (name) DO NOTHING;
+"""
+
+SAVE_SHARED_TOKEN_SQL = """
+    INSERT INTO spotify_tokens (name, access_token, refresh_token, expires_at)
+    VALUES ($1, $2, $3, now() + make_interval(secs => $4))
+    ON CONFLICT (name) DO UPDATE
+    SET access_token = EXCLUDED.access_token,
+        refresh_token = COALESCE(EXCLUDED.refresh_token, spotify_tokens.refresh_token),
+        expires_at = EXCLUDED.expires_at;
+"""
+
+
+# ============================================================
+# SPOTIFY TOKEN MANAGER
+# ============================================================
+
+class SpotifyTokenManager:
+    """Keeps the Spotify access token in memory until shortly before it
+    expires. Concurrent callers share a single in-flight refresh, and a
+    background task renews the token ahead of expiry so commands rarely
+    wait on the token endpoint at all.
+
+    With a pool attached, the token lives in the spotify_tokens table and
+    is shared by every bot process: one refreshes it under a row lock and
+    the rest pick it up."""
+
+    def __init__(self, http: HttpClient, refresh_margin: float = 60.0,
+                 retry_delay: float = 30.0):
+        self.http = http
+        self.refresh_margin = refresh_margin
+        self.retry_delay = retry_delay
+        self._token: Optional[str] = None
+        self._expires_at = 0.0
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._background_task: Optional[asyncio.Task] = None
+        self._refresh_token_override: Optional[str] = None
+        self._rejected: Optional[str] = None
+        self._pool: Optional["asyncpg.pool.Pool"] = None
+
+    def attach(self, pool: "asyncpg.pool.Pool"):
+        # The spotify_tokens table is created by migrations.py.
+        self._pool = pool
+
+    def _credentials(self) -> Optional[Tuple[str, str, str]]:
+        client_id = os.getenv("SPOTIFY_CLIENT_ID")
+        client_secret = os.getenv("SPOTIFY_CLIENT_SECRET")
+        refresh_token = self._refresh_token_override or os.getenv("SPOTIFY_REFRESH_TOKEN")
+
+        if not all([client_id, client_secret, refresh_token]):
+            return None
+        return client_id, client_secret, refresh_token
+
+    def _is_fresh(self) -> bool:
+        return self._token is not None and time.monotonic() < self._expires_at
+
+    async def get_token(self) -> Optional[str]:
+        if self._is_fresh():
+            return self._token
+        return await self.refresh()
+
+    def invalidate(self, token: str):
+        # Only drop the token that was actually rejected; a newer one may
+        # already have been fetched by another caller.
+        if self._token == token:
+            self._token = None
+            self._expires_at = 0.0
+            # Don't pick the same token back up from the shared row.
+            self._rejected = token
+
+    async def refresh(self) -> Optional[str]:
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.ensure_future(self._fetch())
+        return await asyncio.shield(self._refresh_task)
+
+    async def _fetch(self) -> Optional[str]:
+        if self._pool is not None:
+            try:
+                return await self._fetch_shared()
+            except Exception as e:
+                print("Spotify shared token error:", e)
+
+        data = await self._request()
+        return self._use(data) if data else None
+
+    async def _fetch_shared(self) -> Optional[str]:
+        async with self._pool.acquire() as conn:
+            async with conn.transaction():
+                row = await conn.fetchrow(LOCK_SHARED_TOKEN_SQL, SHARED_TOKEN_NAME)
+                if row is None:
+                    # Seed the row so concurrent first refreshes queue on its lock.
+                    await conn.execute(SEED_SHARED_TOKEN_SQL, SHARED_TOKEN_NAME)
+                    row = await conn.fetchrow(LOCK_SHARED_TOKEN_SQL, SHARED_TOKEN_NAME)
+
+                if row["refresh_token"]:
+                    self._refresh_token_override = row["refresh_token"]
+                if (row["access_token"] and row["access_token"] != self._rejected
+                        and row["ttl"] > self.refresh_margin):
+                    return self._set_token(row["access_token"], row["ttl"])
+
+                data = await self._request()
+                if not data:
+                    return None
+                token = self._use(data)
+                if token:
+                    await conn.execute(
+                        SAVE_SHARED_TOKEN_SQL,
+                        SHARED_TOKEN_NAME,
+                        token,
+                        data.get("refresh_token"),
+                        float(data.get("expires_in", 3600)),
+                    )
+                return token
+
+    async def _request(self) -> Optional[Dict[str, Any]]:
+        creds = self._credentials()
+        if not creds:
+            print("Missing Spotify environment variables.")
+            return None
+
+        client_id, client_secret, refresh_token = creds
+        auth_header = f"{client_id}:{client_secret}".encode("utf-8")
+        auth_b64 = base64.b64encode(auth_header).decode()
+
+        try:
+            resp = await self.http.post(
+                SPOTIFY_TOKEN_URL,
+                data={
+                    "grant_type": "refresh_token",
+                    "refresh_token": refresh_token,
+                },
+                headers={
+                    "Authorization": f"Basic {auth_b64}",
+                    "Content-Type": "application/x-www-form-urlencoded",
+                },
+            )
+            if resp.status_code != 200:
+                print("Spotify token refresh failed:", resp.status_code, resp.text)
+                return None
+
+            return resp.json()
+        except Exception as e:
+            print("Spotify token error:", e)
+            return None
+
+    def _use(self, data: Dict[str, Any]) -> Optional[str]:
+        token = data.get("access_token")
+        if not token:
+            return None
+
+        # Spotify may rotate the refresh token; keep using the newest one.
+        if data.get("refresh_token"):
+            self._refresh_token_override = data["refresh_token"]
+
+        return self._set_token(token, float(data.get("expires_in", 3600)))
+
+    def _set_token(self, token: str, expires_in: float) -> str:
+        self._token = token
+        self._expires_at = time.monotonic() + max(expires_in - self.refresh_margin, 0.0)
+        return token
+
+    # --------------------------------------------------------
+    # BACKGROUND REFRESH
+    # --------------------------------------------------------
+
+    def start(self):
+        if self._background_task is None or self._background_task.done():
+            self._background_task = asyncio.ensure_future(self._refresh_loop())
+
+    async def stop(self):
+        if self._background_task:
+            self._background_task.cancel()
+            try:
+                await self._background_task
+            except asyncio.CancelledError:
+                pass
+            self._background_task = None
+
+    async def _refresh_loop(self):
+        while True:
+            token = await self.refresh()
+            if token:
+                delay = max(self._expires_at - time.monotonic(), 1.0)
+            else:
+                delay = self.retry_delay
+            await asyncio.sleep(delay)
@@ -0,0 +1,246 @@
+import time
+import heapq
+import asyncio
+import itertools
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+PRIORITY_PREFETCH = 2
+
+DEFAULT_DEADLINES = {
+    PRIORITY_INTERACTIVE: 10.0,
+    PRIORITY_BACKGROUND: 60.0,
+    PRIORITY_PREFETCH: 120.0,
+}
+
+
+class SpotifyUnavailable(Exception):
+    pass
+
+
+class _Request:
+    __slots__ = ("priority", "seq", "deadline", "fn", "future", "attempts")
+
+    def __init__(self, priority: int, seq: int, deadline: float,
+                 fn: Callable[[], Awaitable[Any]], future: asyncio.Future):
+        self.priority = priority
+        self.seq = seq
+        self.deadline = deadline
+        self.fn = fn
+        self.future = future
+        self.attempts = 0
+
+    def __lt__(self, other: "_Request") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+# ============================================================
+# SPOTIFY REQUEST SCHEDULER
+# ============================================================
+
+class SpotifyScheduler:
+    """Every Spotify API call goes through one queue.
+
+    - A token bucket (rate per second, burst) sets the steady request budget.
+    - A 429 pauses all traffic for its Retry-After, then the request is
+      retried if its deadline allows.
+    - Interactive requests are served before background refreshes and
+      prefetches.
+    - The queue is bounded. Requests whose deadline passes while queued are
+      shed instead of being sent late.
+    - After failure_threshold consecutive 5xx or transport errors the
+      circuit opens. Requests then fail fast until a single probe
+      succeeds after the cooldown."""
+
+    def __init__(self, rate: float = 10.0, burst: int = 20, max_concurrency: int = 10,
+                 max_queue: int = 200, max_retries: int = 2,
+                 failure_threshold: int = 5, cooldown: float = 30.0):
+        self.rate = rate
+        self.burst = burst
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+
+        self._heap: List[_Request] = []
+        self._seq = itertools.count()
+        self._tokens = float(burst)
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._has_work = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probe_in_flight = False
+
+        self.counters: Dict[str, int] = {
+            "sent": 0, "rate_limited": 0, "shed": 0, "rejected": 0, "errors": 0,
+        }
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._dispatch_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    @property
+    def circuit_state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.cooldown:
+            return "half-open"
+        return "open"
+
+    async def submit(self, fn: Callable[[], Awaitable[Any]],
+                     priority: int = PRIORITY_INTERACTIVE,
+                     timeout: Optional[float] = None) -> Any:
+        if self.circuit_state == "open":
+            self.counters["rejected"] += 1
+            raise SpotifyUnavailable("Spotify circuit is open")
+
+        if len(self._heap) >= self.max_queue and not self._shed_lowest(priority):
+            self.counters["rejected"] += 1
+            raise SpotifyUnavailable("Spotify request queue is full")
+
+        self.start()
+        loop = asyncio.get_running_loop()
+        deadline = time.monotonic() + (timeout or DEFAULT_DEADLINES.get(priority, 30.0))
+        request = _Request(priority, next(self._seq), deadline, fn, loop.create_future())
+        heapq.heappush(self._heap, request)
+        self._has_work.set()
+        return await request.future
+
+    def _shed_lowest(self, priority: int) -> bool:
+        # Make room by dropping the newest request of the worst priority,
+        # but only for a strictly more important newcomer.
+        worst = max(self._heap)
+        if worst.priority <= priority:
+            return False
+        self._heap.remove(worst)
+        heapq.heapify(self._heap)
+        self._fail(worst, SpotifyUnavailable("Shed for a higher-priority request"), "shed")
+        return True
+
+    def _fail(self, request: _Request, exc: Exception, counter: str):
+        self.counters[counter] += 1
+        if not request.future.done():
+            request.future.set_exception(exc)
+
+    def _refill_tokens(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+
+    def _pop_live(self) -> Optional[_Request]:
+        now = time.monotonic()
+        while self._heap:
+            request = heapq.heappop(self._heap)
+            if request.future.done():
+                continue
+            if request.deadline <= now:
+                self._fail(request, SpotifyUnavailable("Deadline passed while queued"), "shed")
+                continue
+            return request
+        return None
+
+    async def _dispatch_loop(self):
+        while True:
+            if not self._heap:
+                self._has_work.clear()
+                await self._has_work.wait()
+                continue
+
+            now = time.monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+
+            state = self.circuit_state
+            if state == "open" or (state == "half-open" and self._probe_in_flight):
+                await asyncio.sleep(0.25)
+                continue
+
+            self._refill_tokens()
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                continue
+
+            await self._slots.acquire()
+            request = self._pop_live()
+            if request is None:
+                self._slots.release()
+                continue
+
+            self._tokens -= 1
+            if state == "half-open":
+                self._probe_in_flight = True
+            asyncio.ensure_future(self._execute(request, probe=state == "half-open"))
+
+    async def _execute(self, request: _Request, probe: bool):
+        request.attempts += 1
+        self.counters["sent"] += 1
+        try:
+            resp = await request.fn()
+        except Exception as e:
+            self._record_failure()
+            self._fail(request, e, "errors")
+            return
+        finally:
+            self._slots.release()
+            if probe:
+                self._probe_in_flight = False
+
+        if resp is not None and resp.status_code == 429:
+            self.counters["rate_limited"] += 1
+            retry_after = self._retry_after(resp)
+            self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+            self._tokens = 0.0
+
+            if (request.attempts <= self.max_retries
+                    and time.monotonic() + retry_after < request.deadline):
+                heapq.heappush(self._heap, request)
+                self._has_work.set()
+                return
+        elif resp is not None and resp.status_code >= 500:
+            self._record_failure()
+        else:
+            self._record_success()
+
+        if not request.future.done():
+            request.future.set_result(resp)
+
+    @staticmethod
+    def _retry_after(resp: Any) -> float:
+        try:
+            return max(float(resp.headers.get("Retry-After", "1")), 0.0)
+        except (TypeError, ValueError):
+            return 1.0
+
+    def _record_failure(self):
+        self._failures += 1
+        if self._opened_at is not None or self._failures >= self.failure_threshold:
+            if self._opened_at is None:
+                print("Spotify circuit opened after", self._failures, "failures.")
+            self._opened_at = time.monotonic()
+
+    def _record_success(self):
+        self._failures = 0
+        self._opened_at = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.counters,
+            "queued": len(self._heap),
+            "circuit": self.circuit_state,
+            "paused_for": max(self._paused_until - time.monotonic(), 0.0),
+        }
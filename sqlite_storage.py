@@ -0,0 +1,586 @@
+import time
+import queue
+import asyncio
+import sqlite3
+import threading
+from datetime import date
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from storage import (
+    GLOBAL_SCOPE,
+    MYRATINGS_SORTS,
+    Song,
+    Storage,
+    StorageSession,
+    StoredView,
+    TrendingSong,
+    UserRating,
+)
+
+SONG_COLUMNS = "s.song_key, s.title, s.artist, s.spotify_url, s.apple_url, s.average, s.count, s.rating_sum"
+
+# Same layout as the Postgres schema. Timestamps are unix seconds.
+SQLITE_MIGRATIONS: List[Tuple[int, str, List[str]]] = [
+    (1, "base tables", [
+        """
+        CREATE TABLE IF NOT EXISTS songs (
+            song_key TEXT PRIMARY KEY,
+            title TEXT NOT NULL,
+            artist TEXT NOT NULL,
+            spotify_url TEXT NOT NULL,
+            apple_url TEXT,
+            average REAL NOT NULL DEFAULT 0,
+            count INTEGER NOT NULL DEFAULT 0,
+            rating_sum INTEGER NOT NULL DEFAULT 0
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS ratings (
+            song_key TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            rating INTEGER NOT NULL,
+            song_title TEXT NOT NULL DEFAULT '',
+            rated_at REAL NOT NULL,
+            PRIMARY KEY (song_key, user_id)
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS views (
+            message_id INTEGER PRIMARY KEY,
+            channel_id INTEGER NOT NULL,
+            song_key TEXT NOT NULL
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS apple_lookup_attempts (
+            song_key TEXT PRIMARY KEY,
+            misses INTEGER NOT NULL DEFAULT 1,
+            retry_after REAL NOT NULL
+        );
+        """,
+        "CREATE INDEX IF NOT EXISTS songs_leaderboard_idx ON songs (average DESC, count DESC) WHERE count > 0;",
+        "CREATE INDEX IF NOT EXISTS ratings_user_title_idx ON ratings (user_id, song_title, song_key);",
+        "CREATE INDEX IF NOT EXISTS ratings_user_rating_idx ON ratings (user_id, rating, song_key);",
+        "CREATE INDEX IF NOT EXISTS ratings_user_recent_idx ON ratings (user_id, rated_at, song_key);",
+    ]),
+    (2, "guilds and daily rating rollups", [
+        "ALTER TABLE ratings ADD COLUMN guild_id INTEGER;",
+        "ALTER TABLE views ADD COLUMN guild_id INTEGER;",
+        "ALTER TABLE views ADD COLUMN posted_at REAL NOT NULL DEFAULT 0;",
+        # day is 'YYYY-MM-DD' in UTC; guild_id 0 holds the totals.
+        """
+        CREATE TABLE IF NOT EXISTS rating_rollups (
+            guild_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            song_key TEXT NOT NULL,
+            rating_sum INTEGER NOT NULL DEFAULT 0,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (guild_id, day, song_key)
+        );
+        """,
+        # rated_at has no default here, so every row carries its real time.
+        # Ratings copied from Postgres bring theirs along, with legacy ones
+        # at the epoch (Postgres step 10), so they land on 1970-01-01.
+        """
+        INSERT OR IGNORE INTO rating_rollups (guild_id, day, song_key, rating_sum, count)
+        SELECT 0, date(rated_at, 'unixepoch'), song_key, SUM(rating), COUNT(*)
+        FROM ratings
+        GROUP BY 2, 3;
+        """,
+    ]),
+    # See Postgres step 11: nothing orders by (average, count) any more.
+    (3, "drop unused leaderboard index", [
+        "DROP INDEX IF EXISTS songs_leaderboard_idx;",
+    ]),
+]
+
+BUMP_ROLLUP_SQL = """
+    INSERT INTO rating_rollups (guild_id, day, song_key, rating_sum, count)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (guild_id, day, song_key)
+    DO UPDATE SET rating_sum = rating_sum + excluded.rating_sum,
+                  count = count + excluded.count;
+"""
+
+GET_SONG_SQL = f"""
+    SELECT {SONG_COLUMNS}, COALESCE(a.retry_after > ?, 0) AS apple_miss
+    FROM songs s
+    LEFT JOIN apple_lookup_attempts a ON a.song_key = s.song_key
+    WHERE s.song_key = ?;
+"""
+
+
+def run_sqlite_migrations(conn: sqlite3.Connection):
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for step, name, statements in SQLITE_MIGRATIONS:
+        if step <= version:
+            continue
+        # Explicit transaction: with isolation_level=None the sqlite3 module
+        # leaves every statement in autocommit, and a half-applied step
+        # could never be rerun. SQLite DDL rolls back like anything else.
+        conn.execute("BEGIN")
+        try:
+            for sql in statements:
+                conn.execute(sql)
+            conn.execute(f"PRAGMA user_version = {int(step)}")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        print(f"Applied SQLite migration {step}: {name}")
+
+
+def _utc_day(ts: float) -> str:
+    return time.strftime("%Y-%m-%d", time.gmtime(ts))
+
+
+def _bump_rollups(conn: sqlite3.Connection, guild_id: Optional[int], ts: float,
+                  song_key: str, d_sum: int, d_count: int):
+    day = _utc_day(ts)
+    conn.execute(BUMP_ROLLUP_SQL, (GLOBAL_SCOPE, day, song_key, d_sum, d_count))
+    if guild_id is not None:
+        conn.execute(BUMP_ROLLUP_SQL, (guild_id, day, song_key, d_sum, d_count))
+
+
+def _fetch_song(conn: sqlite3.Connection, song_key: str) -> Optional[Song]:
+    row = conn.execute(GET_SONG_SQL, (time.time(), song_key)).fetchone()
+    return Song.from_record(row) if row else None
+
+
+class _Write:
+    __slots__ = ("fn", "future", "loop")
+
+    def __init__(self, fn: Callable[[sqlite3.Connection], Any],
+                 future: asyncio.Future, loop: asyncio.AbstractEventLoop):
+        self.fn = fn
+        self.future = future
+        self.loop = loop
+
+
+# ============================================================
+# SQLITE STORAGE
+# ============================================================
+
+class SqliteStorage(Storage):
+    """Embedded storage in one SQLite file in WAL mode.
+
+    Reads run on a small thread pool, each thread with its own connection;
+    WAL lets them proceed while a write is in progress. Every write goes to
+    one writer thread, which drains whatever has queued up (up to
+    max_batch) and commits it as one transaction, each write in its own
+    savepoint so one failure doesn't undo its neighbours. A write's await
+    returns after its batch has committed."""
+
+    def __init__(self, path: str, readers: int = 4, max_batch: int = 256,
+                 commit_delay: float = 0.002):
+        self.path = path
+        self.readers = readers
+        self.max_batch = max_batch
+        self.commit_delay = commit_delay
+        self._writes: "queue.Queue[Optional[_Write]]" = queue.Queue()
+        self._writer: Optional[threading.Thread] = None
+        self._read_pool: Optional[ThreadPoolExecutor] = None
+        self._local = threading.local()
+        self._read_conns: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA busy_timeout = 5000")
+        conn.execute("PRAGMA foreign_keys = OFF")
+        return conn
+
+    async def open(self):
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        run_sqlite_migrations(conn)
+
+        self._writer = threading.Thread(
+            target=self._writer_loop, args=(conn,), name="sqlite-writer", daemon=True
+        )
+        self._writer.start()
+        self._read_pool = ThreadPoolExecutor(self.readers, thread_name_prefix="sqlite-read")
+
+    async def close(self):
+        if self._writer is not None:
+            self._writes.put(None)
+            await asyncio.get_running_loop().run_in_executor(None, self._writer.join)
+            self._writer = None
+        if self._read_pool is not None:
+            self._read_pool.shutdown(wait=True)
+            self._read_pool = None
+        with self._lock:
+            for conn in self._read_conns:
+                conn.close()
+            self._read_conns = []
+
+    def session(self) -> "_SqliteScope":
+        return _SqliteScope(self)
+
+    # --------------------------------------------------------
+    # READS
+    # --------------------------------------------------------
+
+    def _read_conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+            with self._lock:
+                self._read_conns.append(conn)
+        return conn
+
+    async def read(self, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._read_pool, lambda: fn(self._read_conn()))
+
+    # --------------------------------------------------------
+    # WRITES
+    # --------------------------------------------------------
+
+    async def write(self, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._writes.put(_Write(fn, future, loop))
+        return await future
+
+    def _writer_loop(self, conn: sqlite3.Connection):
+        while True:
+            first = self._writes.get()
+            if first is None:
+                conn.close()
+                return
+
+            # Give concurrent writers a moment to join this commit.
+            if self.commit_delay > 0 and self._writes.empty():
+                time.sleep(self.commit_delay)
+            batch = [first]
+            stop = False
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._writes.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+
+            results = self._run_batch(conn, batch)
+            for item, (ok, value) in zip(batch, results):
+                item.loop.call_soon_threadsafe(_settle, item.future, ok, value)
+
+            if stop:
+                conn.close()
+                return
+
+    @staticmethod
+    def _run_batch(conn: sqlite3.Connection, batch: List[_Write]) -> List[Tuple[bool, Any]]:
+        results: List[Tuple[bool, Any]] = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for item in batch:
+                conn.execute("SAVEPOINT write")
+                try:
+                    results.append((True, item.fn(conn)))
+                    conn.execute("RELEASE write")
+                except Exception as e:
+                    conn.execute("ROLLBACK TO write")
+                    conn.execute("RELEASE write")
+                    results.append((False, e))
+            conn.execute("COMMIT")
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            return [(False, e)] * len(batch)
+        return results
+
+
+def _settle(future: asyncio.Future, ok: bool, value: Any):
+    if future.done():
+        return
+    if ok:
+        future.set_result(value)
+    else:
+        future.set_exception(value)
+
+
+class _SqliteScope:
+    def __init__(self, storage: SqliteStorage):
+        self._storage = storage
+
+    async def __aenter__(self) -> "SqliteSession":
+        return SqliteSession(self._storage)
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+# ============================================================
+# QUERIES
+# ============================================================
+
+class SqliteSession(StorageSession):
+    def __init__(self, storage: SqliteStorage):
+        self.storage = storage
+
+    async def get_song(self, song_key: str) -> Optional[Song]:
+        try:
+            return await self.storage.read(lambda conn: _fetch_song(conn, song_key))
+        except Exception as e:
+            print("DB GET SONG ERROR:", e)
+            return None
+
+    async def get_or_create_song(self, song_key: str, title: str, artist: str,
+                                 spotify_url: str) -> Optional[Song]:
+        song = await self.get_song(song_key)
+        if song is not None:
+            return song
+
+        def create(conn: sqlite3.Connection) -> Optional[Song]:
+            conn.execute("""
+                INSERT INTO songs (song_key, title, artist, spotify_url)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (song_key) DO NOTHING;
+            """, (song_key, title, artist, spotify_url))
+            return _fetch_song(conn, song_key)
+
+        try:
+            return await self.storage.write(create)
+        except Exception as e:
+            print("DB GET OR CREATE SONG ERROR:", e)
+            return None
+
+    async def insert_songs(self, tracks: List[Dict[str, Any]]) -> List[str]:
+        records = list({
+            t["spotify_url"]: (t["spotify_url"], t["title"], t["artist"], t["spotify_url"])
+            for t in tracks
+        }.values())
+
+        def insert(conn: sqlite3.Connection) -> List[str]:
+            new_keys = []
+            for record in records:
+                cur = conn.execute("""
+                    INSERT INTO songs (song_key, title, artist, spotify_url)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT (song_key) DO NOTHING;
+                """, record)
+                if cur.rowcount == 1:
+                    new_keys.append(record[0])
+            return new_keys
+
+        return await self.storage.write(insert)
+
+    async def set_apple_url(self, song_key: str, apple_url: str) -> Optional[Song]:
+        def update(conn: sqlite3.Connection) -> Optional[Song]:
+            conn.execute("DELETE FROM apple_lookup_attempts WHERE song_key = ?", (song_key,))
+            conn.execute(
+                "UPDATE songs SET apple_url = COALESCE(apple_url, ?) WHERE song_key = ?",
+                (apple_url, song_key),
+            )
+            return _fetch_song(conn, song_key)
+
+        try:
+            return await self.storage.write(update)
+        except Exception as e:
+            print("DB SET APPLE URL ERROR:", e)
+            return None
+
+    async def record_apple_miss(self, song_key: str, ttl_seconds: float) -> Optional[Song]:
+        def record(conn: sqlite3.Connection) -> Optional[Song]:
+            conn.execute("""
+                INSERT INTO apple_lookup_attempts (song_key, misses, retry_after)
+                VALUES (?, 1, ?)
+                ON CONFLICT (song_key)
+                DO UPDATE SET misses = misses + 1, retry_after = excluded.retry_after;
+            """, (song_key, time.time() + ttl_seconds))
+            return _fetch_song(conn, song_key)
+
+        try:
+            return await self.storage.write(record)
+        except Exception as e:
+            print("DB RECORD APPLE MISS ERROR:", e)
+            return None
+
+    @staticmethod
+    def _apply(conn: sqlite3.Connection, song_key: str, user_id: str,
+               rating: int, guild_id: Optional[int], now: float) -> Optional[Song]:
+        # Writes are serialized on one thread, so no row locks are needed.
+        song = conn.execute("SELECT title FROM songs WHERE song_key = ?", (song_key,)).fetchone()
+        if song is None:
+            return None
+
+        prev = conn.execute(
+            "SELECT rating, guild_id, rated_at FROM ratings WHERE song_key = ? AND user_id = ?",
+            (song_key, user_id),
+        ).fetchone()
+        conn.execute("""
+            INSERT INTO ratings (song_key, user_id, rating, song_title, rated_at, guild_id)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (song_key, user_id)
+            DO UPDATE SET rating = excluded.rating, rated_at = excluded.rated_at,
+                          guild_id = excluded.guild_id;
+        """, (song_key, user_id, rating, song["title"], now, guild_id))
+
+        # Same rollup bookkeeping as the Postgres backend: the replaced
+        # rating leaves the day and guild it was made in.
+        if prev:
+            _bump_rollups(conn, prev["guild_id"], prev["rated_at"], song_key, -prev["rating"], -1)
+        _bump_rollups(conn, guild_id, now, song_key, rating, 1)
+
+        d_sum = rating - (prev["rating"] if prev else 0)
+        d_count = 0 if prev else 1
+        conn.execute("""
+            UPDATE songs
+            SET rating_sum = rating_sum + ?,
+                count = count + ?,
+                average = CAST(rating_sum + ? AS REAL) / (count + ?)
+            WHERE song_key = ?;
+        """, (d_sum, d_count, d_sum, d_count, song_key))
+        return _fetch_song(conn, song_key)
+
+    async def apply_rating(self, song_key: str, user_id: str, rating: int,
+                           guild_id: Optional[int] = None) -> Optional[Song]:
+        try:
+            return await self.storage.write(
+                lambda conn: self._apply(conn, song_key, user_id, rating, guild_id, time.time())
+            )
+        except Exception as e:
+            print("DB APPLY RATING ERROR:", e)
+            return None
+
+    async def apply_ratings(self, rows: List[Tuple[str, str, int, Optional[int]]]) -> Dict[str, Song]:
+        def apply_all(conn: sqlite3.Connection) -> Dict[str, Song]:
+            now = time.time()
+            songs = {}
+            for song_key, user_id, rating, guild_id in rows:
+                song = self._apply(conn, song_key, user_id, rating, guild_id, now)
+                if song is not None:
+                    songs[song_key] = song
+            return songs
+
+        return await self.storage.write(apply_all)
+
+    async def user_ratings_page(self, user_id: str, sort: str,
+                                cursor: Optional[Tuple[Any, str]],
+                                backward: bool, limit: int) -> Tuple[List[UserRating], bool]:
+        column, direction = MYRATINGS_SORTS[sort]
+        if backward:
+            direction = "DESC" if direction == "ASC" else "ASC"
+        op = ">" if direction == "ASC" else "<"
+
+        args: List[Any] = [user_id]
+        keyset = ""
+        if cursor is not None:
+            keyset = f"AND ({column}, r.song_key) {op} (?, ?)"
+            args.extend(cursor)
+        args.append(limit + 1)
+
+        sql = f"""
+            SELECT s.title, s.artist, s.spotify_url, s.average, s.count,
+                   r.rating, r.song_key, {column} AS sort_value
+            FROM ratings r
+            JOIN songs s ON s.song_key = r.song_key
+            WHERE r.user_id = ? {keyset}
+            ORDER BY {column} {direction}, r.song_key {direction}
+            LIMIT ?;
+        """
+        rows = await self.storage.read(lambda conn: conn.execute(sql, args).fetchall())
+
+        has_more = len(rows) > limit
+        page = [UserRating(**dict(row)) for row in rows[:limit]]
+        if backward:
+            page.reverse()
+        return page, has_more
+
+    async def top_songs(self, limit: int, score_sql: str) -> List[Song]:
+        sql = f"""
+            SELECT {SONG_COLUMNS}
+            FROM songs s
+            WHERE count > 0
+            ORDER BY {score_sql} DESC, count DESC
+            LIMIT ?;
+        """
+        try:
+            rows = await self.storage.read(lambda conn: conn.execute(sql, (limit,)).fetchall())
+        except Exception as e:
+            print("DB GET TOP SONGS ERROR:", e)
+            return []
+        return [Song.from_record(row) for row in rows]
+
+    async def rated_songs(self) -> List[Song]:
+        rows = await self.storage.read(lambda conn: conn.execute(
+            f"SELECT {SONG_COLUMNS} FROM songs s WHERE count > 0;"
+        ).fetchall())
+        return [Song.from_record(row) for row in rows]
+
+    async def all_ratings(self) -> List[Tuple[str, str, int]]:
+        rows = await self.storage.read(lambda conn: conn.execute(
+            "SELECT song_key, user_id, rating FROM ratings;"
+        ).fetchall())
+        return [tuple(row) for row in rows]
+
+    async def trending_songs(self, scope: int, since: date, limit: int,
+                             score_sql: str) -> List[TrendingSong]:
+        sql = f"""
+            SELECT s.song_key, s.title, s.artist, s.spotify_url, t.rating_sum, t.count
+            FROM (
+                SELECT song_key, SUM(rating_sum) AS rating_sum, SUM(count) AS count
+                FROM rating_rollups
+                WHERE guild_id = ? AND day >= ?
+                GROUP BY song_key
+                HAVING SUM(count) > 0
+            ) t
+            JOIN songs s ON s.song_key = t.song_key
+            ORDER BY {score_sql} DESC, t.count DESC
+            LIMIT ?;
+        """
+        try:
+            rows = await self.storage.read(
+                lambda conn: conn.execute(sql, (scope, since.isoformat(), limit)).fetchall()
+            )
+        except Exception as e:
+            print("DB GET TRENDING ERROR:", e)
+            return []
+        return [TrendingSong(**dict(row)) for row in rows]
+
+    async def add_views(self, views: List[Tuple[int, int, str, Optional[int], float]]):
+        await self.storage.write(lambda conn: conn.executemany("""
+            INSERT OR IGNORE INTO views (channel_id, message_id, song_key, guild_id, posted_at)
+            VALUES (?, ?, ?, ?, ?)
+        """, views))
+
+    async def views_page(self, after_message_id: int, limit: int,
+                         shard_count: Optional[int] = None,
+                         shard_ids: Optional[List[int]] = None) -> List[StoredView]:
+        shard_filter = ""
+        params: List[Any] = [after_message_id]
+        if shard_count:
+            ids = shard_ids or [-1]
+            shard_filter = (
+                f"AND (COALESCE(guild_id, 0) >> 22) % ? IN ({', '.join('?' * len(ids))})"
+            )
+            params += [shard_count, *ids]
+        params.append(limit)
+        try:
+            rows = await self.storage.read(lambda conn: conn.execute(f"""
+                SELECT channel_id, message_id
+                FROM views
+                WHERE message_id > ? {shard_filter}
+                ORDER BY message_id
+                LIMIT ?;
+            """, params).fetchall())
+        except Exception as e:
+            print("DB GET VIEWS ERROR:", e)
+            return []
+        return [StoredView(row["channel_id"], row["message_id"]) for row in rows]
+
+    async def delete_views(self, message_ids: List[int]):
+        try:
+            await self.storage.write(lambda conn: conn.executemany(
+                "DELETE FROM views WHERE message_id = ?", [(m,) for m in message_ids]
+            ))
+        except Exception as e:
+            print("DB DELETE VIEWS ERROR:", e)
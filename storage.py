@@ -0,0 +1,220 @@
+import time
+import asyncio
+from datetime import date
+from dataclasses import dataclass
+from typing import Any, AsyncContextManager, Dict, List, Optional, Tuple
+
+
+# ============================================================
+# RESULT TYPES
+# ============================================================
+
+@dataclass
+class Song:
+    song_key: str
+    title: str
+    artist: str
+    spotify_url: str
+    apple_url: Optional[str]
+    average: float
+    count: int
+    rating_sum: int
+    # An Apple Music lookup found nothing recently; don't scrape again yet.
+    apple_miss: bool = False
+
+    @classmethod
+    def from_record(cls, row: Any) -> "Song":
+        return cls(
+            song_key=row["song_key"],
+            title=row["title"],
+            artist=row["artist"],
+            spotify_url=row["spotify_url"],
+            apple_url=row["apple_url"],
+            average=float(row["average"] or 0.0),
+            count=int(row["count"] or 0),
+            rating_sum=int(row["rating_sum"]),
+            apple_miss=bool(row["apple_miss"]) if "apple_miss" in row.keys() else False,
+        )
+
+
+@dataclass
+class UserRating:
+    song_key: str
+    title: str
+    artist: str
+    spotify_url: str
+    average: float
+    count: int
+    rating: int
+    sort_value: Any
+
+
+@dataclass
+class StoredView:
+    channel_id: int
+    message_id: int
+
+
+@dataclass
+class TrendingSong:
+    song_key: str
+    title: str
+    artist: str
+    spotify_url: str
+    rating_sum: int
+    count: int
+
+
+# rating_rollups.guild_id of the rows that count ratings from every guild
+# (and from DMs). Discord snowflakes are never 0.
+GLOBAL_SCOPE = 0
+
+
+# sort name -> (keyset column, direction); song_key breaks ties.
+MYRATINGS_SORTS = {
+    "title": ("r.song_title", "ASC"),
+    "rating": ("r.rating", "DESC"),
+    "recent": ("r.rated_at", "DESC"),
+}
+
+
+# ============================================================
+# STORAGE INTERFACE
+# ============================================================
+# Implemented by PostgresStorage (pg_storage.py) and SqliteStorage
+# (sqlite_storage.py); STORAGE_BACKEND picks one at startup.
+
+class StorageSession:
+    """The queries one interaction makes. Methods that swallowed errors
+    before (printing them and returning None or []) still do."""
+
+    async def get_song(self, song_key: str) -> Optional[Song]:
+        raise NotImplementedError
+
+    async def get_or_create_song(self, song_key: str, title: str, artist: str,
+                                 spotify_url: str) -> Optional[Song]:
+        raise NotImplementedError
+
+    async def insert_songs(self, tracks: List[Dict[str, Any]]) -> List[str]:
+        """Insert tracks that aren't stored yet; return the new song keys."""
+        raise NotImplementedError
+
+    async def set_apple_url(self, song_key: str, apple_url: str) -> Optional[Song]:
+        raise NotImplementedError
+
+    async def record_apple_miss(self, song_key: str, ttl_seconds: float) -> Optional[Song]:
+        raise NotImplementedError
+
+    async def apply_rating(self, song_key: str, user_id: str, rating: int,
+                           guild_id: Optional[int] = None) -> Optional[Song]:
+        raise NotImplementedError
+
+    async def apply_ratings(self, rows: List[Tuple[str, str, int, Optional[int]]]) -> Dict[str, Song]:
+        """Rows are (song_key, user_id, rating, guild_id). Ratings also
+        update the per-day rollups for their guild and GLOBAL_SCOPE."""
+        raise NotImplementedError
+
+    async def user_ratings_page(self, user_id: str, sort: str,
+                                cursor: Optional[Tuple[Any, str]],
+                                backward: bool, limit: int) -> Tuple[List[UserRating], bool]:
+        raise NotImplementedError
+
+    async def top_songs(self, limit: int, score_sql: str) -> List[Song]:
+        raise NotImplementedError
+
+    async def rated_songs(self) -> List[Song]:
+        raise NotImplementedError
+
+    async def all_ratings(self) -> List[Tuple[str, str, int]]:
+        """Every (song_key, user_id, rating) row."""
+        raise NotImplementedError
+
+    async def trending_songs(self, scope: int, since: date, limit: int,
+                             score_sql: str) -> List[TrendingSong]:
+        """Songs by their ratings from day `since` (UTC) onwards, read from
+        the daily rollups of one guild or of GLOBAL_SCOPE."""
+        raise NotImplementedError
+
+    async def add_views(self, views: List[Tuple[int, int, str, Optional[int], float]]):
+        """Rows are (channel_id, message_id, song_key, guild_id, posted_at)."""
+        raise NotImplementedError
+
+    async def views_page(self, after_message_id: int, limit: int,
+                         shard_count: Optional[int] = None,
+                         shard_ids: Optional[List[int]] = None) -> List[StoredView]:
+        """With shard_count, only views in guilds on one of shard_ids.
+        Views without a guild count as shard 0, where Discord puts DMs."""
+        raise NotImplementedError
+
+    async def delete_views(self, message_ids: List[int]):
+        raise NotImplementedError
+
+
+class Storage:
+    async def open(self):
+        pass
+
+    async def close(self):
+        pass
+
+    def session(self) -> AsyncContextManager[StorageSession]:
+        raise NotImplementedError
+
+
+# ============================================================
+# BATCHED VIEW WRITES
+# ============================================================
+
+class ViewWriter:
+    """Collects posted rating messages and stores them in one multi-row
+    insert per flush, so posting a song costs no database call of its own.
+    The rows only feed the deleted-message sweep, so a few lost on a crash
+    are harmless."""
+
+    def __init__(self, database: "Storage", flush_interval: float = 1.0,
+                 max_batch: int = 500):
+        self.database = database
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._pending: List[Tuple[int, int, str, Optional[int], float]] = []
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._flush_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def add(self, channel_id: int, message_id: int, song_key: str,
+            guild_id: Optional[int] = None):
+        self._pending.append((channel_id, message_id, song_key, guild_id, time.time()))
+        if len(self._pending) >= self.max_batch:
+            self._wakeup.set()
+
+    async def flush(self):
+        while self._pending:
+            batch = self._pending[:self.max_batch]
+            del self._pending[:self.max_batch]
+            try:
+                async with self.database.session() as db:
+                    await db.add_views(batch)
+            except Exception as e:
+                print("DB ADD VIEWS ERROR:", e)
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
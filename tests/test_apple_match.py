@@ -0,0 +1,34 @@
+import unittest
+
+from apple_match import AppleCandidateScanner
+
+PAGE = """
+<li><a href="https://music.apple.com/us/song/yesterday/111">Yesterday</a>
+<p>Yesterday - Song by Some Cover Band - Apple Music</p></li>
+<li><a href="https://music.apple.com/us/song/yesterday/222">Yesterday</a>
+<p>Yesterday - Song by The Beatles - Apple Music</p></li>
+"""
+
+
+def scan(title: str, artist: str, page: str = PAGE) -> AppleCandidateScanner:
+    scanner = AppleCandidateScanner(title, artist)
+    scanner.feed(page)
+    scanner.finish()
+    return scanner
+
+
+class AppleCandidateScannerTest(unittest.TestCase):
+    def test_picks_the_matching_artist(self):
+        self.assertEqual(scan("Yesterday", "The Beatles").best(),
+                         "https://music.apple.com/us/song/yesterday/222")
+
+    def test_rejects_same_title_by_another_artist(self):
+        page = PAGE.split("<li>", 2)[1]
+        self.assertIsNone(scan("Yesterday", "The Beatles", "<li>" + page).best())
+
+    def test_artist_without_latin_words_matches_on_title(self):
+        self.assertIsNotNone(scan("Yesterday", "米津玄師").best())
+
+
+if __name__ == "__main__":
+    unittest.main()